@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module paces page loads adaptively, instead of with a fixed
+interval. A ScholarAdaptiveController shared by the queriers limits the
+number of page loads in flight and the interval between their starts,
+and adjusts both AIMD-style (additive increase, multiplicative
+decrease): while pages load quickly and without challenges, the limit
+creeps up and the interval down; challenge pages, bursts of errors and
+slow pages cut the limit and stretch the interval right away. Both stay
+within the bounds the operator sets.
+"""
+import collections
+import threading
+import time
+from utils import ScholarUtils
+
+
+class ScholarAdaptiveController(object):
+
+    """
+    Call before_request() before loading a page and record() with the
+    load's latency and outcome (OK, ERROR or CHALLENGE) afterwards. The
+    limit on concurrent loads grows by one per limit successful loads
+    and halves on a challenge; the interval shrinks by interval_step per
+    successful load and doubles on a challenge. When the error rate over
+    the last window loads reaches error_threshold, or the average
+    latency exceeds target_latency, both are cut by a quarter, at most
+    once per window loads. metrics() returns the current state, the
+    counters and the recent decisions.
+    """
+    OK = 'ok'
+    ERROR = 'error'
+    CHALLENGE = 'challenge'
+
+    def __init__(self, min_concurrency=1, max_concurrency=1,
+                 min_interval=0.5, max_interval=60.0, interval=1.0,
+                 interval_step=0.05, target_latency=5.0, window=20,
+                 error_threshold=0.2):
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(min_concurrency, max_concurrency)
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.interval_step = interval_step
+        self.target_latency = target_latency
+        self.error_threshold = error_threshold
+        self.window = window
+        self.limit = float(self.min_concurrency)
+        self.interval = min(max(interval, min_interval), self.max_interval)
+        self.latency = None  # Moving average of successful loads
+        self.in_flight = 0
+        self.stats = {'requests': 0, 'errors': 0, 'challenges': 0,
+                      'increases': 0, 'decreases': 0, 'wait_seconds': 0.0}
+        self.decisions = collections.deque(maxlen=50)
+        self._outcomes = collections.deque(maxlen=window)
+        self._since_decrease = 0
+        self._next_start = 0.0
+        self._cond = threading.Condition()
+
+    def before_request(self):
+        """
+        Waits until a page load may start: fewer than limit loads are in
+        flight, and the interval since the previous start has passed.
+        """
+        start = time.time()
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+            now = time.time()
+            wait = max(0.0, self._next_start - now)
+            self._next_start = max(now, self._next_start) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+        with self._cond:
+            self.stats['requests'] += 1
+            self.stats['wait_seconds'] += time.time() - start
+
+    def record(self, latency, outcome):
+        """Records how a page load went and adapts limit and interval."""
+        with self._cond:
+            self.in_flight -= 1
+            self._outcomes.append(outcome)
+            self._since_decrease += 1
+            if outcome == self.CHALLENGE:
+                self.stats['challenges'] += 1
+                self._decrease(0.5, 'challenge page')
+            elif outcome == self.ERROR:
+                self.stats['errors'] += 1
+                errors = self._outcomes.count(self.ERROR)
+                if len(self._outcomes) >= self.window // 2 and \
+                   errors >= self.error_threshold * len(self._outcomes):
+                    self._decrease(0.75, 'error rate %.2f' %
+                                   (float(errors) / len(self._outcomes)),
+                                   once_per_window=True)
+            else:
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency = 0.8 * self.latency + 0.2 * latency
+                if self.latency > self.target_latency:
+                    self._decrease(0.75, 'latency %.1fs' % self.latency,
+                                   once_per_window=True)
+                else:
+                    self._increase()
+            self._cond.notify_all()
+
+    def metrics(self):
+        """Returns the controller's state, counters and recent decisions."""
+        with self._cond:
+            res = dict(self.stats)
+            res.update({'limit': int(self.limit), 'interval': self.interval,
+                        'in_flight': self.in_flight, 'latency': self.latency,
+                        'decisions': list(self.decisions)})
+        return res
+
+    def _increase(self):
+        old_limit = int(self.limit)
+        self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+        self.interval = max(self.min_interval,
+                            self.interval - self.interval_step)
+        if int(self.limit) > old_limit:
+            self.stats['increases'] += 1
+            self._decide('pages load fine')
+
+    def _decrease(self, factor, reason, once_per_window=False):
+        if once_per_window and self._since_decrease < self.window:
+            return
+        self._since_decrease = 0
+        self.limit = max(self.min_concurrency, self.limit * factor)
+        self.interval = min(self.max_interval,
+                            max(self.interval / factor, self.interval_step))
+        self.stats['decreases'] += 1
+        self._decide(reason)
+
+    def _decide(self, reason):
+        self.decisions.append({'time': time.time(), 'reason': reason,
+                               'limit': int(self.limit),
+                               'interval': round(self.interval, 3)})
+        ScholarUtils.log('info', 'pacing: %s, %d concurrent loads, %.2fs '
+                         'apart' % (reason, int(self.limit), self.interval))
@@ -0,0 +1,271 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module computes corpus statistics over harvested results with
+NumPy: citation distributions, h-index style metrics, per-year counts
+and top venues. The articles of --json result files (res.json or the
+per-URL files) are loaded into flat arrays once; with a cache
+directory the arrays are stored as .npy files and memory-mapped on
+later runs, as long as the result files did not change. All statistics
+are vectorized over the arrays.
+
+Run it directly for a report:
+
+  analytics.py --cache ../analytics ../results/*.json
+"""
+import json
+import optparse
+import os
+import re
+import sys
+from utils import encode
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The arrays of a corpus and their types. Missing values are 0, except
+# for venues, where they are -1.
+_COLUMNS = (('num_citations', 'int32'), ('num_versions', 'int32'),
+            ('year', 'int16'), ('cluster_id', 'uint64'), ('venue', 'int32'))
+
+# The year at the end of the venue part of an authors line.
+_YEAR_RE = re.compile(r'(^|,)\s*\d{4}\s*$')
+
+
+def venue_of(authors):
+    """
+    Returns the venue part of an authors line as parsed from a results
+    page, e.g. 'Physical Review' for 'A Einstein, B Podolsky - Physical
+    Review, 1935 - APS', or None.
+    """
+    if not authors or ' - ' not in authors:
+        return None
+    # The line reads "authors - venue, year - publisher", where the
+    # venue or the year may be missing.
+    venue = _YEAR_RE.sub('', authors.split(' - ')[1]).strip(' ,.-')
+    return venue or None
+
+
+def _as_int(val):
+    try:
+        return int(val or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class ScholarCorpus(object):
+
+    """
+    The articles of a set of result files as NumPy arrays, one entry per
+    article: num_citations, num_versions, year, cluster_id and venue (an
+    index into the venues list). Use from_files() to build one.
+    """
+
+    def __init__(self, arrays, venues):
+        if numpy is None:
+            raise ImportError('analytics needs the numpy module')
+        self.num_citations = arrays['num_citations']
+        self.num_versions = arrays['num_versions']
+        self.year = arrays['year']
+        self.cluster_id = arrays['cluster_id']
+        self.venue = arrays['venue']
+        self.venues = venues
+
+    def __len__(self):
+        return len(self.num_citations)
+
+    @classmethod
+    def from_files(cls, file_names, cache_dir=None):
+        """
+        Loads the articles of --json result files. With a cache
+        directory, arrays cached for the same files are memory-mapped
+        instead, and freshly loaded ones are cached.
+        """
+        if numpy is None:
+            raise ImportError('analytics needs the numpy module')
+        sources = sorted([(name, os.path.getsize(name),
+                           os.path.getmtime(name)) for name in file_names])
+        meta_file = None
+        if cache_dir is not None:
+            meta_file = os.path.join(cache_dir, 'meta.json')
+            try:
+                with open(meta_file) as data_file:
+                    meta = json.load(data_file)
+                if [tuple(src) for src in meta['sources']] == sources:
+                    arrays = dict((name, numpy.load(
+                        os.path.join(cache_dir, name + '.npy'), mmap_mode='r'))
+                        for name, _ in _COLUMNS)
+                    return cls(arrays, meta['venues'])
+            except (IOError, ValueError, KeyError):
+                pass
+
+        columns = dict((name, []) for name, _ in _COLUMNS)
+        venues = []
+        venue_codes = {}
+        for name, _, _ in sources:
+            with open(name) as data_file:
+                records = json.load(data_file)
+            for rec in records:
+                columns['num_citations'].append(_as_int(rec.get('num_citations')))
+                columns['num_versions'].append(_as_int(rec.get('num_versions')))
+                columns['year'].append(_as_int(rec.get('year')))
+                columns['cluster_id'].append(_as_int(rec.get('cluster_id')))
+                venue = venue_of(rec.get('authors'))
+                if venue is None:
+                    columns['venue'].append(-1)
+                    continue
+                if venue not in venue_codes:
+                    venue_codes[venue] = len(venues)
+                    venues.append(venue)
+                columns['venue'].append(venue_codes[venue])
+        arrays = dict((name, numpy.array(columns[name], dtype=dtype))
+                      for name, dtype in _COLUMNS)
+
+        if cache_dir is not None:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            for name, _ in _COLUMNS:
+                numpy.save(os.path.join(cache_dir, name + '.npy'), arrays[name])
+            with open(meta_file + '.tmp', 'w') as data_file:
+                json.dump({'sources': sources, 'venues': venues}, data_file)
+            os.rename(meta_file + '.tmp', meta_file)
+        return cls(arrays, venues)
+
+    def unique(self):
+        """
+        Returns a corpus with one article per cluster ID (the first one
+        seen); articles without a cluster ID are all kept.
+        """
+        known = numpy.nonzero(self.cluster_id)[0]
+        _, first = numpy.unique(self.cluster_id[known], return_index=True)
+        keep = numpy.sort(numpy.concatenate(
+            [known[first], numpy.nonzero(self.cluster_id == 0)[0]]))
+        arrays = dict((name, numpy.asarray(getattr(self, name))[keep])
+                      for name, _ in _COLUMNS)
+        return ScholarCorpus(arrays, self.venues)
+
+    def h_index(self):
+        """Returns the largest h with h articles cited at least h times."""
+        cites = numpy.sort(self.num_citations)[::-1]
+        return int(numpy.count_nonzero(cites >= numpy.arange(1, len(cites) + 1)))
+
+    def g_index(self):
+        """
+        Returns the largest g whose g most cited articles have at least
+        g squared citations together.
+        """
+        cites = numpy.cumsum(numpy.sort(self.num_citations)[::-1],
+                             dtype='int64')
+        ranks = numpy.arange(1, len(cites) + 1, dtype='int64')
+        return int(numpy.count_nonzero(cites >= ranks ** 2))
+
+    def citation_summary(self):
+        """Returns totals and percentiles of the citation counts."""
+        cites = numpy.asarray(self.num_citations)
+        if len(cites) == 0:
+            return {'articles': 0}
+        pct = numpy.percentile(cites, [25, 50, 75, 90, 99])
+        return {'articles': len(cites), 'total': int(cites.sum(dtype='int64')),
+                'mean': float(cites.mean()), 'max': int(cites.max()),
+                'uncited': int(numpy.count_nonzero(cites == 0)),
+                'p25': float(pct[0]), 'median': float(pct[1]),
+                'p75': float(pct[2]), 'p90': float(pct[3]),
+                'p99': float(pct[4])}
+
+    def citation_histogram(self):
+        """
+        Returns (bucket lower bound, number of articles) pairs for the
+        citation counts in powers of two: 0, 1, 2-3, 4-7, ...
+        """
+        cites = numpy.asarray(self.num_citations)
+        buckets = numpy.zeros(len(cites), dtype='int64')
+        cited = cites > 0
+        buckets[cited] = numpy.floor(numpy.log2(cites[cited])).astype('int64') + 1
+        counts = numpy.bincount(buckets)
+        return [(0 if idx == 0 else 2 ** (idx - 1), int(num))
+                for idx, num in enumerate(counts) if num]
+
+    def per_year(self):
+        """Returns (year, articles, citations) for every year with articles."""
+        years = numpy.asarray(self.year)
+        dated = years > 0
+        if not dated.any():
+            return []
+        first = int(years[dated].min())
+        offsets = years[dated].astype('int64') - first
+        counts = numpy.bincount(offsets)
+        cites = numpy.bincount(offsets, weights=numpy.asarray(
+            self.num_citations)[dated])
+        return [(first + int(idx), int(counts[idx]), int(cites[idx]))
+                for idx in numpy.nonzero(counts)[0]]
+
+    def top_venues(self, num=10):
+        """Returns (venue, articles, citations) of the num largest venues."""
+        venues = numpy.asarray(self.venue)
+        known = venues >= 0
+        if not known.any():
+            return []
+        counts = numpy.bincount(venues[known], minlength=len(self.venues))
+        cites = numpy.bincount(venues[known], minlength=len(self.venues),
+                               weights=numpy.asarray(self.num_citations)[known])
+        order = numpy.lexsort((-cites, -counts))[:num]
+        return [(self.venues[idx], int(counts[idx]), int(cites[idx]))
+                for idx in order if counts[idx]]
+
+
+def main():
+    usage = 'analytics.py [options] <results.json> ...\n' \
+        'Reports corpus statistics over --json result files.'
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--cache', metavar='DIR', default=None,
+                      help='Directory to cache the loaded arrays in, memory-mapped on later runs')
+    parser.add_option('--unique', action='store_true', default=False,
+                      help='Count every cluster ID only once')
+    parser.add_option('--top', type='int', default=10,
+                      help='Number of venues to list (default: 10)')
+    parser.add_option('--json', action='store_true', default=False,
+                      help='Print the report as JSON')
+    options, args = parser.parse_args()
+    if not args:
+        parser.print_help()
+        return 1
+    if numpy is None:
+        print('analytics.py needs the numpy module, sorry...')
+        return 1
+
+    corpus = ScholarCorpus.from_files(args, cache_dir=options.cache)
+    if options.unique:
+        corpus = corpus.unique()
+    report = {'citations': corpus.citation_summary(),
+              'h_index': corpus.h_index(), 'g_index': corpus.g_index(),
+              'histogram': corpus.citation_histogram(),
+              'per_year': corpus.per_year(),
+              'top_venues': corpus.top_venues(options.top)}
+    if options.json:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return 0
+
+    summary = report['citations']
+    print('%d articles' % summary['articles'])
+    if summary['articles']:
+        print('citations: %(total)d total, %(mean).1f mean, %(median).0f '
+              'median, %(p90).0f p90, %(max)d max, %(uncited)d uncited'
+              % summary)
+    print('h-index %d, g-index %d' % (report['h_index'], report['g_index']))
+    print('\ncitations   articles')
+    for low, num in report['histogram']:
+        label = '%d' % low if low < 2 else '%d-%d' % (low, 2 * low - 1)
+        print('%-11s %8d' % (label, num))
+    print('\nyear  articles  citations')
+    for year, num, cites in report['per_year']:
+        print('%4d  %8d  %9d' % (year, num, cites))
+    print('\narticles  citations  venue')
+    for venue, num, cites in report['top_venues']:
+        print('%8d  %9d  %s' % (num, cites, encode(venue)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,430 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module provides an append-only archive of fetched pages, so data
+can be re-extracted after parser changes without fetching anything
+again. Pages are compressed one by one (zstd if the zstandard module is
+available, zlib otherwise) and appended to segment files. A memory-mapped
+hash table keyed by URL hash finds the latest fetch of any URL in
+constant time, and a sequential scan of the segments yields every
+fetch for bulk re-parsing.
+
+The archive is a directory:
+
+  index.dat        hash table of URL hash -> latest fetch
+  lock             locked with fcntl while the archive is read or written
+  seg-00000.dat    records: header, URL, compressed HTML
+  seg-00001.dat    ...
+
+Several processes, e.g. work queue workers, may write to one archive:
+writers take the lock file exclusively, readers shared, and each picks
+up what the others wrote before going on.
+
+Run it directly to inspect an archive or re-parse its results pages:
+
+  archive.py ../archive --stats
+  archive.py ../archive --get "http://scholar.google.com/scholar?cites=..."
+  archive.py ../archive --reparse articles.jsonl
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import mmap
+import optparse
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from replay import page_key
+from utils import encode
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    unicode
+except NameError:  # Python 3
+    unicode = str
+
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+
+# Segment record header: magic, codec, URL length, fetch time, data length.
+_RECORD = struct.Struct('<4sBIdI')
+_RECORD_MAGIC = b'SPR1'
+
+# Index header: magic, capacity, number of used slots.
+_INDEX_HEADER = struct.Struct('<4sQQ')
+_INDEX_MAGIC = b'SPI1'
+
+# Index slot: URL hash (0 means empty), fetch time, segment, offset and
+# length of the segment record.
+_SLOT = struct.Struct('<QdIQI')
+
+
+def url_hash(url):
+    """Returns the nonzero 64-bit hash the archive files a URL under."""
+    key = page_key(url)
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    res = struct.unpack('<Q', hashlib.sha1(key).digest()[:8])[0]
+    return res or 1
+
+
+@contextlib.contextmanager
+def _flocked(lock_file, mode):
+    fcntl.flock(lock_file, mode)
+    try:
+        yield
+    finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class ScholarPageArchive(object):
+
+    """
+    An append-only, compressed archive of pages in a directory. Use
+    add() to archive a fetched page, get() to look up the latest fetch
+    of a URL, and scan() to iterate over all fetches. The archive also
+    works as the recording of a replay.ReplayDriver.
+    """
+
+    def __init__(self, directory, compression=None,
+                 segment_size=1 << 30, initial_capacity=1 << 16):
+        if compression is None:
+            compression = 'zstd' if zstandard is not None else 'zlib'
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstd compression needs the zstandard module')
+        self.directory = directory
+        self.codec = CODEC_ZSTD if compression == 'zstd' else CODEC_ZLIB
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        self._segments = {}
+        self._writer = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock_file = open(os.path.join(directory, 'lock'), 'a')
+
+        self._index_file = os.path.join(directory, 'index.dat')
+        with _flocked(self._lock_file, fcntl.LOCK_EX):
+            if not os.path.exists(self._index_file):
+                self._create_index(self._index_file, initial_capacity)
+            self._open_index()
+
+        self._segment = 0
+        self._sync()
+
+    def __len__(self):
+        """Returns the number of distinct URLs in the archive."""
+        return self._count
+
+    def add(self, url, html, fetch_time=None):
+        """Archives a page fetched from the given URL."""
+        if isinstance(html, unicode):
+            html = html.encode('utf-8')
+        url_bytes = url
+        if isinstance(url, unicode):
+            url_bytes = url.encode('utf-8')
+        if fetch_time is None:
+            fetch_time = time.time()
+        if self.codec == CODEC_ZSTD:
+            data = zstandard.ZstdCompressor().compress(html)
+        else:
+            data = zlib.compress(html)
+        record = _RECORD.pack(_RECORD_MAGIC, self.codec, len(url_bytes),
+                              fetch_time, len(data)) + url_bytes + data
+
+        with self._lock:
+            with _flocked(self._lock_file, fcntl.LOCK_EX):
+                self._sync()
+                out = self._get_writer(len(record))
+                offset = out.tell()
+                out.write(record)
+                out.flush()
+                self._put(url_hash(url), fetch_time, self._segment, offset,
+                          len(record))
+
+    def lookup(self, url):
+        """
+        Returns (fetch time, segment, offset, length) of the latest fetch
+        of a URL, or None if it is not in the archive. The lookup is by
+        URL hash; get() makes sure the record is the URL's.
+        """
+        with self._lock:
+            with _flocked(self._lock_file, fcntl.LOCK_SH):
+                self._sync_index()
+                slot = self._find_slot(url_hash(url))
+                if slot is None:
+                    return None
+                return _SLOT.unpack_from(self._index, slot)[1:]
+
+    def get(self, url):
+        """Returns the HTML of the latest fetch of a URL, or None."""
+        found = self.lookup(url)
+        if found is None:
+            return None
+        _, segment, offset, length = found
+        with self._lock:
+            seg_file = self._get_segment(segment)
+            seg_file.seek(offset)
+            record = seg_file.read(length)
+        stored_url, _, html = self._decode(record)
+        if page_key(stored_url) != page_key(url):
+            # Another URL with the same hash; its fetch replaced this
+            # URL's in the index.
+            return None
+        return html
+
+    def scan(self):
+        """
+        Generator yielding (url, fetch time, html) for every fetch in the
+        archive, in the order the pages were added.
+        """
+        segment = 0
+        while os.path.exists(self._segment_file(segment)):
+            with open(self._segment_file(segment), 'rb') as seg_file:
+                while True:
+                    header = seg_file.read(_RECORD.size)
+                    if len(header) < _RECORD.size:
+                        break
+                    _, _, url_len, _, data_len = _RECORD.unpack(header)
+                    record = header + seg_file.read(url_len + data_len)
+                    yield self._decode(record)
+            segment += 1
+
+    def reindex(self):
+        """
+        Rebuilds the index from the segments, e.g. after a crash between
+        writing a record and indexing it.
+        """
+        with self._lock:
+            with _flocked(self._lock_file, fcntl.LOCK_EX):
+                self._sync_index()
+                self._close_index()
+                self._create_index(self._index_file, self._capacity)
+                self._open_index()
+                for segment, offset, url, fetch_time, length in \
+                        self._headers():
+                    self._put(url_hash(url), fetch_time, segment, offset,
+                              length)
+
+    def num_fetches(self):
+        """Returns the number of fetches in the archive."""
+        return sum(1 for _ in self._headers())
+
+    def close(self):
+        with self._lock:
+            if self._index is None:
+                return
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            for seg_file in self._segments.values():
+                seg_file.close()
+            self._segments = {}
+            self._close_index()
+            self._lock_file.close()
+
+    def _sync(self):
+        # Catches up with what other writers did, under the exclusive
+        # lock: a grown index, more used slots, new segments.
+        self._sync_index()
+        segment = self._segment
+        while os.path.exists(self._segment_file(segment + 1)):
+            segment += 1
+        if segment != self._segment:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._segment = segment
+
+    def _sync_index(self):
+        # Another writer may have replaced the index with a grown one.
+        if os.stat(self._index_file).st_ino != \
+           os.fstat(self._index_fd.fileno()).st_ino:
+            self._close_index()
+            self._open_index()
+        self._count = _INDEX_HEADER.unpack_from(self._index)[2]
+
+    def _headers(self):
+        # Yields segment, offset, URL, fetch time and record length of
+        # every record, skipping over the page data.
+        segment = 0
+        while os.path.exists(self._segment_file(segment)):
+            with open(self._segment_file(segment), 'rb') as seg_file:
+                while True:
+                    offset = seg_file.tell()
+                    header = seg_file.read(_RECORD.size)
+                    if len(header) < _RECORD.size:
+                        break
+                    _, _, url_len, fetch_time, data_len = \
+                        _RECORD.unpack(header)
+                    url = seg_file.read(url_len).decode('utf-8')
+                    seg_file.seek(data_len, os.SEEK_CUR)
+                    yield (segment, offset, url, fetch_time,
+                           _RECORD.size + url_len + data_len)
+            segment += 1
+
+    def _decode(self, record):
+        magic, codec, url_len, fetch_time, data_len = \
+            _RECORD.unpack_from(record)
+        if magic != _RECORD_MAGIC:
+            raise IOError('corrupt archive record')
+        url = record[_RECORD.size:_RECORD.size + url_len]
+        data = record[_RECORD.size + url_len:]
+        if codec == CODEC_ZSTD:
+            if zstandard is None:
+                raise ImportError('archive record needs the zstandard module')
+            html = zstandard.ZstdDecompressor().decompress(data)
+        else:
+            html = zlib.decompress(data)
+        return url.decode('utf-8'), fetch_time, html.decode('utf-8')
+
+    def _segment_file(self, segment):
+        return os.path.join(self.directory, 'seg-%05d.dat' % segment)
+
+    def _get_segment(self, segment):
+        if self._writer is not None:
+            self._writer.flush()
+        if segment not in self._segments:
+            self._segments[segment] = open(self._segment_file(segment), 'rb')
+        return self._segments[segment]
+
+    def _get_writer(self, record_len):
+        if self._writer is None:
+            self._writer = open(self._segment_file(self._segment), 'ab')
+        # Other writers may have appended since.
+        self._writer.seek(0, os.SEEK_END)
+        if self._writer.tell() > 0 and \
+           self._writer.tell() + record_len > self.segment_size:
+            self._writer.close()
+            self._segment += 1
+            self._writer = open(self._segment_file(self._segment), 'ab')
+        return self._writer
+
+    # The index is an open-addressing hash table with linear probing,
+    # stored in a file and memory-mapped. It is rebuilt at twice the
+    # capacity once more than 60% of the slots are used.
+
+    @staticmethod
+    def _create_index(file_name, capacity):
+        with open(file_name + '.tmp', 'wb') as index_file:
+            index_file.write(_INDEX_HEADER.pack(_INDEX_MAGIC, capacity, 0))
+            index_file.truncate(_INDEX_HEADER.size + capacity * _SLOT.size)
+        os.rename(file_name + '.tmp', file_name)
+
+    def _open_index(self):
+        self._index_fd = open(self._index_file, 'r+b')
+        self._index = mmap.mmap(self._index_fd.fileno(), 0)
+        magic, self._capacity, self._count = \
+            _INDEX_HEADER.unpack_from(self._index)
+        if magic != _INDEX_MAGIC:
+            raise IOError('corrupt archive index')
+
+    def _close_index(self):
+        self._index.flush()
+        self._index.close()
+        self._index_fd.close()
+        self._index = None
+
+    def _find_slot(self, key):
+        # Returns the offset of the key's slot in the index, or None.
+        mask = self._capacity - 1
+        pos = key & mask
+        while True:
+            offset = _INDEX_HEADER.size + pos * _SLOT.size
+            slot_key = _SLOT.unpack_from(self._index, offset)[0]
+            if slot_key == key:
+                return offset
+            if slot_key == 0:
+                return None
+            pos = (pos + 1) & mask
+
+    def _put(self, key, fetch_time, segment, offset, length):
+        mask = self._capacity - 1
+        pos = key & mask
+        while True:
+            slot = _INDEX_HEADER.size + pos * _SLOT.size
+            slot_key = _SLOT.unpack_from(self._index, slot)[0]
+            if slot_key == key or slot_key == 0:
+                break
+            pos = (pos + 1) & mask
+        _SLOT.pack_into(self._index, slot, key, fetch_time, segment, offset,
+                        length)
+        if slot_key == 0:
+            self._count += 1
+            _INDEX_HEADER.pack_into(self._index, 0, _INDEX_MAGIC,
+                                    self._capacity, self._count)
+            if self._count * 10 > self._capacity * 6:
+                self._grow()
+
+    def _grow(self):
+        old_index = self._index
+        old_index_fd = self._index_fd
+        old_capacity = self._capacity
+        tmp_file = self._index_file + '.grow'
+        self._create_index(tmp_file, old_capacity * 2)
+        self._index_fd = open(tmp_file, 'r+b')
+        self._index = mmap.mmap(self._index_fd.fileno(), 0)
+        self._capacity = old_capacity * 2
+        self._count = 0
+        for pos in range(old_capacity):
+            slot = _SLOT.unpack_from(old_index,
+                                     _INDEX_HEADER.size + pos * _SLOT.size)
+            if slot[0] != 0:
+                self._put(*slot)
+        self._index.flush()
+        old_index.close()
+        old_index_fd.close()
+        os.rename(tmp_file, self._index_file)
+
+
+def main():
+    usage = 'archive.py [options] <archive directory>\n' \
+        'Inspects a page archive written with pyscholar.py --archive.'
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--stats', action='store_true', default=False,
+                      help='Print the number of URLs and fetches')
+    parser.add_option('--get', metavar='URL', default=None,
+                      help='Print the latest archived page for URL')
+    parser.add_option('--reparse', metavar='FILE', default=None,
+                      help='Re-parse all archived results pages, writing the articles as JSON lines to FILE')
+    parser.add_option('--reindex', action='store_true', default=False,
+                      help='Rebuild the index from the segment files')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.print_help()
+        return 1
+
+    archive = ScholarPageArchive(args[0])
+    if options.reindex:
+        archive.reindex()
+    if options.get is not None:
+        html = archive.get(options.get)
+        if html is None:
+            print('not archived: %s' % options.get)
+            return 1
+        print(encode(html))
+    if options.reparse is not None:
+        # Imported here since the parser needs BeautifulSoup.
+        from parser import ScholarArticleParser120726
+        parser = ScholarArticleParser120726()
+        with open(options.reparse, 'w') as out:
+            for url, fetch_time, html in archive.scan():
+                for art in parser.iter_articles(html):
+                    rec = art.as_dict()
+                    rec['_url'] = url
+                    rec['_fetched'] = fetch_time
+                    out.write(json.dumps(rec) + '\n')
+    if options.stats:
+        print('%d urls, %d fetches' % (len(archive), archive.num_fetches()))
+    archive.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,11 @@
 #! /usr/bin/env python
 # -*- coding: utf8 -*-
 
+try:
+    unicode
+except NameError:  # Python 3
+    unicode = str
+
 
 class ScholarArticle(object):
 
@@ -52,6 +57,10 @@ class ScholarArticle(object):
     def set_citation_data(self, citation_data):
         self.citation_data = citation_data
 
+    def as_dict(self):
+        """Returns the article's attribute values as a dictionary."""
+        return dict((key, val[0]) for key, val in self.attrs.items())
+
     def as_txt(self):
         # Get items sorted in specified order:
         items = sorted(list(self.attrs.values()), key=lambda item: item[2])
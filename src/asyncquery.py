@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+# -*- coding: utf8 -*-
+"""
+This module offers ScholarQuerier to asyncio code (Python 3 only). A
+ScholarAsyncQuerier runs its querier's blocking browser calls in a
+thread of its own, so the event loop stays free, and many queriers can
+work concurrently in one loop, each with its own browser:
+
+  async def citing(url):
+      async with ScholarAsyncQuerier() as querier:  # Starts Firefox
+          query = SearchScholarQuery()
+          query.set_url(url)
+          return [art async for art in querier.iter_results(query, 100)]
+
+  async def main(urls):
+      return await asyncio.gather(*[citing(url) for url in urls])
+
+  results = asyncio.run(main(urls))
+
+ChallengeError and the other querier errors are raised by the awaits.
+The browser starts in the querier's thread as well, when the async with
+block is entered (or with ScholarAsyncQuerier.create()), so starting it
+does not hold up the loop either.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from query import ScholarQuerier
+
+_DONE = object()
+
+
+class ScholarAsyncQuerier(object):
+
+    """
+    The async counterpart of ScholarQuerier, wrapping one (a new one by
+    default, made in the querier's thread by start() or the first call
+    needing it). Its methods are coroutines doing what the querier's
+    methods of the same name do; iter_results() is an async generator.
+    The querier is used from one thread only, so calls on the same
+    ScholarAsyncQuerier run one after the other.
+    """
+
+    def __init__(self, querier=None):
+        self.querier = querier
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    @classmethod
+    async def create(cls, querier=None):
+        """Returns a new ScholarAsyncQuerier, started."""
+        res = cls(querier)
+        await res.start()
+        return res
+
+    @property
+    def articles(self):
+        return self.querier.articles if self.querier is not None else []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.quit()
+
+    async def start(self):
+        """Makes the querier, starting the browser, unless there is one."""
+        if self.querier is None:
+            self.querier = await self._run(ScholarQuerier)
+        return self.querier
+
+    async def apply_settings(self, settings):
+        querier = await self.start()
+        return await self._run(querier.apply_settings, settings)
+
+    async def send_query(self, query):
+        """Runs a query and returns its articles."""
+        querier = await self.start()
+        await self._run(querier.send_query, query)
+        return querier.articles
+
+    async def get_citation_data(self, article):
+        querier = await self.start()
+        return await self._run(querier.get_citation_data, article)
+
+    async def iter_results(self, query, limit=None):
+        """
+        Yields the articles found for a query, up to limit, fetching
+        result pages as the articles are consumed, like
+        ScholarQuerier.iter_results().
+        """
+        querier = await self.start()
+        results = querier.iter_results(query, limit=limit)
+        try:
+            while True:
+                art = await self._run(next, results, _DONE)
+                if art is _DONE:
+                    return
+                yield art
+        finally:
+            await self._run(results.close)
+
+    async def quit(self):
+        if self.querier is not None:
+            await self._run(self.querier.quit)
+        self._executor.shutdown(wait=False)
+
+    def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor,
+                                    functools.partial(func, *args, **kwargs))
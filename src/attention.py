@@ -0,0 +1,132 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module keeps the work that Scholar stopped with a "not a robot"
+challenge page, so a crawl can carry on with everything else instead
+of waiting for somebody to solve the challenge. The operator solves it
+in the visible browser and releases the parked work by creating the
+release file (the parked file name plus '.release') while the crawl is
+still running, or runs pyscholar.py with --release-parked afterwards.
+Released work stays parked until it went through.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from utils import ScholarConf, ScholarUtils
+
+
+class ScholarAttentionQueue(object):
+
+    """
+    A persistent list of parked work entries. Entries are dictionaries
+    with a 'kind' key ('url', 'query', 'cluster' or 'batch') plus
+    whatever the kind needs to run the work again; the list is
+    rewritten atomically on every change so it survives a crash. The
+    same work is parked only once. back_off() and succeeded() may be
+    called from several threads.
+    """
+
+    def __init__(self, file_name, notify_cmd=None):
+        self.file_name = file_name
+        self.release_file = file_name + '.release'
+        self.notify_cmd = notify_cmd
+        self.consecutive = 0
+        self._lock = threading.Lock()
+        self.entries = []
+        try:
+            with open(file_name) as data_file:
+                self.entries = json.load(data_file)
+        except IOError:
+            pass
+
+    def __len__(self):
+        return len(self.entries)
+
+    def park(self, entry, reason):
+        """Parks a work entry and tells the operator about it."""
+        entry = dict(entry)
+        entry['reason'] = reason
+        entry['parked'] = time.time()
+        self._remove(entry)
+        self.entries.append(entry)
+        self._save()
+        self.notify('%s; parked in %s (%d waiting)' %
+                    (reason, self.file_name, len(self.entries)))
+
+    def release_requested(self):
+        """Returns True if the operator created the release file."""
+        return os.path.exists(self.release_file)
+
+    def release(self):
+        """
+        Returns the parked entries to run them again. They stay parked
+        until done() is called for them, so work that fails again, or
+        is interrupted, is not lost.
+        """
+        if os.path.exists(self.release_file):
+            os.remove(self.release_file)
+        return list(self.entries)
+
+    def done(self, entry):
+        """Unparks the work of an entry, once it went through."""
+        if self._remove(entry):
+            self._save()
+
+    def notify(self, msg):
+        """
+        Gets the operator's attention: logs the message, rings the
+        terminal bell and runs the notification command, if any, with
+        the message in the SCHOLAR_MESSAGE environment variable.
+        """
+        ScholarUtils.log('warn', msg)
+        sys.stderr.write('\a')
+        sys.stderr.flush()
+        if self.notify_cmd:
+            env = dict(os.environ)
+            env['SCHOLAR_MESSAGE'] = msg
+            try:
+                subprocess.Popen(self.notify_cmd, shell=True, env=env)
+            except OSError as err:
+                ScholarUtils.log('error', 'notification failed: %s' % err)
+
+    def back_off(self):
+        """
+        Waits after a challenge before going on with other work. The
+        wait doubles with every consecutive challenge, from
+        ScholarConf.CHALLENGE_BACKOFF up to CHALLENGE_MAX_BACKOFF.
+        """
+        with self._lock:
+            self.consecutive += 1
+            delay = min(ScholarConf.CHALLENGE_BACKOFF *
+                        2 ** (self.consecutive - 1),
+                        ScholarConf.CHALLENGE_MAX_BACKOFF)
+        ScholarUtils.log('info', 'backing off for %d seconds' % delay)
+        time.sleep(delay)
+
+    def succeeded(self):
+        """Tells the queue that work went through without a challenge."""
+        with self._lock:
+            self.consecutive = 0
+
+    def _remove(self, entry):
+        # Removes the entries for the same work; returns True if any.
+        work = self._work(entry)
+        entries = [other for other in self.entries
+                   if self._work(other) != work]
+        removed = len(entries) != len(self.entries)
+        self.entries = entries
+        return removed
+
+    @staticmethod
+    def _work(entry):
+        return dict((key, val) for key, val in entry.items()
+                    if key not in ('reason', 'parked'))
+
+    def _save(self):
+        tmp_file = self.file_name + '.tmp'
+        with open(tmp_file, 'w') as data_file:
+            json.dump(self.entries, data_file, indent=2)
+        os.rename(tmp_file, self.file_name)
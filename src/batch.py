@@ -0,0 +1,151 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module runs a batch of searches within one session, so each search
+costs its page fetches only, not a browser start and the settings. The
+batch is a file with one query spec per line: a JSON object with the
+keys of query.QUERY_SPEC_KEYS, plus optionally 'start', 'count' and an
+'id' naming the output file, e.g.
+
+  {"id": "epr", "author": "albert einstein", "phrase": "quantum theory"}
+  {"allw": "entanglement", "after": 2010, "count": 50}
+
+Every search gets its own JSON output file, with the articles and where
+they came from.
+"""
+import json
+import os
+import re
+import time
+from query import query_from_spec
+from excepts import ChallengeError, Error
+from utils import ScholarConf, ScholarUtils
+
+
+_UNSAFE_RE = re.compile(r'[^\w.-]+', re.UNICODE)
+
+
+def read_specs(file_name):
+    """
+    Generator yielding (line number, line) for the query specs in a batch
+    file, skipping blank lines and lines starting with '#'. The lines are
+    parsed by ScholarBatch.run(), so that a bad one fails alone.
+    """
+    with open(file_name) as data_file:
+        for line_no, line in enumerate(data_file, 1):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line_no, line
+
+
+def parse_spec(spec):
+    """
+    Returns a query spec given as a dictionary or a JSON line as a
+    dictionary. Raises ValueError if it is neither.
+    """
+    if not isinstance(spec, dict):
+        spec = json.loads(spec)
+    if not isinstance(spec, dict):
+        raise ValueError('query spec is not a JSON object')
+    return spec
+
+
+class ScholarBatch(object):
+
+    """
+    Runs query specs with one querier, writing each search's results to
+    out_dir as a JSON object of the form
+
+      {"spec": ..., "batch": ..., "line": ..., "url": ..., "started": ...,
+       "finished": ..., "num_results": ..., "articles": [...]}
+
+    where url is the first results page fetched and num_results the
+    total Scholar reported. Searches whose output file exists are
+    skipped, so an interrupted batch can simply be run again. Searches
+    stopped by a challenge page are parked in the attention queue, if
+    one is given.
+    """
+
+    def __init__(self, querier, out_dir, batch_file=None, limit=None,
+                 attention=None):
+        self.querier = querier
+        self.out_dir = out_dir
+        self.batch_file = batch_file
+        self.limit = limit or ScholarConf.MAX_PAGE_RESULTS
+        self.attention = attention
+        self.stats = {'done': 0, 'skipped': 0, 'failed': 0, 'parked': 0,
+                      'articles': 0}
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+
+    def output_file(self, line_no, spec):
+        # The id may be anything; only letters, digits, '_', '-' and
+        # inner dots make it into the file name.
+        name = _UNSAFE_RE.sub('_', u'%s' % (spec.get('id') or '')).strip('.')
+        name = name or 'query-%05d' % line_no
+        return os.path.join(self.out_dir, '%s.json' % name)
+
+    def run(self, specs):
+        """
+        Runs the (line number, spec) pairs from the given iterable, where
+        the specs are dictionaries or JSON lines. A spec that cannot be
+        parsed or run counts as failed and gets no output file, so it is
+        run again with the batch.
+        """
+        first = True
+        for line_no, spec in specs:
+            try:
+                spec = parse_spec(spec)
+            except ValueError as err:
+                ScholarUtils.log('error', 'batch line %d failed: %s'
+                                 % (line_no, err))
+                self.stats['failed'] += 1
+                continue
+            file_name = self.output_file(line_no, spec)
+            if os.path.exists(file_name):
+                self.stats['skipped'] += 1
+                continue
+            if not first:
+                time.sleep(ScholarConf.PAGE_INTERVAL)
+            first = False
+            try:
+                self.run_spec(line_no, spec, file_name)
+            except ChallengeError as err:
+                self.stats['parked'] += 1
+                if self.attention is None:
+                    raise
+                self.attention.park({'kind': 'batch', 'spec': spec,
+                                     'line': line_no, 'batch': self.batch_file,
+                                     'file_name': file_name}, str(err))
+                self.attention.back_off()
+                continue
+            except (Error, ValueError) as err:
+                ScholarUtils.log('error', 'batch line %d failed: %s'
+                                 % (line_no, err))
+                self.stats['failed'] += 1
+                continue
+            if self.attention is not None:
+                self.attention.succeeded()
+        ScholarUtils.log('info', 'batch: %s' % self.stats)
+
+    def run_spec(self, line_no, spec, file_name):
+        """
+        Runs one query spec and writes its output file, unless fetching
+        the results failed, which raises FetchError.
+        """
+        query = query_from_spec(spec)
+        query.set_starting_number(spec.get('start') or 0)
+        limit = spec.get('count', self.limit)
+        url = query.get_url()
+        started = time.time()
+        articles = [art.as_dict()
+                    for art in self.querier.iter_results(query, limit=limit)]
+        res = {'spec': spec, 'batch': self.batch_file, 'line': line_no,
+               'url': url, 'started': started, 'finished': time.time(),
+               'num_results': query['num_results'], 'articles': articles}
+        tmp_file = file_name + '.tmp'
+        with open(tmp_file, 'w') as data_file:
+            json.dump(res, data_file, indent=2)
+        os.rename(tmp_file, file_name)
+        self.stats['done'] += 1
+        self.stats['articles'] += len(articles)
@@ -0,0 +1,439 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+Throughput benchmarks for the hot paths of pyscholar: parsing results
+pages, rendering and serializing articles, composing query URLs, and
+full loop() crawls against a local ScholarMockServer at several
+concurrency levels, page loads of the default and the lean browser, and
+the time and memory taken to hand a page from the browser to the
+parser. Everything runs offline on synthetic pages; the browser
+comparison needs Firefox, the page memory figures Python 3.
+
+  benchmark.py                         # run and report
+  benchmark.py --save-baseline b.json  # store results as baseline
+  benchmark.py --baseline b.json       # compare, exit 1 on regression
+"""
+import json
+import optparse
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import warnings
+import utils
+from page import ScholarPage
+from parser import BeautifulSoup, ScholarArticleParser120726
+from query import ScholarQuerier, SearchScholarQuery
+from replay import HttpDriver, ScholarMockServer, page_key
+from utils import ScholarConf, reset_res
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+BENCH_SITE = ScholarConf.SCHOLAR_SITE
+
+
+def synthetic_page(num_results, start=0, total=None, excerpt_words=30,
+                   assets=False):
+    """
+    Returns the HTML of a results page shaped like Scholar's, with
+    num_results articles numbered from start. With assets, the page also
+    refers to a style sheet, a web font and a thumbnail per article
+    below /asset/, as served by ScholarMockServer.
+    """
+    total = total if total is not None else start + num_results
+    head = ''
+    if assets:
+        head = '<link rel="stylesheet" href="/asset/style.css">' \
+            '<style>@font-face { font-family: f; src: ' \
+            'url(/asset/font.woff); } body { font-family: f; }</style>'
+    res = ['<html><head><title>Scholar</title>%s</head><body>'
+           '<div id="gs_ab_md"><div class="gs_ab_mdw">About %d results '
+           '(<b>0.04</b> sec)</div></div><div id="gs_res_ccl">'
+           % (head, total)]
+    for idx in range(start, start + num_results):
+        cluster = 4412725301034017472 + idx
+        excerpt = ' '.join(['word%d' % ((idx * 7 + i) % 97)
+                            for i in range(excerpt_words)])
+        res.append(
+            '<div class="gs_r gs_or gs_scl"><div class="gs_ggs gs_fl">'
+            '<div class="gs_ggsd"><div class="gs_or_ggsm">'
+            '<a href="http://example.org/paper%(idx)d.pdf">[PDF] example.org'
+            '</a></div></div></div><div class="gs_ri"><h3 class="gs_rt">'
+            '<a href="http://example.org/paper%(idx)d">On the <b>theory</b> '
+            'of things, part %(idx)d</a></h3><div class="gs_a">A Einstein, '
+            'B Podolsky, N Rosen - Physical Review, %(year)d - APS</div>'
+            '<div class="gs_rs">%(excerpt)s</div><div class="gs_fl">'
+            '<a href="/scholar?cites=%(cluster)d&amp;as_sdt=2005&amp;'
+            'sciodt=0,5&amp;hl=en&amp;num=10">Cited by %(cites)d</a> '
+            '<a href="/scholar?q=related:x:scholar.google.com/">Related '
+            'articles</a> <a href="/scholar?cluster=%(cluster)d&amp;hl=en'
+            '&amp;num=10">All %(versions)d versions</a></div></div></div>'
+            % {'idx': idx, 'year': 1950 + idx % 70, 'excerpt': excerpt,
+               'cluster': cluster, 'cites': (idx * 37) % 5000,
+               'versions': 1 + idx % 12})
+        if assets:
+            res.append('<img src="/asset/thumb%d.png">' % idx)
+    res.append('</div></body></html>')
+    return ''.join(res)
+
+
+def synthetic_articles(num):
+    parser = ScholarArticleParser120726()
+    articles = []
+    parser.handle_article = articles.append
+    while len(articles) < num:
+        parser.parse(synthetic_page(min(100, num - len(articles)),
+                                    start=len(articles)))
+    return articles
+
+
+class _Silence(object):
+
+    """Context manager swallowing whatever the output code prints."""
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def best_time(func, repeat=5, number=1):
+    """Returns the best wall-clock time of number calls of func."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for _ in range(number):
+            func()
+        elapsed = (time.time() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def peak_rss_kb():
+    """
+    Returns the peak resident set size of this process in KiB. That is
+    the peak of the whole run so far, over all benchmarks run in it,
+    not that of any one benchmark.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+def bench_parse(results):
+    for size in (1, 10, 50, 100):
+        html = synthetic_page(size)
+        parser = ScholarArticleParser120726()
+        secs = best_time(lambda: parser.parse(html), number=5)
+        results['parse/%d' % size] = {'rate': 1.0 / secs, 'unit': 'pages/s'}
+        results['parse/%d/articles' % size] = {'rate': size / secs,
+                                               'unit': 'articles/s'}
+
+
+class _BytesParser(ScholarArticleParser120726):
+
+    # The parser as it was before ScholarPage: given bytes, BeautifulSoup
+    # guesses the encoding and picks a tree builder itself.
+    @staticmethod
+    def _make_soup(html):
+        return BeautifulSoup(html)
+
+
+def bench_page(results, size=100):
+    """
+    Compares the way a page used to go from the browser to the parser
+    with the way it goes now. Before, the page source was encoded to
+    bytes, scanned for challenge texts as bytes, decoded again for the
+    debug log, and given to BeautifulSoup without a tree builder, so it
+    guessed the encoding and picked a builder. Now one ScholarPage is
+    scanned and parsed with ScholarConf.HTML_PARSER. Measured are pages
+    per second including the parse, and pages per MB of peak allocations
+    up to the parse. The units name the tree builder each way used,
+    since that, rather than the hand-off, decides the parse time.
+    """
+    source = synthetic_page(size)
+    if not isinstance(source, type(u'')):
+        source = source.decode('utf-8')
+    old_texts = [text.encode('utf-8') for text in ScholarQuerier.CHALLENGE_TEXTS]
+    texts = ScholarQuerier.CHALLENGE_TEXTS
+    old_parser = _BytesParser()
+    parser = ScholarArticleParser120726()
+
+    def as_bytes(parse=True):
+        html = source.encode('utf-8')
+        if any(text in html for text in old_texts):
+            return
+        html.decode('utf-8')
+        if parse:
+            old_parser.parse(html)
+            old_parser.release()
+
+    def as_page(parse=True):
+        page = ScholarPage(source)
+        if page.contains_any(texts):
+            return
+        if parse:
+            parser.parse(page)
+            parser.release()
+
+    with warnings.catch_warnings():
+        # BeautifulSoup warns when it has to pick the builder.
+        warnings.simplefilter('ignore')
+        for name, func, make_soup in (
+                ('bytes', as_bytes, lambda: _BytesParser._make_soup(
+                    source.encode('utf-8'))),
+                ('page', as_page, lambda: parser._make_soup(
+                    ScholarPage(source)))):
+            builder = getattr(make_soup().builder, 'NAME', 'unknown')
+            secs = best_time(func, number=5)
+            results['page/%s' % name] = {'rate': 1.0 / secs,
+                                         'unit': 'pages/s (%s)' % builder}
+            if tracemalloc is None:
+                continue
+            tracemalloc.start()
+            func(parse=False)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results['page/%s/handoff' % name] = {'rate': 1e6 / max(peak, 1),
+                                                 'unit': 'pages/MB'}
+
+
+def bench_render(results):
+    articles = synthetic_articles(100)
+    secs = best_time(lambda: [art.as_txt() for art in articles])
+    results['as_txt'] = {'rate': len(articles) / secs, 'unit': 'articles/s'}
+    secs = best_time(lambda: [art.as_csv() for art in articles])
+    results['as_csv'] = {'rate': len(articles) / secs, 'unit': 'articles/s'}
+
+
+def bench_to_json(results):
+    class _Querier(object):
+        pass
+    querier = _Querier()
+    querier.articles = synthetic_articles(ScholarConf.MAX_PAGE_RESULTS)
+    fd, file_name = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        for count in (100, 1000, 2000):
+            def run():
+                reset_res()
+                for _ in range(count // len(querier.articles)):
+                    utils.to_json(querier, file_name)
+            with _Silence():
+                secs = best_time(run, repeat=1)
+            results['to_json/%d' % count] = {'rate': count / secs,
+                                             'unit': 'articles/s'}
+    finally:
+        reset_res()
+        os.remove(file_name)
+
+
+def bench_get_url(results):
+    query = SearchScholarQuery()
+    query.set_author('albert einstein')
+    query.set_words_some('quantum theory, radiation, light quanta')
+    query.set_timeframe(1900, 1950)
+    secs = best_time(query.get_url, number=1000)
+    results['get_url'] = {'rate': 1.0 / secs, 'unit': 'urls/s'}
+
+
+def crawl_pages(num_urls, num_pages):
+    """
+    Returns a dictionary of page key -> HTML serving num_urls citations
+    lists of num_pages pages each, plus their citation list URLs.
+    """
+    pages = {}
+    urls = []
+    for idx in range(num_urls):
+        url = BENCH_SITE + '/scholar?cites=%d&as_sdt=2005' % (1000 + idx)
+        urls.append(url)
+        query = SearchScholarQuery()
+        query.set_url(url)
+        total = num_pages * ScholarConf.MAX_PAGE_RESULTS
+        for page in range(num_pages):
+            start = page * ScholarConf.MAX_PAGE_RESULTS
+            query.set_starting_number(start)
+            pages[page_key(query.get_url())] = synthetic_page(
+                ScholarConf.MAX_PAGE_RESULTS, start=start, total=total)
+    return pages, urls
+
+
+def bench_loop(results, levels=(1, 2, 4, 8), num_pages=10, latency=0.05,
+               prefetch=0):
+    # Imported here since pyscholar pulls in the whole command line.
+    from pyscholar import loop
+
+    options = optparse.Values({'start': 0, 'json': False, 'csv': True,
+                               'csv_header': False, 'citation': None,
+                               'txt_globals': False, 'cookie_file': None,
+                               'prefetch': prefetch, 'count': num_pages *
+                               ScholarConf.MAX_PAGE_RESULTS})
+    page_load_wait = ScholarConf.PAGE_LOAD_WAIT
+    page_interval = ScholarConf.PAGE_INTERVAL
+    ScholarConf.PAGE_LOAD_WAIT = ScholarConf.PAGE_INTERVAL = 0
+    pages, urls = crawl_pages(max(levels), num_pages)
+    server = ScholarMockServer(pages, latency=latency).start()
+    try:
+        for level in levels:
+            queriers = [ScholarQuerier(driver=HttpDriver(server.url))
+                        for _ in range(level)]
+            counts = []
+
+            def crawl(querier, url):
+                query = SearchScholarQuery()
+                query.set_url(url)
+                loop(options, query, querier, file_name=os.devnull)
+                counts.append(querier.firefox.num_requests)
+
+            threads = [threading.Thread(target=crawl, args=(querier, url))
+                       for querier, url in zip(queriers, urls)]
+            start = time.time()
+            with _Silence():
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            secs = time.time() - start
+            num = sum(counts)
+            name = 'loop/%d' % level
+            if prefetch:
+                name += '/prefetch%d' % prefetch
+            results[name] = {'rate': num / secs, 'unit': 'pages/s'}
+            results[name + '/articles'] = {
+                'rate': num * ScholarConf.MAX_PAGE_RESULTS / secs,
+                'unit': 'articles/s'}
+    finally:
+        server.stop()
+        ScholarConf.PAGE_LOAD_WAIT = page_load_wait
+        ScholarConf.PAGE_INTERVAL = page_interval
+
+
+def bench_browser(results, num_pages=10, asset_size=50000):
+    """
+    Compares page loads of the default and the lean browser (see
+    ScholarConf.LEAN_BROWSER) on pages with images, fonts and style
+    sheets: pages per second, and pages per MB sent by the server.
+    Needs Firefox and geckodriver; skipped without them.
+    """
+    pages = {}
+    for page in range(num_pages):
+        pages['/page%d' % page] = synthetic_page(
+            ScholarConf.MAX_PAGE_RESULTS,
+            start=page * ScholarConf.MAX_PAGE_RESULTS, assets=True)
+    server = ScholarMockServer(pages, asset_size=asset_size).start()
+    lean = ScholarConf.LEAN_BROWSER
+    page_load_wait = ScholarConf.PAGE_LOAD_WAIT
+    session_file = ScholarConf.SESSION_FILE
+    cookie_file = ScholarConf.COOKIE_JAR_FILE
+    ScholarConf.PAGE_LOAD_WAIT = 0
+    ScholarConf.COOKIE_JAR_FILE = None
+    ScholarConf.SESSION_FILE = os.path.join(tempfile.mkdtemp(),
+                                            'session.json')
+    try:
+        for name, mode in (('default', False), ('lean', True)):
+            ScholarConf.LEAN_BROWSER = mode
+            try:
+                querier = ScholarQuerier()
+            except Exception as err:
+                print('browser benchmark skipped: %s' % err)
+                return
+            try:
+                # Warm up, so browser start-up costs are not counted.
+                querier._get_http_response(server.url + '/page0')
+                sent = server.bytes_sent
+                start = time.time()
+                for page in range(num_pages):
+                    querier._get_http_response(server.url + '/page%d' % page)
+                secs = time.time() - start
+                sent = server.bytes_sent - sent
+            finally:
+                querier.quit()
+            results['browser/%s' % name] = {'rate': num_pages / secs,
+                                            'unit': 'pages/s'}
+            results['browser/%s/bandwidth' % name] = {
+                'rate': num_pages / (sent / 1e6), 'unit': 'pages/MB'}
+    finally:
+        server.stop()
+        ScholarConf.LEAN_BROWSER = lean
+        ScholarConf.PAGE_LOAD_WAIT = page_load_wait
+        ScholarConf.SESSION_FILE = session_file
+        ScholarConf.COOKIE_JAR_FILE = cookie_file
+
+
+BENCHMARKS = [('parse', bench_parse),
+              ('page', bench_page),
+              ('render', bench_render),
+              ('to_json', bench_to_json),
+              ('get_url', bench_get_url),
+              ('loop', bench_loop),
+              ('prefetch', lambda results: bench_loop(results, levels=(1,),
+                                                      prefetch=2)),
+              ('browser', bench_browser)]
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results against baseline results and returns the names
+    of benchmarks that got slower by more than the tolerance.
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        ratio = results[name]['rate'] / baseline[name]['rate']
+        flag = ''
+        if ratio < 1.0 - tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-24s %12.1f %-11s %6.2fx baseline%s' % (
+            name, results[name]['rate'], results[name]['unit'], ratio, flag))
+    return regressions
+
+
+def main():
+    usage = 'benchmark.py [options] [benchmark ...]\n' \
+        'Runs the pyscholar throughput benchmarks (default: all of %s).' \
+        % ', '.join([name for name, _ in BENCHMARKS])
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--baseline', metavar='FILE', default=None,
+                      help='Compare against the results stored in FILE')
+    parser.add_option('--save-baseline', metavar='FILE', default=None,
+                      help='Store the results in FILE')
+    parser.add_option('--tolerance', type='float', default=0.25,
+                      help='Slowdown tolerated before reporting a regression (default: 0.25)')
+    options, args = parser.parse_args()
+
+    results = {}
+    for name, bench in BENCHMARKS:
+        if not args or name in args:
+            bench(results)
+
+    if options.baseline is not None:
+        with open(options.baseline) as data_file:
+            baseline = json.load(data_file)
+        regressions = compare(results, baseline['results'],
+                              options.tolerance)
+    else:
+        regressions = []
+        for name in sorted(results):
+            print('%-24s %12.1f %s' % (name, results[name]['rate'],
+                                       results[name]['unit']))
+    print('%-24s %12d KiB' % ('peak RSS (whole run)', peak_rss_kb()))
+
+    if options.save_baseline is not None:
+        with open(options.save_baseline, 'w') as data_file:
+            json.dump({'results': results, 'run_peak_rss_kb': peak_rss_kb()},
+                      data_file, indent=2, sort_keys=True)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
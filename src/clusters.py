@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module resolves many cluster IDs to their versions within one
+session: the queriers (and their browsers) are set up once, so each
+cluster costs page fetches only. Cluster IDs are deduplicated, results
+can be cached across runs, and several queriers can work concurrently.
+"""
+import json
+import threading
+from query import ClusterScholarQuery
+from excepts import ChallengeError, FormatError
+from utils import ScholarUtils
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+
+class ScholarClusterResolver(object):
+
+    """
+    Resolves cluster IDs with a pool of ScholarQuerier instances, one
+    thread per querier. Every cluster is written as one JSON line of
+    the form {"cluster_id": ..., "versions": [...]}, where the versions
+    are article dictionaries. The cache, if any, is a file in the same
+    format; clusters found in it are answered without a fetch and newly
+    resolved ones are appended to it. Clusters stopped by a challenge
+    page are parked in the attention queue, if one is given, together
+    with the park_info fields (where the cluster goes once resolved);
+    the queue also learns of every resolved cluster, so its back-off
+    starts over.
+    Clusters that could not be fetched are counted as failed and not
+    written, so that a later run with the same output tries them again.
+    """
+
+    def __init__(self, queriers, cache_file=None, limit=None,
+                 attention=None, park_info=None):
+        self.queriers = queriers
+        self.limit = limit
+        self.attention = attention
+        self.park_info = park_info or {}
+        self.cache = {}
+        self.cache_file = None
+        self.stats = {'resolved': 0, 'cached': 0, 'duplicates': 0,
+                      'failed': 0, 'parked': 0}
+        self._lock = threading.Lock()
+        if cache_file is not None:
+            try:
+                with open(cache_file) as data_file:
+                    for line in data_file:
+                        rec = json.loads(line)
+                        self.cache[str(rec['cluster_id'])] = rec['versions']
+            except IOError:
+                pass
+            self.cache_file = open(cache_file, 'a')
+
+    def resolve(self, cluster_ids, out):
+        """
+        Resolves the cluster IDs from the given iterable, writing each
+        resolved cluster to the out file as soon as it is done. IDs are
+        consumed as the queriers become free, so the iterable may be a
+        long stream.
+        """
+        tasks = queue.Queue(maxsize=2 * len(self.queriers))
+        threads = [threading.Thread(target=self._work,
+                                    args=(querier, tasks, out))
+                   for querier in self.queriers]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        seen = set()
+        for cluster_id in cluster_ids:
+            try:
+                cluster_id = str(ScholarUtils.ensure_int(cluster_id))
+            except FormatError:
+                ScholarUtils.log('warn', 'skipping invalid cluster ID %r'
+                                 % cluster_id)
+                continue
+            if cluster_id in seen:
+                self.stats['duplicates'] += 1
+                continue
+            seen.add(cluster_id)
+            if cluster_id in self.cache:
+                self.stats['cached'] += 1
+                self._write(out, cluster_id, self.cache[cluster_id])
+                continue
+            tasks.put(cluster_id)
+
+        for _ in threads:
+            tasks.put(None)
+        for thread in threads:
+            thread.join()
+
+    def close(self):
+        if self.cache_file is not None:
+            self.cache_file.close()
+            self.cache_file = None
+
+    def _work(self, querier, tasks, out):
+        while True:
+            cluster_id = tasks.get()
+            if cluster_id is None:
+                return
+            try:
+                query = ClusterScholarQuery(cluster=cluster_id)
+                versions = [art.as_dict() for art in
+                            querier.iter_results(query, limit=self.limit)]
+            except ChallengeError as err:
+                self._park(cluster_id, err)
+                continue
+            except Exception as err:
+                ScholarUtils.log('error', 'resolving cluster %s failed: %s'
+                                 % (cluster_id, err))
+                with self._lock:
+                    self.stats['failed'] += 1
+                continue
+            if not versions:
+                # Every cluster has at least one version, so an empty
+                # result means the page was not what we asked for.
+                ScholarUtils.log('error', 'resolving cluster %s failed: '
+                                 'no versions' % cluster_id)
+                with self._lock:
+                    self.stats['failed'] += 1
+                continue
+            with self._lock:
+                self.stats['resolved'] += 1
+                if self.cache_file is not None:
+                    self.cache_file.write(json.dumps(
+                        {'cluster_id': cluster_id, 'versions': versions}) + '\n')
+                    self.cache_file.flush()
+            self._write(out, cluster_id, versions)
+            if self.attention is not None:
+                self.attention.succeeded()
+
+    def _park(self, cluster_id, err):
+        with self._lock:
+            if self.attention is None:
+                ScholarUtils.log('error', 'resolving cluster %s failed: %s'
+                                 % (cluster_id, err))
+                self.stats['failed'] += 1
+                return
+            self.stats['parked'] += 1
+            entry = dict(self.park_info, kind='cluster', cluster_id=cluster_id)
+            self.attention.park(entry, str(err))
+        self.attention.back_off()
+
+    def _write(self, out, cluster_id, versions):
+        line = json.dumps({'cluster_id': cluster_id, 'versions': versions})
+        with self._lock:
+            out.write(line + '\n')
+            out.flush()
@@ -0,0 +1,175 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module runs pyscholar as a long-lived local server, so that many
+small queries do not each pay for starting Firefox and applying the
+settings. A ScholarDaemon keeps a pool of warm queriers and answers
+queries sent as JSON over HTTP, streaming back the articles found as
+JSON lines while the result pages are fetched. Queries wait in line
+for a free querier.
+
+  POST /query   body: a query spec, i.e. a JSON object with the keys of
+                query.QUERY_SPEC_KEYS plus 'start' and 'count' (the
+                number of articles, default one page; null for all)
+  GET /stats    the daemon's counters as JSON
+
+Start it with pyscholar.py --serve PORT, then e.g.
+
+  curl -d '{"author": "albert einstein", "count": 30}' localhost:8080/query
+"""
+import json
+import socket
+import threading
+import time
+from excepts import ChallengeError, Error, FetchError
+from query import query_from_spec
+from utils import ScholarConf, ScholarUtils
+
+try:
+    import queue
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    import Queue as queue
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self._send_json(404, {'error': 'not found'})
+            return
+        self._send_json(200, self.server.report())
+
+    def do_POST(self):
+        if self.path != '/query':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            # get() works on the headers of Python 2 and 3 alike.
+            length = int(self.headers.get('content-length') or 0)
+            spec = json.loads(self.rfile.read(length))
+            query = query_from_spec(spec)
+            query.set_starting_number(spec.get('start') or 0)
+            query.get_url()  # Raises QueryArgumentError if incomplete.
+            limit = spec.get('count', ScholarConf.MAX_PAGE_RESULTS)
+            if limit is not None:
+                limit = ScholarUtils.ensure_int(limit, 'count must be numeric')
+        except (ValueError, AttributeError, Error) as err:
+            self._send_json(400, {'error': str(err)})
+            return
+
+        querier = self.server.acquire()
+        if querier is None:
+            self._send_json(503, {'error': 'all queriers busy'})
+            return
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.end_headers()
+            num = 0
+            for art in querier.iter_results(query, limit=limit):
+                self._write_line(art.as_dict())
+                self.wfile.flush()
+                num += 1
+            self.server.count('articles', num)
+        except ChallengeError as err:
+            self.server.count('challenges')
+            if self.server.attention is not None:
+                self.server.attention.notify('daemon: %s' % err)
+            self._write_line({'error': str(err)})
+        except FetchError as err:
+            self.server.count('fetch_errors')
+            self._write_line({'error': str(err)})
+        except socket.error:
+            # The client went away; the querier is fine.
+            self.server.count('disconnects')
+        finally:
+            self.server.release(querier)
+
+    def _write_line(self, data):
+        self.wfile.write((json.dumps(data) + '\n').encode('utf-8'))
+
+    def _send_json(self, status, data):
+        body = (json.dumps(data) + '\n').encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        ScholarUtils.log('info', 'daemon: ' + fmt % args)
+
+
+class ScholarDaemon(ThreadingMixIn, HTTPServer):
+
+    """
+    A local HTTP server answering queries with a pool of queriers. The
+    queriers are expected to be set up already (settings applied); the
+    daemon lends each one to a single query at a time. Queries wait up
+    to queue_timeout seconds for a free querier before they are turned
+    away. Call serve_forever() to run it and close() to quit the
+    queriers.
+    """
+    daemon_threads = True
+
+    def __init__(self, queriers, host='127.0.0.1', port=8080,
+                 queue_timeout=300, attention=None):
+        HTTPServer.__init__(self, (host, port), _QueryHandler)
+        self.queriers = queriers
+        self.queue_timeout = queue_timeout
+        self.attention = attention
+        self.started = time.time()
+        self.stats = {'queries': 0, 'articles': 0, 'challenges': 0,
+                      'fetch_errors': 0, 'disconnects': 0, 'rejected': 0}
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._idle = queue.Queue()
+        for querier in queriers:
+            self._idle.put(querier)
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def acquire(self):
+        """Returns a free querier, or None if none became free in time."""
+        with self._lock:
+            self._waiting += 1
+        try:
+            querier = self._idle.get(timeout=self.queue_timeout)
+            self.count('queries')
+            return querier
+        except queue.Empty:
+            self.count('rejected')
+            return None
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def release(self, querier):
+        self._idle.put(querier)
+
+    def count(self, key, num=1):
+        with self._lock:
+            self.stats[key] += num
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['waiting'] = self._waiting
+        stats['queriers'] = len(self.queriers)
+        stats['idle'] = self._idle.qsize()
+        stats['uptime'] = time.time() - self.started
+        controller = self.queriers[0].controller if self.queriers else None
+        if controller is not None:
+            stats['pacing'] = controller.metrics()
+        return stats
+
+    def close(self):
+        self.server_close()
+        for querier in self.queriers:
+            querier.quit()
@@ -0,0 +1,343 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module finds records that describe the same paper even though
+Scholar gave them different cluster IDs, e.g. a preprint and its
+journal version, or a [CITATION] entry. Comparing all pairs of records
+does not scale, so each record gets a MinHash signature over its
+normalized title and author names, and locality-sensitive hashing
+(LSH) of the signatures yields candidate duplicates in near-linear
+time. Candidates are verified by their estimated similarity and year,
+and merged into groups.
+
+Run it directly on --json result files:
+
+  dedup.py --index dedup.idx ../results/*.json > groups.json
+"""
+import array
+import hashlib
+import json
+import optparse
+import random
+import re
+import sys
+import unicodedata
+import zlib
+from article import ScholarArticle
+
+# The Mersenne prime for the universal hash functions that simulate the
+# permutations. It keeps (a * h + b) below 2**63 for 32-bit shingle
+# hashes, which avoids slow long-integer arithmetic.
+_PRIME = (1 << 31) - 1
+
+_TAG_RE = re.compile(r'\[(citation|c|pdf|html|book|b|doc)\]', re.IGNORECASE)
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _fold(text):
+    """Lowercases text and strips accents and punctuation."""
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', 'replace')
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = u''.join([c for c in text if not unicodedata.combining(c)])
+    return u' '.join(_WORD_RE.findall(_TAG_RE.sub(u' ', text)))
+
+
+def normalize_title(title):
+    """Returns the title lowercased, without accents, punctuation and tags."""
+    return _fold(title or u'')
+
+
+def normalize_authors(authors):
+    """
+    Returns the authors' last names from an authors line as parsed from
+    a results page, e.g. 'A Einstein, B Podolsky - Physical Review'.
+    """
+    if not authors:
+        return []
+    names = authors.split(' - ')[0]
+    res = []
+    for name in names.split(','):
+        words = _fold(name).split()
+        if words:
+            res.append(words[-1])
+    return res
+
+
+def record_key(record):
+    """
+    Returns the ID a record is indexed under: its cluster ID, or else a
+    hash of its normalized title, authors and year. Result files are
+    rewritten from the start by every crawl, so a record's position in
+    a file does not identify it.
+    """
+    record = _as_dict(record)
+    if record.get('cluster_id'):
+        return u'cluster:%s' % record['cluster_id']
+    text = u'|'.join([normalize_title(record.get('title')),
+                      u' '.join(normalize_authors(record.get('authors'))),
+                      u'%s' % (record.get('year') or u'')])
+    return u'hash:' + hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _as_dict(record):
+    if isinstance(record, ScholarArticle):
+        return record.as_dict()
+    return record
+
+
+class MinHasher(object):
+
+    """
+    Computes MinHash signatures of sets of shingles. Each of the
+    num_perm signature values is the minimum of a universal hash
+    function over the shingles' CRC32 values.
+    """
+
+    def __init__(self, num_perm=64, seed=1):
+        rnd = random.Random(seed)
+        self.num_perm = num_perm
+        self.params = [(rnd.randint(1, _PRIME - 1), rnd.randint(0, _PRIME - 1))
+                       for _ in range(num_perm)]
+
+    def signature(self, shingles):
+        hashes = [zlib.crc32(shingle.encode('utf-8')) & 0xffffffff
+                  for shingle in shingles]
+        return array.array('L', [min([(a * h + b) % _PRIME for h in hashes])
+                                 for a, b in self.params])
+
+    @staticmethod
+    def similarity(sig1, sig2):
+        """Returns the Jaccard similarity estimated from two signatures."""
+        same = sum(1 for val1, val2 in zip(sig1, sig2) if val1 == val2)
+        return float(same) / len(sig1)
+
+
+def shingles(record, size=4):
+    """
+    Returns the set of shingles for a record: character n-grams of its
+    normalized title plus one shingle per author last name.
+    """
+    title = normalize_title(record.get('title'))
+    res = set()
+    if len(title) <= size:
+        if title:
+            res.add(title)
+    else:
+        for idx in range(len(title) - size + 1):
+            res.add(title[idx:idx + size])
+    for name in normalize_authors(record.get('authors')):
+        res.add(u'author:' + name)
+    return res
+
+
+def lsh_bands(num_perm, threshold):
+    """
+    Returns the (bands, rows) split of a signature whose LSH threshold,
+    (1/bands)^(1/rows), is closest to but not above the given
+    similarity threshold.
+    """
+    best = (1, num_perm)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1.0 / bands) ** (1.0 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+
+class ScholarDedupIndex(object):
+
+    """
+    An incremental index of records, finding near-duplicates as records
+    are added. Records are article dictionaries (as written by --json)
+    or ScholarArticle instances, identified by any hashable ID, usually
+    record_key().
+
+    Two records are merged if they share a cluster ID, or if their
+    estimated title/author similarity reaches the threshold and their
+    years differ by no more than year_slack (a missing year matches
+    any year).
+    """
+
+    def __init__(self, threshold=0.7, num_perm=64, year_slack=2, seed=1):
+        self.threshold = threshold
+        self.year_slack = year_slack
+        self.hasher = MinHasher(num_perm, seed)
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = {}
+        self.meta = {}
+        self.clusters = {}
+        self.parent = {}
+
+    def __len__(self):
+        return len(self.meta)
+
+    def add(self, record_id, record, source=None):
+        """
+        Adds a record and returns the IDs of the already indexed records
+        it was found to duplicate. source, e.g. (file name, position),
+        tells where the record was last seen. A record ID indexed
+        already only gets the new source, and nothing is returned, as
+        with IDs from record_key() it is the same record.
+        """
+        if record_id in self.meta:
+            if source is not None:
+                self.meta[record_id]['source'] = list(source)
+            return []
+        record = _as_dict(record)
+        year = record.get('year')
+        try:
+            year = int(year) if year else None
+        except ValueError:
+            year = None
+        meta = {'title': record.get('title'), 'year': year,
+                'cluster_id': record.get('cluster_id'),
+                'source': list(source) if source is not None else None}
+        shingle_set = shingles(record)
+        sig = self.hasher.signature(shingle_set) if shingle_set else None
+        return self._insert(record_id, meta, sig)
+
+    def groups(self, min_size=2):
+        """Returns the merge groups as lists of record IDs."""
+        res = {}
+        for record_id in self.meta:
+            res.setdefault(self._find(record_id), []).append(record_id)
+        return [sorted(group) for group in res.values()
+                if len(group) >= min_size]
+
+    def save(self, file_name):
+        """
+        Writes the index to a JSON lines file, one record per line, from
+        which load() rebuilds it.
+        """
+        with open(file_name, 'w') as data_file:
+            data_file.write(json.dumps({'threshold': self.threshold,
+                                        'num_perm': self.hasher.num_perm,
+                                        'year_slack': self.year_slack}) + '\n')
+            for record_id, meta in self.meta.items():
+                sig = self.signatures.get(record_id)
+                data_file.write(json.dumps(
+                    {'id': record_id, 'meta': meta,
+                     'sig': list(sig) if sig is not None else None}) + '\n')
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name) as data_file:
+            params = json.loads(next(data_file))
+            index = cls(threshold=params['threshold'],
+                        num_perm=params['num_perm'],
+                        year_slack=params['year_slack'])
+            for line in data_file:
+                rec = json.loads(line)
+                record_id = rec['id']
+                if isinstance(record_id, list):
+                    record_id = tuple(record_id)
+                sig = rec['sig']
+                if sig is not None:
+                    sig = array.array('L', sig)
+                index._insert(record_id, rec['meta'], sig)
+        return index
+
+    def _insert(self, record_id, meta, sig):
+        self.meta[record_id] = meta
+        self.parent[record_id] = record_id
+        matches = set()
+
+        cluster_id = meta['cluster_id']
+        if cluster_id:
+            if cluster_id in self.clusters:
+                matches.add(self.clusters[cluster_id])
+            else:
+                self.clusters[cluster_id] = record_id
+
+        if sig is not None:
+            self.signatures[record_id] = sig
+            candidates = set()
+            for band, buckets in enumerate(self.buckets):
+                key = hash(tuple(sig[band * self.rows:(band + 1) * self.rows]))
+                bucket = buckets.setdefault(key, [])
+                candidates.update(bucket)
+                bucket.append(record_id)
+            for other in candidates:
+                if self._is_duplicate(record_id, other):
+                    matches.add(other)
+
+        for other in matches:
+            self._union(record_id, other)
+        return sorted(matches)
+
+    def _is_duplicate(self, id1, id2):
+        year1 = self.meta[id1]['year']
+        year2 = self.meta[id2]['year']
+        if year1 and year2 and abs(year1 - year2) > self.year_slack:
+            return False
+        return MinHasher.similarity(self.signatures[id1],
+                                    self.signatures[id2]) >= self.threshold
+
+    def _find(self, record_id):
+        root = record_id
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[record_id] != root:
+            self.parent[record_id], record_id = root, self.parent[record_id]
+        return root
+
+    def _union(self, id1, id2):
+        root1 = self._find(id1)
+        root2 = self._find(id2)
+        if root1 != root2:
+            self.parent[root2] = root1
+
+
+def main():
+    usage = 'dedup.py [options] <results.json> ...\n' \
+        'Finds near-duplicate articles in --json result files and prints\n' \
+        'the merge groups as JSON.'
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--threshold', type='float', default=0.7,
+                      help='Title/author similarity needed to merge records (default: 0.7)')
+    parser.add_option('--year-slack', type='int', default=2,
+                      help='Largest year difference between merged records (default: 2)')
+    parser.add_option('--index', metavar='FILE', default=None,
+                      help='Index file to load (if it exists) and to update with the given files')
+    options, args = parser.parse_args()
+
+    index = None
+    if options.index is not None:
+        try:
+            index = ScholarDedupIndex.load(options.index)
+        except IOError:
+            pass
+    if index is None:
+        index = ScholarDedupIndex(threshold=options.threshold,
+                                  year_slack=options.year_slack)
+
+    for file_name in args:
+        with open(file_name) as data_file:
+            records = json.load(data_file)
+        for idx, record in enumerate(records):
+            index.add(record_key(record), record, source=(file_name, idx))
+
+    if options.index is not None:
+        index.save(options.index)
+
+    groups = []
+    for group in index.groups():
+        res = []
+        for record_id in group:
+            meta = index.meta[record_id]
+            # Indexes saved before record_key() used the source as ID.
+            source = meta.get('source') or record_id
+            res.append({'file': source[0], 'index': source[1],
+                        'title': meta['title'], 'year': meta['year'],
+                        'cluster_id': meta['cluster_id']})
+        groups.append(res)
+    json.dump(groups, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
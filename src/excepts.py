@@ -15,3 +15,30 @@ class FormatError(Error):
 class QueryArgumentError(Error):
 
     """A query did not have a suitable set of arguments."""
+
+
+class ChallengeError(Error):
+
+    """Scholar answered with a "not a robot" challenge page."""
+
+    def __init__(self, url):
+        Error.__init__(self, 'challenge page for %s' % url)
+        self.url = url
+
+
+class FetchError(Error):
+
+    """A results page could not be fetched, even after retrying."""
+
+    def __init__(self, url):
+        Error.__init__(self, 'could not fetch %s' % url)
+        self.url = url
+
+
+class LeaseError(Error):
+
+    """A work queue task was leased to another worker meanwhile."""
+
+    def __init__(self, task_id):
+        Error.__init__(self, 'lease on task %d lost' % task_id)
+        self.task_id = task_id
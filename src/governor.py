@@ -0,0 +1,110 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module caps the combined request rate of all pyscholar processes
+on a host. The processes share a token bucket per job in a small state
+file, locked with fcntl while it is read and updated. The host-wide
+rate is split between the jobs that sent requests recently, in
+proportion to their weights, so adding workers does not raise the
+aggregate rate and a busy job cannot starve the others.
+"""
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+from utils import ScholarUtils
+
+
+class ScholarRateGovernor(object):
+
+    """
+    A host-wide rate limit of rate requests per second, shared through
+    file_name. Call acquire() before each request; it waits until the
+    job may send one. A job's bucket refills at its share of the rate,
+    rate * weight / (sum of the active jobs' weights), and holds up to
+    burst seconds' worth of its share. Jobs not seen for stale_after
+    seconds, e.g. because they finished, no longer count as active.
+    """
+
+    def __init__(self, file_name, rate, weight=1.0, job=None, burst=2.0,
+                 stale_after=60.0):
+        self.file_name = file_name
+        self.rate = float(rate)
+        self.weight = float(weight)
+        self.job = job or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.burst = burst
+        self.stale_after = stale_after
+        self.stats = {'requests': 0, 'wait_seconds': 0.0, 'max_wait': 0.0}
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Waits for a token; returns the seconds waited."""
+        start = time.time()
+        with self._lock:
+            while True:
+                wait = self._take()
+                if wait <= 0:
+                    break
+                # Shares change as jobs come and go, so look again soon.
+                time.sleep(min(wait, 1.0))
+            waited = time.time() - start
+            self.stats['requests'] += 1
+            self.stats['wait_seconds'] += waited
+            self.stats['max_wait'] = max(self.stats['max_wait'], waited)
+        return waited
+
+    def report(self):
+        stats = dict(self.stats)
+        if stats['requests']:
+            stats['mean_wait'] = stats['wait_seconds'] / stats['requests']
+        return stats
+
+    def _take(self):
+        # Takes a token if there is one and returns 0, or else returns
+        # the seconds until there will be one.
+        def take(jobs, now):
+            entry = jobs.get(self.job)
+            if entry is None:
+                entry = {'tokens': 1.0, 'last': now}
+                jobs[self.job] = entry
+            entry['weight'] = self.weight
+            entry['seen'] = now
+            total = sum(job['weight'] for job in jobs.values())
+            share = self.rate * self.weight / total
+            entry['tokens'] = min(max(1.0, self.burst * share),
+                                  entry['tokens'] +
+                                  (now - entry['last']) * share)
+            entry['last'] = now
+            if entry['tokens'] >= 1.0:
+                entry['tokens'] -= 1.0
+                return 0.0
+            return (1.0 - entry['tokens']) / share
+        return self._update(take)
+
+    def _update(self, func):
+        # Calls func(jobs, now) on the shared state, with stale jobs
+        # dropped, under the file lock, and writes the state back.
+        fd = os.open(self.file_name, os.O_RDWR | os.O_CREAT, 0o666)
+        with os.fdopen(fd, 'r+') as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                try:
+                    jobs = json.loads(state_file.read() or '{}')
+                except ValueError:
+                    ScholarUtils.log('warn', 'resetting corrupt governor '
+                                     'state in %s' % self.file_name)
+                    jobs = {}
+                for job in list(jobs):
+                    if now - jobs[job]['seen'] > self.stale_after:
+                        del jobs[job]
+                res = func(jobs, now)
+                state_file.seek(0)
+                state_file.truncate()
+                state_file.write(json.dumps(jobs))
+                state_file.flush()
+                return res
+            finally:
+                fcntl.flock(state_file, fcntl.LOCK_UN)
@@ -0,0 +1,472 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module keeps a local full-text index over harvested articles, so
+we can look up whether we have an article already instead of asking
+Scholar again. The title, authors and excerpt of every article are
+indexed in an inverted index on disk, with varint-delta compressed
+postings that keep word positions for phrase queries. Matches are
+ranked by tf-idf, with title matches counting double.
+
+The index is a directory:
+
+  segments.json    the segments in use, and how much of the docs files
+                   they cover
+  docs.jsonl       one indexed article per line
+  docs.off         offsets of the lines, 8 bytes each
+  seg-00000.terms  term dictionary of a segment: term -> offset, length
+  seg-00000.post   postings of a segment
+  ...
+
+New articles go into a new segment on flush(); the segments are merged
+into one once there are more than MAX_SEGMENTS of them. Segments are
+never rewritten: every flush and merge writes a segment under a new
+number and then takes effect at once by replacing segments.json, so an
+interrupted one leaves the index as it was. Articles are indexed once,
+identified by cluster ID, or else URL or title.
+
+Queries are words, all of which must match; "quoted phrases"; words or
+phrases joined by OR; and -words that must not match:
+
+  index.py ../index --add ../results/*.json
+  index.py ../index 'einstein "quantum theory" -relativity'
+"""
+import json
+import math
+import optparse
+import os
+import re
+import struct
+import sys
+import unicodedata
+from utils import encode
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_QUERY_RE = re.compile(r'(-?)"([^"]*)"|(\S+)', re.UNICODE)
+
+# Where the fields start in a document's word positions. The gaps keep
+# phrases from matching across fields.
+_FIELDS = (('title', 0), ('authors', 1000), ('excerpt', 2000))
+_FIELD_LEN = 1000
+
+_OFFSET = struct.Struct('<Q')
+
+MAX_SEGMENTS = 16
+
+
+def tokenize(text):
+    """Returns the lowercased words of text, without accents."""
+    if not text:
+        return []
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', 'replace')
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = u''.join([c for c in text if not unicodedata.combining(c)])
+    return _WORD_RE.findall(text)
+
+
+def doc_key(record):
+    """Returns the key an article is indexed under only once."""
+    for key in ('cluster_id', 'url', 'title'):
+        if record.get(key):
+            return u'%s:%s' % (key, record[key])
+    return None
+
+
+def encode_varint(num, out):
+    while num >= 0x80:
+        out.append((num & 0x7f) | 0x80)
+        num >>= 7
+    out.append(num)
+
+
+def decode_varint(data, pos):
+    """Returns the number at pos in data and the position after it."""
+    num = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        num |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return num, pos
+        shift += 7
+
+
+def encode_postings(postings):
+    """
+    Encodes a list of (doc ID, positions) sorted by doc ID as: number
+    of docs, then per doc the doc ID delta, the number of positions and
+    the position deltas, all varints.
+    """
+    out = bytearray()
+    encode_varint(len(postings), out)
+    last_doc = 0
+    for doc, positions in postings:
+        encode_varint(doc - last_doc, out)
+        last_doc = doc
+        encode_varint(len(positions), out)
+        last_pos = 0
+        for pos in positions:
+            encode_varint(pos - last_pos, out)
+            last_pos = pos
+    return out
+
+
+def decode_postings(data):
+    """Decodes what encode_postings() returns."""
+    data = bytearray(data)
+    num, pos = decode_varint(data, 0)
+    res = []
+    doc = 0
+    for _ in range(num):
+        delta, pos = decode_varint(data, pos)
+        doc += delta
+        count, pos = decode_varint(data, pos)
+        positions = []
+        last = 0
+        for _ in range(count):
+            delta, pos = decode_varint(data, pos)
+            last += delta
+            positions.append(last)
+        res.append((doc, positions))
+    return res
+
+
+class ScholarIndex(object):
+
+    """
+    An inverted index over articles in a directory. Use add() or
+    add_files() to index articles, flush() to make them searchable and
+    search() to query.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._docs_file = os.path.join(directory, 'docs.jsonl')
+        self._offsets_file = os.path.join(directory, 'docs.off')
+        self._manifest_file = os.path.join(directory, 'segments.json')
+        if os.path.exists(self._manifest_file):
+            with open(self._manifest_file) as manifest_file:
+                manifest = json.load(manifest_file)
+            self._names = manifest['segments']
+            self._next_segment = manifest['next']
+            self._num_docs = manifest['num_docs']
+            self._docs_size = manifest['docs_size']
+            # Drop what an interrupted flush appended.
+            self._truncate(self._docs_file, self._docs_size)
+            self._truncate(self._offsets_file,
+                           self._num_docs * _OFFSET.size)
+        else:
+            # Written before there was a manifest: the segments are
+            # numbered from 0 on.
+            self._names = []
+            while os.path.exists(self._segment_file(
+                    self._segment_name(len(self._names)), 'terms')):
+                self._names.append(self._segment_name(len(self._names)))
+            self._next_segment = len(self._names)
+            self._num_docs = 0
+            self._docs_size = 0
+            if os.path.exists(self._offsets_file):
+                self._num_docs = os.path.getsize(self._offsets_file) \
+                    // _OFFSET.size
+                self._docs_size = os.path.getsize(self._docs_file)
+        self._segments = []
+        for name in self._names:
+            with open(self._segment_file(name, 'terms')) as terms_file:
+                self._segments.append(json.load(terms_file))
+        self._keys = None
+        self._pending = {}
+        self._pending_docs = []
+
+    def __len__(self):
+        return self._num_docs + len(self._pending_docs)
+
+    def add(self, record, source=None):
+        """
+        Adds an article (a dictionary as written by --json, or a
+        ScholarArticle) unless it is indexed already. Returns True if it
+        was added.
+        """
+        if hasattr(record, 'as_dict'):
+            record = record.as_dict()
+        if self._keys is None:
+            self._load_keys()
+        key = doc_key(record)
+        if key is not None:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+        doc = len(self)
+        words = {}
+        for field, start in _FIELDS:
+            for pos, word in enumerate(tokenize(record.get(field))[:_FIELD_LEN]):
+                words.setdefault(word, []).append(start + pos)
+        for word, positions in words.items():
+            self._pending.setdefault(word, []).append((doc, positions))
+        self._pending_docs.append({
+            'key': key, 'source': source, 'title': record.get('title'),
+            'authors': record.get('authors'), 'year': record.get('year'),
+            'url': record.get('url'), 'cluster_id': record.get('cluster_id'),
+            'num_citations': record.get('num_citations'),
+            'excerpt': record.get('excerpt')})
+        return True
+
+    def add_files(self, file_names):
+        """Adds the articles of --json result files and flushes."""
+        added = 0
+        for file_name in file_names:
+            with open(file_name) as data_file:
+                for record in json.load(data_file):
+                    added += self.add(record, source=file_name)
+        self.flush()
+        return added
+
+    def flush(self):
+        """
+        Writes the articles added since the last flush as a segment, and
+        their documents after it. Both count once the manifest is
+        replaced.
+        """
+        if not self._pending_docs:
+            return
+        name, terms = self._write_segment(self._pending)
+        docs_size = self._docs_size
+        offsets = bytearray()
+        lines = []
+        for doc in self._pending_docs:
+            offsets += _OFFSET.pack(docs_size)
+            lines.append(json.dumps(doc).encode('utf-8') + b'\n')
+            docs_size += len(lines[-1])
+        with open(self._docs_file, 'ab') as docs_file:
+            docs_file.write(b''.join(lines))
+        with open(self._offsets_file, 'ab') as offsets_file:
+            offsets_file.write(offsets)
+        self._write_manifest(self._names + [name],
+                             self._num_docs + len(self._pending_docs),
+                             docs_size)
+        self._segments.append(terms)
+        self._pending = {}
+        self._pending_docs = []
+        if len(self._segments) > MAX_SEGMENTS:
+            self.compact()
+
+    def compact(self):
+        """
+        Merges all segments into a new one, which replaces them when the
+        manifest is replaced.
+        """
+        merged = {}
+        for segment in range(len(self._segments)):
+            for term in self._segments[segment]:
+                merged.setdefault(term, []).extend(
+                    self._read_postings(segment, term))
+        name, terms = self._write_segment(merged)
+        old = self._names
+        self._write_manifest([name], self._num_docs, self._docs_size)
+        self._segments = [terms]
+        for old_name in old:
+            for ext in ('terms', 'post'):
+                os.remove(self._segment_file(old_name, ext))
+
+    def postings(self, term):
+        """Returns the (doc ID, positions) list of a term, by doc ID."""
+        res = []
+        for segment in range(len(self._segments)):
+            res.extend(self._read_postings(segment, term))
+        return res
+
+    def search(self, query, limit=10):
+        """
+        Returns up to limit (score, article) pairs matching the query,
+        best first.
+        """
+        must, must_not = self._parse(query)
+        if not must:
+            return []
+        scores = None
+        for group in must:
+            group_scores = {}
+            for words in group:
+                for doc, score in self._match(words).items():
+                    group_scores[doc] = group_scores.get(doc, 0.0) + score
+            if scores is None:
+                scores = group_scores
+            else:
+                scores = dict((doc, score + group_scores[doc])
+                              for doc, score in scores.items()
+                              if doc in group_scores)
+            if not scores:
+                return []
+        for words in must_not:
+            for doc in self._match(words):
+                scores.pop(doc, None)
+        best = sorted(scores.items(), key=lambda item: -item[1])[:limit]
+        return [(score, self.get(doc)) for doc, score in best]
+
+    def get(self, doc):
+        """Returns the indexed article with the given doc ID."""
+        with open(self._offsets_file, 'rb') as offsets_file:
+            offsets_file.seek(doc * _OFFSET.size)
+            offset = _OFFSET.unpack(offsets_file.read(_OFFSET.size))[0]
+        with open(self._docs_file, 'rb') as docs_file:
+            docs_file.seek(offset)
+            return json.loads(docs_file.readline().decode('utf-8'))
+
+    def _parse(self, query):
+        # Returns the AND of OR groups of word lists, and the word lists
+        # that must not match. A word list of more than one word is a
+        # phrase.
+        must = []
+        must_not = []
+        join = False
+        for neg, phrase, word in _QUERY_RE.findall(query):
+            if word == 'OR':
+                join = True
+                continue
+            if phrase:
+                words = tokenize(phrase)
+            else:
+                if word.startswith('-'):
+                    neg, word = '-', word[1:]
+                words = tokenize(word)
+            if not words:
+                continue
+            if neg:
+                must_not.append(words)
+            elif join and must:
+                must[-1].append(words)
+            else:
+                must.append([words])
+            join = False
+        return must, must_not
+
+    def _match(self, words):
+        # Returns doc ID -> tf-idf score of the docs containing the
+        # words, as a phrase if there are several.
+        num_docs = max(1, self._num_docs)
+        docs = None
+        score = {}
+        for idx, word in enumerate(words):
+            postings = self.postings(word)
+            if not postings:
+                return {}
+            idf = math.log(1.0 + float(num_docs) / len(postings))
+            current = {}
+            for doc, positions in postings:
+                if docs is not None:
+                    if doc not in docs:
+                        continue
+                    # Keep the positions continuing the phrase.
+                    positions = [pos for pos in positions
+                                 if pos - idx in docs[doc]]
+                    if not positions:
+                        continue
+                    starts = set(pos - idx for pos in positions)
+                else:
+                    starts = set(positions)
+                title = sum(1 for pos in positions if pos < _FIELD_LEN)
+                weight = 1.0 + math.log(len(positions) + title)
+                current[doc] = starts
+                score[doc] = score.get(doc, 0.0) + weight * idf
+            docs = current
+        return dict((doc, score[doc]) for doc in docs)
+
+    def _load_keys(self):
+        self._keys = set()
+        if os.path.exists(self._docs_file):
+            with open(self._docs_file, 'rb') as docs_file:
+                for line in docs_file:
+                    key = json.loads(line.decode('utf-8'))['key']
+                    if key is not None:
+                        self._keys.add(key)
+
+    @staticmethod
+    def _segment_name(number):
+        return 'seg-%05d' % number
+
+    def _segment_file(self, name, ext):
+        return os.path.join(self.directory, '%s.%s' % (name, ext))
+
+    @staticmethod
+    def _truncate(file_name, size):
+        if os.path.exists(file_name) and os.path.getsize(file_name) > size:
+            with open(file_name, 'r+b') as data_file:
+                data_file.truncate(size)
+
+    def _read_postings(self, segment, term):
+        entry = self._segments[segment].get(term)
+        if entry is None:
+            return []
+        with open(self._segment_file(self._names[segment], 'post'),
+                  'rb') as post_file:
+            post_file.seek(entry[0])
+            return decode_postings(post_file.read(entry[1]))
+
+    def _write_segment(self, postings):
+        # Writes the postings as a segment with a number not used before
+        # and returns its name and term dictionary. The segment is not
+        # used until it is in the manifest.
+        name = self._segment_name(self._next_segment)
+        self._next_segment += 1
+        terms = {}
+        with open(self._segment_file(name, 'post'), 'wb') as post_file:
+            for term in sorted(postings):
+                data = encode_postings(sorted(postings[term]))
+                terms[term] = [post_file.tell(), len(data)]
+                post_file.write(data)
+        with open(self._segment_file(name, 'terms'), 'w') as terms_file:
+            json.dump(terms, terms_file)
+        return name, terms
+
+    def _write_manifest(self, names, num_docs, docs_size):
+        # Replacing the manifest is what makes a flush or merge count.
+        tmp_name = self._manifest_file + '.tmp'
+        with open(tmp_name, 'w') as manifest_file:
+            json.dump({'segments': names, 'next': self._next_segment,
+                       'num_docs': num_docs, 'docs_size': docs_size},
+                      manifest_file)
+        os.rename(tmp_name, self._manifest_file)
+        self._names = names
+        self._num_docs = num_docs
+        self._docs_size = docs_size
+
+
+def main():
+    usage = 'index.py [options] <index directory> [query]\n' \
+        'Updates or searches a local index of harvested articles.'
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--add', action='store_true', default=False,
+                      help='Index the articles of the --json result files given after the directory')
+    parser.add_option('--compact', action='store_true', default=False,
+                      help='Merge the index segments into one')
+    parser.add_option('-n', '--limit', type='int', default=10,
+                      help='Number of matches to show (default: 10)')
+    options, args = parser.parse_args()
+    if not args:
+        parser.print_help()
+        return 1
+
+    index = ScholarIndex(args[0])
+    if options.add:
+        added = index.add_files(args[1:])
+        print('%d articles added, %d indexed' % (added, len(index)))
+    elif len(args) > 1:
+        print_matches(index.search(' '.join(args[1:]), limit=options.limit))
+    if options.compact:
+        index.compact()
+    return 0
+
+
+def print_matches(matches):
+    for score, doc in matches:
+        line = u'%6.2f  %s (%s) %s' % (score, doc['title'], doc['year'],
+                                       doc['url'] or '')
+        print(encode(line))
+        if doc['authors']:
+            print(encode(u'        %s' % doc['authors']))
+
+if __name__ == "__main__":
+    sys.exit(main())
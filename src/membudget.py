@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module keeps the results of long crawls within a memory budget.
+A ScholarResultBuffer collects the records written with --json; once
+the process's resident set size or the number of buffered records
+exceeds the ScholarMemoryBudget, the buffered records are spilled:
+appended to the JSON results file itself, in the order they came, and
+dropped from memory. The results file is valid JSON after every spill,
+so a crawl that gets killed keeps what it spilled. The budget keeps
+track of the peaks for the report at exit.
+"""
+import json
+import os
+import resource
+import sys
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def rss_mb():
+    """
+    Returns the resident set size of this process in MiB: the current
+    one where /proc tells, else the peak one.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE / 1048576.0
+    except (IOError, OSError, IndexError, ValueError):
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            rss //= 1024
+        return rss / 1024.0
+
+
+class ScholarMemoryBudget(object):
+
+    """
+    A memory budget of max_rss megabytes of resident memory and
+    max_records buffered records; either may be None for no limit.
+    The process hardly ever gives memory back, so its resident size
+    stays over max_rss after a spill; the next spill comes once it grew
+    by a twentieth of max_rss since the last one, that is, once the
+    records buffered since take up more than the spilled ones freed.
+    """
+
+    def __init__(self, max_rss=None, max_records=None):
+        self.max_rss = max_rss
+        self.max_records = max_records
+        self.stats = {'peak_rss_mb': 0.0, 'peak_records': 0, 'spills': 0,
+                      'spilled_records': 0}
+        self._spill_rss = 0.0
+
+    def exceeded(self, num_records):
+        """
+        Returns True if the process or num_records buffered records are
+        over the budget, and records the peaks.
+        """
+        rss = rss_mb()
+        self.stats['peak_rss_mb'] = max(self.stats['peak_rss_mb'], rss)
+        self.stats['peak_records'] = max(self.stats['peak_records'],
+                                         num_records)
+        if self.max_records is not None and num_records >= self.max_records:
+            return True
+        if self.max_rss is None or \
+           rss < max(self.max_rss, self._spill_rss + self.max_rss / 20.0):
+            return False
+        self._spill_rss = rss
+        return True
+
+    def report(self):
+        stats = dict(self.stats)
+        stats['peak_rss_mb'] = round(stats['peak_rss_mb'], 1)
+        return stats
+
+
+class ScholarResultBuffer(object):
+
+    """
+    The records of one results file, kept in memory up to the budget and
+    spilled to the results file beyond it. add() records, finish()
+    writes those still in memory and clears the buffer.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.file_name = None
+        self.records = []
+        self.num_spilled = 0
+
+    def __len__(self):
+        return self.num_spilled + len(self.records)
+
+    def add(self, records, file_name):
+        """
+        Adds records for the results file file_name. Returns True if the
+        records are all in memory, so that writing the file now is
+        cheap, or False if some were spilled and the rest are appended
+        by the next spill or finish().
+        """
+        self.file_name = file_name
+        self.records.extend(records)
+        if self.budget is not None and self.budget.exceeded(len(self.records)):
+            self.spill()
+        return not self.num_spilled
+
+    def spill(self):
+        """
+        Appends the records in memory to the results file, which the
+        first spill writes anew, and drops them from memory.
+        """
+        if not self.records:
+            return
+        if not self.num_spilled:
+            tmp_name = self.file_name + '.tmp'
+            with open(tmp_name, 'wb') as data_file:
+                data_file.write(b'[')
+                self._write_records(data_file, '')
+            os.rename(tmp_name, self.file_name)
+        else:
+            with open(self.file_name, 'r+b') as data_file:
+                # Overwrite the closing bracket.
+                data_file.seek(-1, os.SEEK_END)
+                self._write_records(data_file, ', ')
+        self.num_spilled += len(self.records)
+        if self.budget is not None:
+            self.budget.stats['spills'] += 1
+            self.budget.stats['spilled_records'] += len(self.records)
+        self.records = []
+
+    def write(self, file_name=None):
+        """
+        Writes all records to the JSON results file: the records in
+        memory, after those spilled to it.
+        """
+        if self.num_spilled:
+            self.spill()
+            return
+        file_name = file_name or self.file_name
+        if file_name is None:
+            return
+        with open(file_name, 'w') as data_file:
+            json.dump(self.records, data_file)
+
+    def finish(self):
+        """Writes the results file if records were spilled, and clears."""
+        if self.num_spilled:
+            self.spill()
+        self.clear()
+
+    def clear(self):
+        self.records = []
+        self.num_spilled = 0
+        self.file_name = None
+
+    def _write_records(self, data_file, sep):
+        # The records and the closing bracket; JSON is ASCII as dumped.
+        for record in self.records:
+            data_file.write((sep + json.dumps(record)).encode('ascii'))
+            sep = ', '
+        data_file.write(b']')
@@ -0,0 +1,34 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module holds fetched pages. The browser hands us a page as text;
+a ScholarPage keeps that text, decoded once, together with its
+encoding, and is passed by reference to everything that needs the
+page: challenge detection, the recorder, the archive and the parser,
+which is told the encoding instead of guessing it. Only the archive
+needs the page as bytes, and encodes it itself.
+"""
+
+
+class ScholarPage(object):
+
+    """
+    A fetched page: its text, the URL it came from, and the encoding
+    to use when it is stored as bytes.
+    """
+    __slots__ = ('url', 'text', 'encoding')
+
+    def __init__(self, text, url=None, encoding='utf-8'):
+        self.url = url
+        self.text = text
+        self.encoding = encoding
+
+    def __len__(self):
+        return len(self.text)
+
+    def contains_any(self, texts):
+        """Returns True if any of the texts occurs in the page."""
+        for text in texts:
+            if text in self.text:
+                return True
+        return False
@@ -5,12 +5,15 @@
 import re
 import sys
 from article import ScholarArticle
+from page import ScholarPage
 from utils import ScholarConf
 
 # Import BeautifulSoup -- try 4 first, fall back to older
 try:
     from bs4 import BeautifulSoup
+    _BS4 = True
 except ImportError:
+    _BS4 = False
     try:
         from BeautifulSoup import BeautifulSoup
     except ImportError:
@@ -49,9 +52,19 @@ class ScholarArticleParser(object):
         """
         This method initiates parsing of HTML content, cleans resulting
         content as needed, and notifies the parser instance of
-        resulting instances via the handle_article callback.
+        resulting instances via the handle_article callback. The HTML
+        is a ScholarPage, text, or UTF-8 encoded bytes.
         """
-        self.soup = BeautifulSoup(html)
+        for art in self.iter_articles(html):
+            self.handle_article(art)
+
+    def iter_articles(self, html):
+        """
+        Like parse(), but a generator yielding the articles as they are
+        parsed instead of passing them to handle_article. Global
+        attributes are still reported via handle_num_results.
+        """
+        self.soup = self._make_soup(html)
 
         # This parses any global, non-itemized attributes from the page.
         self._parse_globals()
@@ -61,7 +74,36 @@ class ScholarArticleParser(object):
             self._parse_article(div)
             self._clean_article()
             if self.article['title']:
-                self.handle_article(self.article)
+                yield self.article
+
+    @staticmethod
+    def _make_soup(html):
+        # The encoding is known, so BeautifulSoup need not guess it, and
+        # the tree builder is set (see ScholarConf.HTML_PARSER), so it
+        # need not pick one either, when lxml is installed. A page's text
+        # is encoded again: lxml was measured slower on decoded text.
+        encoding = 'utf-8'
+        if isinstance(html, ScholarPage):
+            html, encoding = html.text, html.encoding
+            if not isinstance(html, bytes):
+                html = html.encode(encoding)
+        if not _BS4:
+            return BeautifulSoup(html)
+        if isinstance(html, bytes):
+            return BeautifulSoup(html, ScholarConf.HTML_PARSER,
+                                 from_encoding=encoding)
+        return BeautifulSoup(html, ScholarConf.HTML_PARSER)
+
+    def release(self):
+        """
+        Frees the parsed page. The tree is full of reference cycles, so
+        without taking it apart it lingers until the garbage collector
+        gets to it; the articles do not refer to it.
+        """
+        if self.soup is not None:
+            self.soup.decompose()
+            self.soup = None
+        self.article = None
 
     def _clean_article(self):
         """
@@ -155,7 +197,7 @@ class ScholarArticleParser(object):
         has a class attribute.
         """
         res = tag.get('class') or []
-        if type(res) != list:
+        if not isinstance(res, list):
             # BeautifulSoup 3 can return e.g. 'gs_md_wp gs_ttss',
             # so split -- conveniently produces a list in any case
             res = res.split()
@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module overlaps fetching result pages with processing them. A
+ScholarPagePrefetcher fetches the next pages of a query in a background
+thread while the caller parses and writes out the current one, so the
+browser is not idle while we parse, and we are not idle while the
+browser loads.
+"""
+import copy
+import threading
+import time
+from utils import ScholarConf
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+
+class ScholarPagePrefetcher(object):
+
+    """
+    Iterating over a prefetcher yields the HTML of consecutive result
+    pages of a query. Up to depth pages are fetched ahead of the page
+    being processed. Fetches are spaced by at least
+    ScholarConf.PAGE_INTERVAL seconds, like unprefetched pages are, and
+    stop once the total number of results reported by Scholar is
+    reached. Call cancel() to drop speculative fetches, e.g. when a page
+    comes back empty; errors raised by a fetch, such as FetchError, are
+    raised again from the iteration.
+    """
+    _DONE = object()
+
+    def __init__(self, querier, query, start, count, depth=1):
+        self.querier = querier
+        # A shallow copy shares the attributes dictionary, so we see the
+        # total number of results once the caller parsed it.
+        self.query = copy.copy(query)
+        self.pages = []
+        done = 0
+        while done < count:
+            num = min(count - done, ScholarConf.MAX_PAGE_RESULTS)
+            self.pages.append((start, num))
+            start += ScholarConf.MAX_PAGE_RESULTS
+            done += num
+        self._results = queue.Queue()
+        self._slots = threading.Semaphore(depth)
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __iter__(self):
+        while True:
+            item = self._results.get()
+            if item is self._DONE:
+                return
+            # The page is being processed now, so another one may be
+            # fetched ahead.
+            self._slots.release()
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def cancel(self):
+        """Stops fetching and waits for an ongoing fetch to finish."""
+        self._cancel.set()
+        self._slots.release()
+        self._thread.join()
+
+    def _run(self):
+        last_fetch = None
+        try:
+            for start, num in self.pages:
+                self._slots.acquire()
+                if self._cancel.is_set():
+                    return
+                total = self.query['num_results']
+                if total and start >= total:
+                    return
+                if last_fetch is not None:
+                    wait = last_fetch + ScholarConf.PAGE_INTERVAL - time.time()
+                    if wait > 0:
+                        time.sleep(wait)
+                self.query.set_starting_number(start)
+                self.query.set_num_page_results(num)
+                try:
+                    html = self.querier.fetch_page(self.query)
+                except Exception as err:
+                    self._results.put(err)
+                    return
+                last_fetch = time.time()
+                self._results.put(html)
+        finally:
+            self._results.put(self._DONE)
@@ -1,16 +1,43 @@
 #! /usr/bin/env python
 # -*- coding: utf8 -*-
 
+import copy
 import optparse
+import os
 import sys
 import time
 import re
-from utils import ScholarUtils, ScholarSettings, ScholarConf, output_query, reset_res
-from query import ClusterScholarQuery, SearchScholarQuery, ScholarQuerier
+import tempfile
+from utils import ScholarUtils, ScholarSettings, ScholarConf, output_query, reset_res, finish_res, json_results
+from query import ScholarQuerier, QUERY_SPEC_KEYS, query_from_spec
+from workqueue import ScholarWorkQueue
+from replay import ReplayDriver, ScholarRecording
+from clusters import ScholarClusterResolver
+from archive import ScholarPageArchive
+from attention import ScholarAttentionQueue
+from excepts import ChallengeError, Error, LeaseError
+from prefetch import ScholarPagePrefetcher
+from daemon import ScholarDaemon
+from batch import ScholarBatch, read_specs
+from adaptive import ScholarAdaptiveController
+from governor import ScholarRateGovernor
+from index import ScholarIndex, print_matches
+from topk import ScholarTopK, KEYS as TOP_KEYS
+from tracing import ScholarTracer, set_tracer, span
+from membudget import ScholarMemoryBudget
+import atexit
 import json
-import pdb
 
-def loop(options, query, querier, file_name='../res.json'):
+def loop(options, query, querier, file_name='../res.json', on_page=None):
+    """
+    Crawls the results of a query into file_name, page by page, calling
+    on_page after every page written. Errors, such as a ChallengeError
+    or a FetchError for a page that could not be fetched, are raised, so
+    that a crawl that stopped short is not taken for a finished one.
+    """
+    if getattr(options, 'top', None) is not None:
+        return top_loop(options, query, querier, file_name, on_page)
+
     if options.start is not None:
         #options.start = min(options.count, ScholarConf.MAX_PAGE_RESULTS)
         query.set_starting_number(options.start)
@@ -21,32 +48,327 @@ def loop(options, query, querier, file_name='../res.json'):
             count = options.count
             start = options.start
             done = 0
-            try:
-                while done < total:
-                    count = min(
-                        total-done, ScholarConf.MAX_PAGE_RESULTS)
-                    query.set_starting_number(start)
-                    query.set_num_page_results(count)
+            if getattr(options, 'prefetch', 0) > 0:
+                return prefetch_loop(options, query, querier, file_name,
+                                     on_page)
+            while done < total:
+                count = min(
+                    total-done, ScholarConf.MAX_PAGE_RESULTS)
+                query.set_starting_number(start)
+                query.set_num_page_results(count)
+                with span('page', start=start):
                     querier.send_query(query)
-                    time.sleep(1)
+                    with span('page_interval'):
+                        time.sleep(ScholarConf.PAGE_INTERVAL)
                     if len(querier.articles) == 0:
                         break
                     output_query(options, querier, file_name)
-                    start += ScholarConf.MAX_PAGE_RESULTS
-                    done += count
-            except Exception, e:
-                print e
-                pdb.set_trace()
-            finally:
-                return 0
+                    if on_page is not None:
+                        on_page()
+                start += ScholarConf.MAX_PAGE_RESULTS
+                done += count
+            return 0
         query.set_num_page_results(options.count)
 
-    querier.send_query(query)
+    with span('page', start=query.starting_number):
+        querier.send_query(query)
+        output_query(options, querier, file_name)
+        if on_page is not None:
+            on_page()
+
+
+def prefetch_loop(options, query, querier, file_name, on_page=None):
+    """
+    Does what loop() does for multi-page results, but fetches up to
+    options.prefetch pages ahead while the current page is parsed and
+    written out. Errors are raised like in loop().
+    """
+    prefetcher = ScholarPagePrefetcher(querier, query, options.start,
+                                       options.count, depth=options.prefetch)
+    try:
+        for html in prefetcher:
+            with span('page'):
+                querier.parse_response(query, html)
+                if len(querier.articles) == 0:
+                    break
+                output_query(options, querier, file_name)
+                if on_page is not None:
+                    on_page()
+    finally:
+        prefetcher.cancel()
+    return 0
+
+
+def top_loop(options, query, querier, file_name, on_page=None):
+    """
+    Does what loop() does, but keeps only the options.top best articles
+    by options.top_key while the results stream in, and writes them out
+    once, best first. Errors are raised like in loop(), and nothing is
+    written then.
+    """
+    if options.start is not None:
+        query.set_starting_number(options.start)
+    top = ScholarTopK(options.top, key=options.top_key,
+                      patience=options.top_patience)
+    top.run(querier.iter_results(query, limit=options.count,
+                                 page_ends=True))
+    ScholarUtils.log('info', 'top %d: %s' % (options.top, top.stats))
+    querier.articles = top.articles()
     output_query(options, querier, file_name)
+    if on_page is not None:
+        on_page()
+    return 0
+
+
+def read_urls(file_name):
+    """
+    Reads a citations list URLs file, either a list of URLs or a list of
+    article dictionaries as written by --json.
+    """
+    with open(file_name) as data_file:
+        urls = json.load(data_file)
+    if isinstance(urls, list) and len(urls) > 0 and isinstance(urls[0], dict):
+        urls = [x['url_citations'] for x in urls]
+    return urls
+
+
+def query_spec(options):
+    """
+    Returns the search the options ask for as a spec for
+    query_from_spec(), with the count and start of results, so it can be
+    run again later without the options.
+    """
+    return dict((key, val) for key, val in vars(options).items()
+                if key in QUERY_SPEC_KEYS + ('count', 'start') and val)
+
+
+def spec_options(options, spec):
+    """Returns a copy of the options with the count and start of spec."""
+    res = copy.copy(options)
+    res.count = spec.get('count', options.count)
+    res.start = spec.get('start', options.start)
+    return res
+
+
+def url_results_file(url):
+    """Returns the JSON results file for a citations list URL."""
+    return '../results/' + re.match('.*?([0-9]+)', url).group(1) + '.json'
+
+
+def open_replay(file_name):
+    """Returns the pages of a --record file or an --archive directory."""
+    if os.path.isdir(file_name):
+        return ScholarPageArchive(file_name)
+    return ScholarRecording(file_name)
+
+
+def make_querier(options, settings, recorder=None, archive=None,
+                 controller=None, governor=None, replay=None):
+    """
+    Returns a new querier set up as the options say, with the settings
+    applied. With --replay, the querier serves pages from replay, as
+    returned by open_replay(), which all queriers share.
+    """
+    if options.replay is not None:
+        if replay is None:
+            replay = open_replay(options.replay)
+        driver = ReplayDriver(replay,
+                              latency=options.replay_latency,
+                              challenge_rate=options.replay_challenge_rate)
+        querier = ScholarQuerier(driver=driver)
+    else:
+        querier = ScholarQuerier()
+    querier.recorder = recorder
+    querier.archive = archive
+    querier.controller = controller
+    querier.governor = governor
+    querier.apply_settings(settings)
+    return querier
+
+
+def crawl(options, query, querier, attention, entry, file_name='../res.json',
+          index=None):
+    """
+    Runs loop() for one crawl and returns True if it went through. If a
+    challenge page stops it, the crawl is parked as the given attention
+    queue entry, and False returned after backing off; other errors are
+    logged, and False returned. With an index, the articles of every
+    page are added to it.
+    """
+    on_page = None
+    if index is not None:
+        def on_page():
+            for art in querier.articles:
+                index.add(art, source=file_name)
+    try:
+        with span('crawl', file_name=file_name):
+            loop(options, query, querier, file_name=file_name,
+                 on_page=on_page)
+    except ChallengeError as err:
+        attention.park(entry, str(err))
+        attention.back_off()
+        return False
+    except Exception as err:
+        ScholarUtils.log('error', 'crawl of %s stopped: %s' % (file_name, err))
+        return False
+    attention.succeeded()
+    return True
+
+
+def release_parked(options, querier, attention):
+    """
+    Runs the work parked in the attention queue again. Each entry is
+    unparked once its work went through; work stopped again stays
+    parked.
+    """
+    entries = attention.release()
+    ScholarUtils.log('info', 'releasing %d parked entries' % len(entries))
+    for entry in entries:
+        if entry['kind'] == 'cluster':
+            # Entries parked before they kept their files take them from
+            # the options.
+            cluster_options = copy.copy(options)
+            cluster_options.cluster_output = entry.get('output',
+                                                       options.cluster_output)
+            cluster_options.cluster_cache = entry.get('cache',
+                                                      options.cluster_cache)
+            stats = resolve_clusters(cluster_options, [querier], attention,
+                                     [entry['cluster_id']])
+            done = stats['resolved'] + stats['cached'] > 0
+        elif entry['kind'] == 'batch':
+            batch = ScholarBatch(querier, os.path.dirname(entry['file_name']),
+                                 batch_file=entry['batch'],
+                                 limit=options.count, attention=attention)
+            batch.run([(entry['line'], entry['spec'])])
+            done = os.path.exists(entry['file_name'])
+        else:
+            # Entries parked before they kept their spec take the search
+            # from the options.
+            spec = entry.get('spec') or dict(vars(options))
+            if entry['kind'] == 'url':
+                spec = dict(spec, url=entry['url'])
+            try:
+                query = query_from_spec(spec)
+            except Error as err:
+                ScholarUtils.log('error', 'cannot release %s: %s'
+                                 % (entry['file_name'], err))
+                continue
+            reset_res()
+            done = crawl(spec_options(options, spec), query, querier,
+                         attention, entry, file_name=entry['file_name'])
+        if done:
+            attention.done(entry)
+
+
+def resolve_clusters(options, queriers, attention, cluster_ids=None):
+    """
+    Resolves the cluster IDs listed in the --cluster-ids file (or the
+    given ones) to their versions, writing one JSON line per cluster.
+    """
+    def read_ids(data_file):
+        for line in data_file:
+            if line.strip():
+                yield line.strip()
+
+    park_info = {'output': options.cluster_output,
+                 'cache': options.cluster_cache}
+    resolver = ScholarClusterResolver(queriers, cache_file=options.cluster_cache,
+                                      limit=options.count, attention=attention,
+                                      park_info=park_info)
+    in_file = None
+    if cluster_ids is None:
+        if options.cluster_ids == '-':
+            in_file = sys.stdin
+        else:
+            in_file = open(options.cluster_ids)
+        cluster_ids = read_ids(in_file)
+    if options.cluster_output == '-':
+        out_file = sys.stdout
+    else:
+        out_file = open(options.cluster_output, 'a')
+    try:
+        resolver.resolve(cluster_ids, out_file)
+    finally:
+        if in_file is not None and in_file is not sys.stdin:
+            in_file.close()
+        if out_file is not sys.stdout:
+            out_file.close()
+        resolver.close()
+    ScholarUtils.log('info', 'clusters: %s' % resolver.stats)
+    return resolver.stats
+
+
+def run_worker(options, querier, queue, attention):
+    """
+    Claims tasks from the work queue and crawls them until no pending
+    task is left. Every crawled page renews the task's lease; once the
+    lease is lost to another worker, the task is dropped. A task stopped
+    by a challenge page goes back to the queue after backing off, for a
+    worker that is not being challenged; the attempt counts, so a task
+    that keeps getting challenged ends up failed. A task is only
+    completed when its crawl went through; any error fails the attempt,
+    so the task is crawled again.
+    """
+    def heartbeat(task):
+        if not queue.heartbeat(task):
+            raise LeaseError(task.id)
+
+    worker = ScholarWorkQueue.worker_name()
+    while True:
+        task = queue.claim(worker)
+        if task is None:
+            break
+        spec = dict(vars(options))
+        task_options = options
+        if task.kind == 'url':
+            spec['url'] = task.payload['url']
+            file_name = url_results_file(task.payload['url'])
+        else:
+            spec.update(task.payload)
+            task_options = spec_options(options, task.payload)
+            file_name = task.payload.get(
+                'output', '../results/query-%d.json' % task.id)
+        try:
+            query = query_from_spec(spec)
+            reset_res()
+            loop(task_options, query, querier, file_name=file_name,
+                 on_page=lambda: heartbeat(task))
+        except LeaseError as err:
+            ScholarUtils.log('warn', '%s; dropping it' % err)
+            continue
+        except ChallengeError as err:
+            queue.fail(task, err, retry=True)
+            attention.notify('%s; task %d returned to the queue'
+                             % (err, task.id))
+            attention.back_off()
+            continue
+        except Exception as e:
+            ScholarUtils.log('error', 'task %d failed: %s' % (task.id, e))
+            queue.fail(task, e)
+            continue
+        attention.succeeded()
+        if not queue.complete(task, {'file': file_name}):
+            ScholarUtils.log('warn', 'task %d was taken over by another '
+                             'worker' % task.id)
+    ScholarUtils.log('info', 'work queue: %s' % queue.stats())
+
+
+def report_memory(budget):
+    """Writes out spilled results and reports the memory peaks."""
+    finish_res()
+    ScholarUtils.log('info', 'memory: %s' % budget.report())
+
+
+def report_parked(attention):
+    if len(attention) > 0:
+        attention.notify('%d entries parked in %s: run again with '
+                         '--release-parked, with --on-challenge debug to '
+                         'solve a challenge in the browser if one shows up'
+                         % (len(attention), attention.file_name))
 
 
 def main():
-    print ""
+    print("")
     usage = """scholar.py [options] <query string>
 A command-line interface to Google Scholar.
 
@@ -94,12 +416,62 @@ scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
                      help='Maximum number of results')
     group.add_option('-S', '--start', type='int', default=0,
                      help='Starting page of results')
+    group.add_option('--prefetch', metavar='N', type='int', default=0,
+                     help='With -c above one page, fetch up to N pages ahead while the current one is processed (default: 0, off)')
+    group.add_option('--top', metavar='K', type='int', default=None,
+                     help='Keep only the K best results by --top-key, holding no more than K in memory')
+    group.add_option('--top-key', metavar='KEY', default='num_citations',
+                     help='What --top ranks by: "num_citations" (default) or "year"')
+    group.add_option('--top-patience', metavar='PAGES', type='int', default=None,
+                     help='With --top, stop once the top K did not change for this many result pages')
     group.add_option('-u', '--url', metavar='URL', default=None,
                      help='Citation list\'s url')
     group.add_option('-U', '--urls_file', metavar='URL', dest='urls', default=None,
                      help='Citation list\'s urls json file ([\'http: // scholar.google.com/scholar?cites=4412725301034017472 & as_sdt=2005 & sciodt=1, 5 & hl=en\', ...])')
     parser.add_option_group(group)
 
+    group = optparse.OptionGroup(parser, 'Bulk cluster resolution',
+                                 'These options resolve many cluster IDs to their versions in one session.')
+    group.add_option('--cluster-ids', metavar='FILE', default=None,
+                     help='File with one cluster ID per line ("-" for stdin). Writes each cluster with its versions as a JSON line; -c limits the versions per cluster')
+    group.add_option('--cluster-output', metavar='FILE', default='-',
+                     help='File to append the resolved clusters to (default: stdout)')
+    group.add_option('--cluster-cache', metavar='FILE', default=None,
+                     help='Cache of resolved clusters; cached clusters are not fetched again')
+    group.add_option('--workers', type='int', default=1,
+                     help='Number of browsers resolving clusters or serving queries concurrently (default: 1)')
+    parser.add_option_group(group)
+
+    group = optparse.OptionGroup(parser, 'Batch searches',
+                                 'These options run many searches in one session.')
+    group.add_option('--batch', metavar='FILE', default=None,
+                     help='File with one search per line, as a JSON object with any of the keys %s, start and count, and optionally id naming the output file' % ', '.join(QUERY_SPEC_KEYS))
+    group.add_option('--batch-output', metavar='DIR', default='../batch',
+                     help='Directory for the per-search JSON files; searches with an existing file are skipped (default: ../batch)')
+    parser.add_option_group(group)
+
+    group = optparse.OptionGroup(parser, 'Local index',
+                                 'These options keep a full-text index of the harvested articles (see index.py).')
+    group.add_option('--index', metavar='DIR', default=None,
+                     help='Add the articles of every crawled page to the index in DIR')
+    group.add_option('--local-search', metavar='QUERY', default=None,
+                     help='Search the --index (default: ../index) instead of Scholar, then exit. QUERY is words, "phrases", words joined by OR and -excluded words')
+    group.add_option('--local-limit', type='int', default=10,
+                     help='Number of --local-search matches to show (default: 10)')
+    parser.add_option_group(group)
+
+    group = optparse.OptionGroup(parser, 'Work queue',
+                                 'These options spread a crawl across several workers.')
+    group.add_option('--queue', metavar='FILE', default=None,
+                     help='SQLite work queue file. Without --enqueue, claim and crawl tasks from it until none is left')
+    group.add_option('--enqueue', action='store_true', default=False,
+                     help='Add the -U urls (or the given search query) to the --queue file, then exit')
+    group.add_option('--lease-time', type='int', default=300,
+                     help='Seconds a claimed task stays leased without a heartbeat (default: 300)')
+    group.add_option('--max-attempts', type='int', default=3,
+                     help='Attempts before a task is marked as failed (default: 3)')
+    parser.add_option_group(group)
+
     group = optparse.OptionGroup(parser, 'Output format',
                                  'These options control the appearance of the results.')
     group.add_option('--txt', action='store_true',
@@ -118,7 +490,62 @@ scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
 
     group = optparse.OptionGroup(parser, 'Miscellaneous')
     group.add_option('--cookie-file', metavar='FILE', default=None,
-                     help='File to use for cookie storage. If given, will read any existing cookies if found at startup, and save resulting cookies in the end.')
+                     help='File to use for cookie storage instead of %s. Existing cookies are read at startup, and the resulting cookies are saved after every results page and in the end.' % ScholarConf.SESSION_FILE)
+    group.add_option('--lean', action='store_true', default=False,
+                     help='Run the browser headless, without images, fonts, media and prefetching; it becomes visible when a challenge page needs solving')
+    group.add_option('--extract-results', action='store_true', default=False,
+                     help='Take only the result blocks and counts from the browser instead of the whole results page; --record and --archive then keep just those')
+    group.add_option('--serve', metavar='PORT', type='int', default=None,
+                     help='Keep --workers browsers running and answer queries sent as JSON to http://localhost:PORT/query (see daemon.py)')
+    group.add_option('--memory-budget', metavar='MB', type='float', default=None,
+                     help='With --json, spill buffered results to the results file once the process uses this much memory, instead of rewriting the file after every page')
+    group.add_option('--max-buffered', metavar='N', type='int', default=None,
+                     help='With --json, spill buffered results to the results file beyond N records')
+    group.add_option('--trace', metavar='FILE', default=None,
+                     help='Write a timeline of the crawl (pages, requests, page loads, parsing, output, challenge pauses) to FILE, in the Chrome trace format that chrome://tracing and ui.perfetto.dev open')
+    group.add_option('--record', metavar='FILE', default=None,
+                     help='Record every fetched page to this file, for later use with --replay')
+    group.add_option('--replay', metavar='FILE', default=None,
+                     help='Do not start a browser, serve pages from a --record file or an --archive directory instead')
+    group.add_option('--archive', metavar='DIR', default=None,
+                     help='Archive every fetched page, compressed, in this directory (see archive.py)')
+    group.add_option('--replay-latency', metavar='SECONDS', type='float', default=0.0,
+                     help='With --replay, wait this long before serving each page')
+    group.add_option('--replay-challenge-rate', metavar='RATE', type='float', default=0.0,
+                     help='With --replay, answer this fraction of requests with a challenge page')
+    group.add_option('--retries', type='int', default=ScholarConf.RETRY_ATTEMPTS,
+                     help='Attempts per request before giving up (default: %d)' % ScholarConf.RETRY_ATTEMPTS)
+    group.add_option('--retry-delay', metavar='SECONDS', type='float', default=ScholarConf.RETRY_BASE_DELAY,
+                     help='Wait before the first retry, doubling with every further one (default: %d)' % ScholarConf.RETRY_BASE_DELAY)
+    group.add_option('--breaker-threshold', metavar='RATE', type='float', default=ScholarConf.BREAKER_THRESHOLD,
+                     help='Error rate that makes the circuit breaker pause requests, 0 to disable (default: %.1f)' % ScholarConf.BREAKER_THRESHOLD)
+    group.add_option('--breaker-cooldown', metavar='SECONDS', type='int', default=ScholarConf.BREAKER_COOLDOWN,
+                     help='How long the circuit breaker pauses requests (default: %d)' % ScholarConf.BREAKER_COOLDOWN)
+    group.add_option('--adaptive', action='store_true', default=False,
+                     help='Adapt the number of concurrent page loads (up to --workers) and the interval between them to latency, errors and challenge pages')
+    group.add_option('--min-interval', metavar='SECONDS', type='float', default=0.5,
+                     help='With --adaptive, shortest interval between page loads (default: 0.5)')
+    group.add_option('--max-interval', metavar='SECONDS', type='float', default=60.0,
+                     help='With --adaptive, longest interval between page loads (default: 60)')
+    group.add_option('--target-latency', metavar='SECONDS', type='float', default=5.0,
+                     help='With --adaptive, back off when pages take longer than this to load (default: 5)')
+    group.add_option('--rate-limit', metavar='RATE', type='float', default=None,
+                     help='Most page loads per second of all pyscholar processes on this host together')
+    group.add_option('--rate-file', metavar='FILE',
+                     default=os.path.join(tempfile.gettempdir(), 'pyscholar-rate.json'),
+                     help='State file the processes share the --rate-limit through (default: %default)')
+    group.add_option('--job-weight', metavar='WEIGHT', type='float', default=1.0,
+                     help='Share of the --rate-limit this process gets, relative to the other active ones (default: 1)')
+    group.add_option('--job-name', metavar='NAME', default=None,
+                     help='Name of this process for --rate-limit (default: host:pid)')
+    group.add_option('--on-challenge', metavar='POLICY', default='park',
+                     help='What to do on a "not a robot" challenge page: "park" the work and go on with the rest (default), "backoff" and retry a few times before parking, or "debug" to stop in the debugger')
+    group.add_option('--parked-file', metavar='FILE', default='../parked.json',
+                     help='Where to keep work parked on a challenge (default: "../parked.json"). Creating FILE.release during a run retries the parked work')
+    group.add_option('--release-parked', action='store_true', default=False,
+                     help='Retry the work parked on a challenge, after solving it in the browser, then exit')
+    group.add_option('--notify-cmd', metavar='CMD', default=None,
+                     help='Shell command run when work gets parked, with the message in $SCHOLAR_MESSAGE')
     group.add_option('-d', '--debug', action='count', default=0,
                      help='Enable verbose logging to stderr. Repeated options increase detail of debug output.')
     group.add_option('-v', '--version', action='store_true', default=False,
@@ -141,8 +568,63 @@ scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
         print('This is scholar.py %s.' % ScholarConf.VERSION)
         return 0
 
+    if options.trace is not None:
+        tracer = ScholarTracer(options.trace)
+        set_tracer(tracer)
+        # The events are on disk as they happen; this only adds the
+        # closing bracket, which the viewers do without.
+        atexit.register(tracer.close)
+
+    json_results.budget = ScholarMemoryBudget(options.memory_budget,
+                                              options.max_buffered)
+    atexit.register(report_memory, json_results.budget)
+
     if options.cookie_file:
         ScholarConf.COOKIE_JAR_FILE = options.cookie_file
+    ScholarConf.LEAN_BROWSER = options.lean
+    ScholarConf.EXTRACT_RESULTS = options.extract_results
+    if options.replay is not None:
+        # Replayed pages neither need to settle nor to be spaced out;
+        # --replay-latency slows them down if wanted.
+        ScholarConf.PAGE_LOAD_WAIT = 0
+        ScholarConf.PAGE_INTERVAL = 0
+
+    if options.on_challenge not in ('park', 'backoff', 'debug'):
+        print('Invalid challenge policy, must be one of "park", "backoff", or "debug".')
+        return 1
+    ScholarConf.CHALLENGE_POLICY = options.on_challenge
+    if options.top_key not in TOP_KEYS:
+        print('Invalid top key, must be one of "num_citations" or "year".')
+        return 1
+    if options.top is not None and options.top < 1:
+        print('Invalid --top, must be at least 1.')
+        return 1
+    if options.top_patience is not None and options.top_patience < 1:
+        print('Invalid --top-patience, must be at least 1.')
+        return 1
+    ScholarConf.RETRY_ATTEMPTS = max(1, options.retries)
+    ScholarConf.RETRY_BASE_DELAY = options.retry_delay
+    ScholarConf.BREAKER_THRESHOLD = options.breaker_threshold
+    ScholarConf.BREAKER_COOLDOWN = options.breaker_cooldown
+    attention = ScholarAttentionQueue(options.parked_file,
+                                      notify_cmd=options.notify_cmd)
+
+    controller = None
+    if options.adaptive:
+        controller = ScholarAdaptiveController(
+            max_concurrency=options.workers,
+            min_interval=options.min_interval,
+            max_interval=options.max_interval,
+            interval=ScholarConf.PAGE_INTERVAL,
+            target_latency=options.target_latency)
+        # The controller paces the page loads from now on.
+        ScholarConf.PAGE_INTERVAL = 0
+
+    governor = None
+    if options.rate_limit is not None:
+        governor = ScholarRateGovernor(options.rate_file, options.rate_limit,
+                                       weight=options.job_weight,
+                                       job=options.job_name)
 
     # Sanity-check the options: if they include a cluster ID query, it
     # makes no sense to have search arguments:
@@ -154,7 +636,30 @@ scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
                 'Cluster ID queries do not allow additional search arguments.')
             return 1
 
-    querier = ScholarQuerier()
+    if options.local_search is not None:
+        index = ScholarIndex(options.index or '../index')
+        print_matches(index.search(options.local_search,
+                                   limit=options.local_limit))
+        return 0
+
+    queue = None
+    if options.queue is not None:
+        queue = ScholarWorkQueue(options.queue, lease_time=options.lease_time,
+                                 max_attempts=options.max_attempts)
+
+    if options.enqueue:
+        if queue is None:
+            print('--enqueue needs a --queue file.')
+            return 1
+        if options.urls is not None:
+            added = 0
+            for url in read_urls(options.urls):
+                added += queue.add('url', {'url': url})
+        else:
+            added = int(queue.add('query', query_spec(options)))
+        print('%d tasks added, queue: %s' % (added, queue.stats()))
+        return 0
+
     settings = ScholarSettings()
 
     if options.citation == 'bt':
@@ -170,55 +675,98 @@ scholar.py -c 5 -a "albert einstein" -t --none "quantum theory" --after 1970"""
             'Invalid citation link format, must be one of "bt", "en", "rm", or "rw".')
         return 1
 
-    querier.apply_settings(settings)
+    recorder = None
+    if options.record is not None:
+        recorder = ScholarRecording(options.record)
 
-    if options.cluster_id:
-        query = ClusterScholarQuery(cluster=options.cluster_id)
-    else:
-        query = SearchScholarQuery()
-        if options.author:
-            query.set_author(options.author)
-        if options.allw:
-            query.set_words(options.allw)
-        if options.some:
-            query.set_words_some(options.some)
-        if options.none:
-            query.set_words_none(options.none)
-        if options.phrase:
-            query.set_phrase(options.phrase)
-        if options.title_only:
-            query.set_scope(True)
-        if options.pub:
-            query.set_pub(options.pub)
-        if options.after or options.before:
-            query.set_timeframe(options.after, options.before)
-        if options.no_patents:
-            query.set_include_patents(False)
-        if options.no_citations:
-            query.set_include_citations(False)
+    archive = None
+    if options.archive is not None:
+        archive = ScholarPageArchive(options.archive)
+
+    replay = None
+    if options.replay is not None:
+        replay = open_replay(options.replay)
+
+    querier = make_querier(options, settings, recorder, archive,
+                           controller, governor, replay)
+
+    if options.release_parked:
+        release_parked(options, querier, attention)
+        querier.quit()
+        return 0
+
+    if options.serve is not None:
+        queriers = [querier] + [make_querier(options, settings, recorder,
+                                             archive, controller, governor,
+                                             replay)
+                                for _ in range(options.workers - 1)]
+        daemon = ScholarDaemon(queriers, port=options.serve,
+                               attention=attention)
+        print('serving queries on %s' % daemon.url)
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        daemon.close()
+        return 0
+
+    if options.cluster_ids is not None:
+        queriers = [querier] + [make_querier(options, settings, recorder,
+                                             archive, controller, governor,
+                                             replay)
+                                for _ in range(options.workers - 1)]
+        resolve_clusters(options, queriers, attention)
+        for querier in queriers:
+            querier.quit()
+        report_parked(attention)
+        return 0
+
+    if queue is not None:
+        run_worker(options, querier, queue, attention)
+        querier.quit()
+        return 0
+
+    if options.batch is not None:
+        batch = ScholarBatch(querier, options.batch_output,
+                             batch_file=options.batch, limit=options.count,
+                             attention=attention)
+        batch.run(read_specs(options.batch))
+        querier.quit()
+        report_parked(attention)
+        return 0
+
+    index = None
+    if options.index is not None:
+        index = ScholarIndex(options.index)
 
+    query = query_from_spec(vars(options))
     if options.url is not None:
-        query.set_url(options.url)
-        print options.url
+        print(options.url)
 
     if options.urls is not None:
-        print options.urls
+        print(options.urls)
         try:
-            with open(options.urls) as data_file:
-                urls = json.load(data_file)
-            if isinstance(urls, list) and len(urls) > 0 and isinstance(urls[0], dict):
-                urls = [x['url_citations'] for x in urls]
-            for url in urls:
+            for url in read_urls(options.urls):
                 query.set_url(url)
                 reset_res()
-                loop(options, query, querier, file_name='../results/' +
-                     re.match('.*?([0-9]+)', url).group(1) + '.json')
-        except Exception, e:
-            print e
+                file_name = url_results_file(url)
+                crawl(options, query, querier, attention,
+                      {'kind': 'url', 'url': url, 'file_name': file_name,
+                       'spec': query_spec(options)},
+                      file_name=file_name, index=index)
+                if attention.release_requested():
+                    release_parked(options, querier, attention)
+        except Exception as e:
+            print(e)
 
     else:
-        loop(options, query, querier)
+        crawl(options, query, querier, attention,
+              {'kind': 'query', 'file_name': '../res.json',
+               'spec': query_spec(options)}, index=index)
+    if index is not None:
+        index.flush()
     querier.quit()
+    report_parked(attention)
     return 0
 
 if __name__ == "__main__":
@@ -5,18 +5,25 @@ This module provides classes for querying Google Scholar and parsing
 returned results. It currently *only* processes the first results
 page. It is not a recursive crawler.
 """
+import threading
 import time
 from utils import ScholarConf, ScholarUtils, encode
 from parser import ScholarArticleParser120726
-from excepts import QueryArgumentError
-from urllib import quote, unquote
+from excepts import ChallengeError, FetchError, QueryArgumentError
+from retry import ScholarRetryPolicy
+from adaptive import ScholarAdaptiveController
+from tracing import span, instant
+from session import ScholarSession
+from page import ScholarPage
 import pdb
 from selenium import webdriver
-from selenium.webdriver.firefox.webdriver import FirefoxProfile
-from os import path
-from shutil import copytree, rmtree
+from selenium.webdriver.firefox.options import Options as FirefoxOptions
+from selenium.webdriver import FirefoxProfile
 
-FF_PROFILE_PATH = '../ffprofile'
+try:
+    from urllib.parse import quote, unquote
+except ImportError:  # Python 2
+    from urllib import quote, unquote
 
 class ScholarQuery(object):
 
@@ -113,7 +120,7 @@ class ClusterScholarQuery(ScholarQuery):
     This version just pulls up an article cluster whose ID we already
     know about.
     """
-    args = 'start=%(num)s' \
+    args = 'start=%(start)s' \
         + '&cluster=%(cluster)s' \
         + '&num=%(num)s'
     SCHOLAR_CLUSTER_URL = ScholarConf.SCHOLAR_SITE + '/scholar?' + args
@@ -138,7 +145,8 @@ class ClusterScholarQuery(ScholarQuery):
         if self.cluster is None:
             raise QueryArgumentError('cluster query needs cluster ID')
 
-        urlargs = {'cluster': self.cluster,
+        urlargs = {'start': self.starting_number or ScholarConf.STARTING_RESULT,
+                   'cluster': self.cluster,
                    'num': self.num_results or ScholarConf.MAX_PAGE_RESULTS}
 
         for key, val in urlargs.items():
@@ -280,6 +288,49 @@ class SearchScholarQuery(ScholarQuery):
         return self.SCHOLAR_QUERY_URL % urlargs
 
 
+# The search parameters understood by query_from_spec():
+QUERY_SPEC_KEYS = ('author', 'allw', 'some', 'none', 'phrase', 'title_only',
+                   'pub', 'after', 'before', 'no_patents', 'no_citations',
+                   'cluster_id', 'url')
+
+
+def query_from_spec(spec):
+    """
+    Builds a query instance from a dictionary of search parameters. The
+    keys (see QUERY_SPEC_KEYS) mirror the command-line options of
+    pyscholar.py; other keys are ignored, so the parsed options
+    themselves can be passed in via vars(options).
+    """
+    if spec.get('cluster_id'):
+        query = ClusterScholarQuery(cluster=spec['cluster_id'])
+    else:
+        query = SearchScholarQuery()
+        if spec.get('author'):
+            query.set_author(spec['author'])
+        if spec.get('allw'):
+            query.set_words(spec['allw'])
+        if spec.get('some'):
+            query.set_words_some(spec['some'])
+        if spec.get('none'):
+            query.set_words_none(spec['none'])
+        if spec.get('phrase'):
+            query.set_phrase(spec['phrase'])
+        if spec.get('title_only'):
+            query.set_scope(True)
+        if spec.get('pub'):
+            query.set_pub(spec['pub'])
+        if spec.get('after') or spec.get('before'):
+            query.set_timeframe(spec.get('after'), spec.get('before'))
+        if spec.get('no_patents'):
+            query.set_include_patents(False)
+        if spec.get('no_citations'):
+            query.set_include_citations(False)
+
+    if spec.get('url') is not None:
+        query.set_url(spec['url'])
+    return query
+
+
 class ScholarQuerier(object):
 
     """
@@ -305,6 +356,48 @@ class ScholarQuerier(object):
         + '%(scisf)s' \
         + '&hl=en&lang=all&instq=&inst=569367360547434339&save='
 
+    # Text on the pages Scholar serves instead of results when it
+    # suspects a robot:
+    CHALLENGE_TEXTS = [u'Please show you\'re not a robot',
+                       u'Per continuare, digita i caratteri nell\'immagine sottostante:']
+
+    # Returns the HTML of what the parser reads on a results page, the
+    # global counts (#gs_ab_md) and the result blocks (div.gs_r), or
+    # null if the page has neither.
+    EXTRACT_SCRIPT = """
+        var md = document.getElementById('gs_ab_md');
+        var divs = document.querySelectorAll('div.gs_r');
+        if (!md && !divs.length) { return null; }
+        var parts = [md ? md.outerHTML : ''];
+        for (var i = 0; i < divs.length; i++) {
+            if (!divs[i].parentNode.closest('div.gs_r')) {
+                parts.push(divs[i].outerHTML);
+            }
+        }
+        return parts.join('');
+    """
+
+    # Firefox preferences of the lean browser (ScholarConf.LEAN_BROWSER).
+    # We only ever read the page source, so we skip whatever only
+    # matters for display, and anything loaded ahead of time.
+    LEAN_PREFS = {'permissions.default.image': 2,
+                  'browser.display.use_document_fonts': 0,
+                  'gfx.downloadable_fonts.enabled': False,
+                  'media.autoplay.default': 5,
+                  'media.autoplay.enabled': False,
+                  'media.video_stats.enabled': False,
+                  'network.prefetch-next': False,
+                  'network.dns.disablePrefetch': True,
+                  'network.http.speculative-parallel-limit': 0,
+                  'browser.urlbar.speculativeConnect.enabled': False,
+                  'extensions.autoDisableScopes': 15,
+                  'extensions.update.enabled': False,
+                  'browser.cache.disk.enable': False,
+                  'browser.cache.offline.enable': False,
+                  'browser.cache.memory.capacity': 16384,
+                  'browser.sessionhistory.max_entries': 2,
+                  'browser.shell.checkDefaultBrowser': False}
+
     # Older URLs:
     # ScholarConf.SCHOLAR_SITE +
     # '/scholar?q=%s&hl=en&btnG=Search&as_sdt=2001&as_sdtp=on
@@ -322,18 +415,55 @@ class ScholarQuerier(object):
         def handle_article(self, art):
             self.querier.add_article(art)
 
-    def __init__(self):
+    def __init__(self, driver=None):
         self.articles = []
         self.query = None
-        try:
-            profile = FirefoxProfile(FF_PROFILE_PATH)
-            self.firefox = webdriver.Firefox(profile)
+        # Any WebDriver-like object will do as driver, e.g. a
+        # replay.ReplayDriver for offline runs. We only restart browsers
+        # we started ourselves.
+        self._own_driver = driver is None
+        # A lean browser runs headless until a challenge needs a human.
+        self.headless = ScholarConf.LEAN_BROWSER and driver is None
+        if driver is not None:
+            self.firefox = driver
+        else:
+            self.firefox = self._start_driver()
 
-        except Exception, e:
+        self.settings = None  # Last settings object, if any
 
-            self.firefox = webdriver.Firefox()
+        # Serializes the use of the browser, which a prefetch.
+        # ScholarPagePrefetcher shares with the thread parsing results.
+        self.driver_lock = threading.RLock()
 
-        self.settings = None  # Last settings object, if any
+        # Decides on retries after failed requests, see retry.py.
+        self.retry_policy = ScholarRetryPolicy.from_conf()
+
+        # If set, an adaptive.ScholarAdaptiveController pacing the page
+        # loads, possibly shared with other queriers.
+        self.controller = None
+
+        # If set, a governor.ScholarRateGovernor that every page load
+        # waits for, shared with other queriers and processes.
+        self.governor = None
+
+        # If set, a replay.ScholarRecording that every fetched page is
+        # added to.
+        self.recorder = None
+
+        # If set, an archive.ScholarPageArchive that every fetched page
+        # is archived in.
+        self.archive = None
+
+        # Browsers we start get the cookies and preferences of the last
+        # session, see session.py. They are restored before the first
+        # request, once the controller and governor are set.
+        self.session = None
+        self._session_restored = False
+        self._session_pending = False
+        if self._own_driver:
+            self.session = ScholarSession(ScholarConf.COOKIE_JAR_FILE or
+                                          ScholarConf.SESSION_FILE)
+            self._session_pending = True
 
     def apply_settings(self, settings):
         """
@@ -343,28 +473,36 @@ class ScholarQuerier(object):
             return True
 
         self.settings = settings
+        self._ensure_session()
+        if self._session_restored and self.session.has_settings(settings):
+            # The restored cookies carry these settings already.
+            ScholarUtils.log('info', 'settings restored from session')
+            return True
+        with self.driver_lock:
+            return self._apply_settings(settings)
 
+    def _apply_settings(self, settings):
         # This is a bit of work. We need to actually retrieve the
         # contents of the Settings pane HTML in order to extract
         # hidden fields before we can compose the query for updating
         # the settings.
 
-        self.firefox.get(self.GET_SETTINGS_URL)
+        self._navigate(self.GET_SETTINGS_URL)
 
-        tag = self.firefox.find_element_by_id('gs_settings_form')
+        tag = self.firefox.find_element('id', 'gs_settings_form')
         #tag = soup.find(name='form', attrs={'id': 'gs_settings_form'})
         if tag is None:
             ScholarUtils.log('info', 'parsing settings failed: no form')
             return False
 
-        tag = [x for x in self.firefox.find_elements_by_tag_name('input') if x.get_attribute(
+        tag = [x for x in self.firefox.find_elements('tag name', 'input') if x.get_attribute(
             'type') == 'hidden' and x.get_attribute('name') == 'scisig'][0]
         if tag is None:
             ScholarUtils.log('info', 'parsing settings failed: scisig')
         #     return False
 
         urlargs = {'start': settings.starting_number,
-                   'scisig': tag['value'],
+                   'scisig': tag.get_attribute('value'),
                    'num': settings.per_page_results,
                    'scis': 'no',
                    'scisf': ''}
@@ -373,7 +511,7 @@ class ScholarQuerier(object):
             urlargs['scis'] = 'yes'
             urlargs['scisf'] = '&scisf=%d' % settings.citform
 
-        self.firefox.get(self.SET_SETTINGS_URL % urlargs)
+        self._navigate(self.SET_SETTINGS_URL % urlargs)
 
         ScholarUtils.log('info', 'settings applied')
         return True
@@ -381,17 +519,86 @@ class ScholarQuerier(object):
     def send_query(self, query):
         """
         This method initiates a search query (a ScholarQuery instance)
-        with subsequent parsing of the response.
+        with subsequent parsing of the response. Raises ChallengeError
+        if Scholar served a challenge page instead of results, see
+        ScholarConf.CHALLENGE_POLICY, and FetchError if the page could
+        not be fetched, so that a failed fetch is not mistaken for the
+        end of the results.
         """
-        self.clear_articles()
-        self.query = query
+        with span('send_query', url=query.get_url()):
+            self.parse_response(query, self.fetch_page(query))
 
-        html = self._get_http_response(url=query.get_url(),
+    def fetch_page(self, query):
+        """
+        Fetches the results page of a query and returns it as a
+        ScholarPage. Raises ChallengeError and FetchError like
+        send_query().
+        """
+        url = query.get_url()
+        html = self._get_http_response(url=url,
                                        log_msg='dump of query response HTML',
-                                       err_msg='results retrieval failed')
+                                       err_msg='results retrieval failed',
+                                       results=True)
+        if html is None:
+            raise FetchError(url)
+        return html
+
+    def parse_response(self, query, html):
+        """
+        Parses the results page fetched for a query into the articles
+        member, as send_query() does. A None page yields no articles.
+        """
+        self.clear_articles()
+        self.query = query
         if html is None:
             return
-        self.parse(html)
+        with span('parse'):
+            self.parse(html)
+
+    def iter_results(self, query, limit=None, page_ends=False):
+        """
+        Generator yielding the articles found for a query (a ScholarQuery
+        instance), up to limit articles or all of them if limit is None.
+        Result pages are fetched lazily as the articles are consumed and
+        dropped once consumed, so memory use stays the same no matter how
+        many results are retrieved, and the caller may stop at any time.
+        With page_ends, None is yielded after the articles of each result
+        page, before the next one is fetched. The articles member is left
+        alone. Raises ChallengeError and FetchError like send_query().
+        """
+        self.query = query
+        start = query.starting_number
+        done = 0
+        while limit is None or done < limit:
+            count = ScholarConf.MAX_PAGE_RESULTS
+            if limit is not None:
+                count = min(count, limit - done)
+            query.set_starting_number(start)
+            query.set_num_page_results(count)
+            html = self.fetch_page(query)
+
+            parser = self.Parser(self)
+            num_page_articles = 0
+            for art in parser.iter_articles(html):
+                self.get_citation_data(art)
+                num_page_articles += 1
+                done += 1
+                yield art
+                if limit is not None and done >= limit:
+                    parser.release()
+                    return
+
+            # Let go of the page before fetching the next one.
+            parser.release()
+            html = None
+            if page_ends:
+                yield None
+
+            start += ScholarConf.MAX_PAGE_RESULTS
+            if num_page_articles == 0 or \
+               (query['num_results'] and start >= query['num_results']):
+                return
+            time.sleep(ScholarConf.PAGE_INTERVAL)
 
     def get_citation_data(self, article):
         """
@@ -405,13 +612,14 @@ class ScholarQuerier(object):
             return True
 
         ScholarUtils.log('info', 'retrieving citation export data')
-        data = self._get_http_response(url=article['url_citation'],
-                                       log_msg='citation data response',
-                                       err_msg='requesting citation data failed')
+        with span('citation_data', url=article['url_citation']):
+            data = self._get_http_response(url=article['url_citation'],
+                                           log_msg='citation data response',
+                                           err_msg='requesting citation data failed')
         if data is None:
             return False
 
-        article.set_citation_data(data)
+        article.set_citation_data(data.text)
         return True
 
     def parse(self, html):
@@ -420,6 +628,7 @@ class ScholarQuerier(object):
         """
         parser = self.Parser(self)
         parser.parse(html)
+        parser.release()
 
     def add_article(self, art):
         self.get_citation_data(art)
@@ -429,41 +638,264 @@ class ScholarQuerier(object):
         """Clears any existing articles stored from previous queries."""
         self.articles = []
 
-    def _get_http_response(self, url, log_msg=None, err_msg=None):
+    def _get_http_response(self, url, log_msg=None, err_msg=None,
+                           results=False):
         """
-        Helper method, sends HTTP request and returns response payload.
+        Helper method, sends HTTP request and returns response payload
+        as a ScholarPage, which the recorder, the archive and the parser
+        all share. For results pages (results=True) and
+        ScholarConf.EXTRACT_RESULTS, the payload is just the part of the
+        page the parser reads.
         """
         if log_msg is None:
             log_msg = 'HTTP response data follow'
         if err_msg is None:
             err_msg = 'request failed'
-        try:
-            ScholarUtils.log('info', 'requesting %s' % unquote(url))
-
-            text = 'Please show you\'re not a robot'
-            text2 = 'Per continuare, digita i caratteri nell\'immagine sottostante:'
-            while True:
-                self.firefox.get(url)
-                time.sleep(1)
-                html = self.firefox.page_source.encode('utf-8')
-                if text in html or text2 in html:
-                    pdb.set_trace()
-                    html = self.firefox.page_source.encode('utf-8')
-                break
+        ScholarUtils.log('info', 'requesting %s' % unquote(url))
+
+        with span('request', url=url):
+            html = self._request(url, err_msg, results)
+        if html is None:
+            return None
 
+        # The page is fetched; failing to keep a copy of it must not
+        # fail the fetch.
+        for store in (self.recorder, self.archive):
+            if store is None:
+                continue
+            try:
+                store.add(url, html.text)
+            except Exception as err:
+                ScholarUtils.log('error', 'storing %s failed: %s'
+                                 % (url, err))
+
+        if ScholarConf.LOG_LEVEL >= ScholarUtils.LOG_LEVELS['debug']:
             ScholarUtils.log('debug', log_msg)
             ScholarUtils.log('debug', '>>>>' + '-'*68)
-            ScholarUtils.log('debug', 'data:\n' + html.decode('utf-8'))
+            ScholarUtils.log('debug', 'data:\n' + encode(html.text))
             ScholarUtils.log('debug', '<<<<' + '-'*68)
 
+        return html
+
+    def _request(self, url, err_msg, results):
+        # Loads the page, retrying as the retry policy says; returns its
+        # HTML or None.
+        self._ensure_session()
+        attempt = 0
+        while True:
+            attempt += 1
+            with span('retry_policy_wait'):
+                self.retry_policy.before_request()
+            try:
+                with self.driver_lock:
+                    html = self._load_page(url, results)
+                    if html is None:
+                        with span('challenge', url=url):
+                            html = self._handle_challenge(url)
+                self.retry_policy.succeeded()
+                return html
+            except ChallengeError:
+                # Also tells a half-open circuit breaker how its trial
+                # request went.
+                self.retry_policy.challenged()
+                raise
+            except Exception as err:
+                kind = self.retry_policy.failed(err)
+                ScholarUtils.log('warn', '%s (%s error): %s'
+                                 % (err_msg, kind, err))
+                instant('request_failed', url=url, kind=kind,
+                        attempt=attempt)
+                if not self.retry_policy.should_retry(kind, attempt):
+                    ScholarUtils.log('error', '%s, giving up after %d '
+                                     'attempts' % (err_msg, attempt))
+                    return None
+                if kind == ScholarRetryPolicy.DRIVER:
+                    with self.driver_lock:
+                        with span('restart_driver'):
+                            self._restart_driver()
+                with span('retry_wait', attempt=attempt):
+                    time.sleep(self.retry_policy.delay(attempt))
+
+    def _navigate(self, url):
+        # Every page load goes through here, so the governor sees it.
+        if self.governor is not None:
+            with span('governor_wait'):
+                self.governor.acquire()
+        with span('navigate', url=url):
+            self.firefox.get(url)
+
+    def _load_page(self, url, results=False):
+        """
+        Loads a page in the browser and returns it as a ScholarPage, or
+        None if Scholar served a challenge page. The controller, if any, paces
+        the load and learns how it went.
+        """
+        if self.controller is not None:
+            with span('pacing_wait'):
+                self.controller.before_request()
+        started = time.time()
+        outcome = ScholarAdaptiveController.ERROR
+        try:
+            self._navigate(url)
+            with span('page_ready_wait'):
+                time.sleep(ScholarConf.PAGE_LOAD_WAIT)
+            html = None
+            if results and ScholarConf.EXTRACT_RESULTS:
+                with span('extract_results'):
+                    html = self._extract_results(url)
+            if html is None:
+                with span('page_source'):
+                    html = ScholarPage(self.firefox.page_source, url=url)
+                if self._is_challenge(html):
+                    outcome = ScholarAdaptiveController.CHALLENGE
+                    instant('challenge_page', url=url)
+                    return None
+            outcome = ScholarAdaptiveController.OK
             return html
+        finally:
+            if self.controller is not None:
+                self.controller.record(time.time() - started, outcome)
+
+    def save_cookies(self):
+        """
+        Saves the cookies and settings of the browser session, so that
+        the next session starts with them. Does nothing for browsers we
+        did not start.
+        """
+        if self.session is None:
+            return
+        with self.driver_lock:
+            try:
+                self.session.save(self.firefox, self.settings)
+            except Exception as err:
+                ScholarUtils.log('warn', 'saving the session failed: %s'
+                                 % err)
+
+    def _start_driver(self):
+        if not ScholarConf.LEAN_BROWSER:
+            driver = webdriver.Firefox()
+        else:
+            profile = FirefoxProfile()
+            for key, val in self.LEAN_PREFS.items():
+                profile.set_preference(key, val)
+            options = FirefoxOptions()
+            options.profile = profile
+            if self.headless:
+                options.add_argument('-headless')
+            driver = webdriver.Firefox(options=options)
+        driver.set_page_load_timeout(ScholarConf.PAGE_LOAD_TIMEOUT)
+        return driver
+
+    def _ensure_session(self):
+        if self._session_pending:
+            self._session_pending = False
+            self._restore_session()
+
+    def _restore_session(self):
+        # The page the cookies are set on is loaded like any other, with
+        # retries, pacing and the rate governor.
+        def load(url):
+            self._request(url, 'loading the session site failed', False)
+        try:
+            self._session_restored = self.session.restore(self.firefox, load)
+        except Exception as err:
+            self._session_restored = False
+            ScholarUtils.log('warn', 'restoring the session failed: %s'
+                             % err)
+
+    def _restart_driver(self):
+        """
+        Replaces a crashed browser with a new one and applies the
+        settings to it again.
+        """
+        if not self._own_driver:
+            return
+        ScholarUtils.log('warn', 'restarting the browser')
+        try:
+            self.firefox.quit()
+        except Exception:
+            pass
+        try:
+            self.firefox = self._start_driver()
+            self.retry_policy.stats['restarts'] += 1
+            self._restore_session()
+            if self.settings is not None:
+                self.apply_settings(self.settings)
         except Exception as err:
-            print err
-            pdb.set_trace()
+            ScholarUtils.log('error', 'restarting the browser failed: %s'
+                             % err)
+
+    def _extract_results(self, url):
+        """
+        Returns the results of the loaded page as a minimal page holding
+        only what the parser reads, or None if the browser cannot run
+        scripts or the page looks different from a results page, e.g. a
+        challenge page. Then the whole page is needed.
+        """
+        execute = getattr(self.firefox, 'execute_script', None)
+        if execute is None:
             return None
+        parts = execute(self.EXTRACT_SCRIPT)
+        if parts is None:
+            return None
+        return ScholarPage(u'<html><body>' + parts + u'</body></html>',
+                           url=url)
+
+    def _show_browser(self, url):
+        """
+        Replaces a headless browser with a visible one, with the same
+        cookies, showing the URL, so that a challenge can be solved.
+        """
+        ScholarUtils.log('warn', 'challenge page, switching to a visible '
+                         'browser')
+        self.save_cookies()
+        self.headless = False
+        self._restart_driver()
+        self._navigate(url)
+
+    def _is_challenge(self, page):
+        return page.contains_any(self.CHALLENGE_TEXTS)
+
+    def _handle_challenge(self, url):
+        """
+        Deals with a challenge page served for the URL as configured in
+        ScholarConf.CHALLENGE_POLICY. Returns the page HTML once the
+        challenge is gone, or raises ChallengeError.
+        """
+        if self.headless:
+            self._show_browser(url)
+
+        policy = ScholarConf.CHALLENGE_POLICY
+        if policy == 'debug':
+            # Solve the challenge in the browser, then continue.
+            with span('debugger_pause', url=url):
+                pdb.set_trace()
+            return ScholarPage(self.firefox.page_source, url=url)
+
+        if policy == 'backoff':
+            delay = ScholarConf.CHALLENGE_BACKOFF
+            for _ in range(ScholarConf.CHALLENGE_RETRIES):
+                ScholarUtils.log('warn', 'challenge page, retrying in %d '
+                                 'seconds' % delay)
+                with span('challenge_backoff', seconds=delay):
+                    time.sleep(delay)
+                html = self._load_page(url)
+                if html is not None:
+                    return html
+                delay *= 2
+
+        raise ChallengeError(url)
 
     def quit(self):
-        if path.exists(FF_PROFILE_PATH):
-            rmtree(FF_PROFILE_PATH)
-        copytree(self.firefox.profile.path, FF_PROFILE_PATH)
+        ScholarUtils.log('info', 'requests: %s' % self.retry_policy.report())
+        if self.controller is not None:
+            ScholarUtils.log('info', 'pacing: %s' % self.controller.metrics())
+        if self.governor is not None:
+            ScholarUtils.log('info', 'rate governor: %s'
+                             % self.governor.report())
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.archive is not None:
+            self.archive.close()
+        self.save_cookies()
         self.firefox.quit()
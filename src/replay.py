@@ -0,0 +1,374 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module lets pyscholar.py run without a live browser and without
+Google. A ScholarRecording captures the URL -> HTML pairs a querier
+fetches (see ScholarQuerier.recorder); ReplayDriver then stands in for
+the Selenium WebDriver and serves those pages back, and
+ScholarMockServer serves them over local HTTP for HttpDriver. Both can
+add latency and inject "not a robot" challenge pages, so end-to-end
+runs become reproducible load tests.
+
+Run it directly to start a mock server from a recording:
+
+  replay.py recording.jsonl.gz --port 8080 --latency 0.2
+"""
+import gzip
+import json
+import optparse
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from utils import ScholarUtils
+
+try:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+    from urllib.parse import urlsplit
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from urllib2 import urlopen, HTTPError
+    from urlparse import urlsplit
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+# Import BeautifulSoup -- try 4 first, fall back to older
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    try:
+        from BeautifulSoup import BeautifulSoup
+    except ImportError:
+        print('We need BeautifulSoup, sorry...')
+        sys.exit(1)
+
+# What Scholar serves instead of results when it suspects a robot:
+CHALLENGE_HTML = '<html><head><title>Sorry...</title></head><body>' \
+    '<div id="gs_captcha_ccl"><h1>Please show you\'re not a robot</h1>' \
+    '</div></body></html>'
+
+# What we serve for pages missing from a recording -- a results page
+# without results, which ends any pagination.
+EMPTY_HTML = '<html><head></head><body><div id="gs_ab_md"></div>' \
+    '</body></html>'
+
+
+def page_key(url):
+    """
+    Returns the key a page is recorded under: its path and query
+    string, so a recording replays regardless of the site it is
+    served from.
+    """
+    parts = urlsplit(url)
+    if parts.query:
+        return parts.path + '?' + parts.query
+    return parts.path
+
+
+class ScholarRecording(object):
+
+    """
+    A set of recorded pages, kept in a gzip-compressed JSON lines file
+    with one {"url": ..., "html": ...} object per line. Pages added
+    while recording are appended to the file right away, so an aborted
+    run still leaves a usable recording: its file lacks the end of the
+    gzip stream, and possibly the end of the last line, so it is read
+    up to there, and rewritten before anything is appended to it.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.pages = {}
+        self._lock = threading.Lock()
+        self._truncated = False
+        try:
+            with gzip.open(file_name, 'rb') as data_file:
+                for line in data_file:
+                    rec = json.loads(line.decode('utf-8'))
+                    self.pages[page_key(rec['url'])] = rec['html']
+        except (IOError, EOFError, zlib.error, ValueError) as err:
+            # A missing file is an empty recording; anything else is
+            # the end of an aborted one.
+            if os.path.exists(file_name):
+                ScholarUtils.log('warn', 'recording %s ends early (%s), '
+                                 'using its first %d pages'
+                                 % (file_name, err, len(self.pages)))
+                self._truncated = True
+        self._file = None
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __iter__(self):
+        return iter(self.pages.items())
+
+    def get(self, url):
+        """Returns the recorded HTML for the URL, or None."""
+        return self.pages.get(page_key(url))
+
+    def add(self, url, html):
+        if isinstance(html, bytes):
+            html = html.decode('utf-8')
+        with self._lock:
+            self.pages[page_key(url)] = html
+            if self._file is None:
+                if self._truncated:
+                    self._rewrite()
+                self._file = gzip.open(self.file_name, 'ab')
+            self._write(self._file, url, html)
+            self._file.flush()
+
+    def _rewrite(self):
+        # Readers stop at the end of an aborted gzip stream, so pages
+        # appended after it would be lost: start over with a complete
+        # one instead.
+        tmp_name = self.file_name + '.tmp'
+        with gzip.open(tmp_name, 'wb') as data_file:
+            for key, html in self.pages.items():
+                self._write(data_file, key, html)
+        os.rename(tmp_name, self.file_name)
+        self._truncated = False
+
+    @staticmethod
+    def _write(data_file, url, html):
+        line = json.dumps({'url': url, 'html': html}) + '\n'
+        data_file.write(line.encode('utf-8'))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class _ReplayElement(object):
+
+    """
+    Just enough of a Selenium WebElement for ScholarQuerier, on top of
+    a BeautifulSoup tag.
+    """
+
+    def __init__(self, tag):
+        self.tag = tag
+
+    def get_attribute(self, name):
+        return self.tag.get(name)
+
+    def __getitem__(self, name):
+        return self.tag.get(name)
+
+
+class _PageDriver(object):
+
+    """
+    Base class for the WebDriver stand-ins below. Derived classes
+    implement _fetch(), which returns the HTML for a URL; this class
+    adds latency and challenge injection and provides the parts of the
+    WebDriver interface ScholarQuerier uses.
+    """
+
+    def __init__(self, latency=0.0, challenge_rate=0.0, seed=None):
+        self.latency = latency
+        self.challenge_rate = challenge_rate
+        self.random = random.Random(seed)
+        self.current_url = None
+        self.page_source = ''
+        self.num_requests = 0
+        self._soup = None
+
+    def get(self, url):
+        self.num_requests += 1
+        self.current_url = url
+        self._soup = None
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if self.challenge_rate > 0 and \
+           self.random.random() < self.challenge_rate:
+            self.page_source = CHALLENGE_HTML
+            return
+        self.page_source = self._fetch(url)
+
+    def _fetch(self, url):
+        raise NotImplementedError
+
+    def _get_soup(self):
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.page_source)
+        return self._soup
+
+    def find_element(self, by, value):
+        # Selenium raises NoSuchElementException here; ScholarQuerier
+        # checks for None, which is what we return instead.
+        tags = self.find_elements(by, value)
+        if not tags:
+            return None
+        return tags[0]
+
+    def find_elements(self, by, value):
+        # Only the locators ScholarQuerier uses.
+        if by == 'id':
+            tags = self._get_soup().findAll(attrs={'id': value})
+        elif by == 'tag name':
+            tags = self._get_soup().findAll(value)
+        else:
+            raise ValueError('unsupported locator: %s' % by)
+        return [_ReplayElement(tag) for tag in tags]
+
+    def quit(self):
+        pass
+
+
+class ReplayDriver(_PageDriver):
+
+    """
+    A WebDriver stand-in serving pages straight from a recording: any
+    object with a get() method returning the HTML for a page key, see
+    page_key(), or None.
+    """
+
+    def __init__(self, pages, **kwargs):
+        _PageDriver.__init__(self, **kwargs)
+        self.pages = pages
+
+    def _fetch(self, url):
+        html = self.pages.get(page_key(url))
+        if html is None:
+            ScholarUtils.log('info', 'not in recording: %s' % url)
+            return EMPTY_HTML
+        return html
+
+
+class HttpDriver(_PageDriver):
+
+    """
+    A WebDriver stand-in fetching pages over plain HTTP from another
+    site, usually a ScholarMockServer. Scholar URLs are rewritten to
+    point at that site.
+    """
+
+    def __init__(self, site, timeout=30, **kwargs):
+        _PageDriver.__init__(self, **kwargs)
+        self.site = site.rstrip('/')
+        self.timeout = timeout
+
+    def _fetch(self, url):
+        try:
+            resp = urlopen(self.site + page_key(url), timeout=self.timeout)
+        except HTTPError as err:
+            resp = err
+        return resp.read().decode('utf-8')
+
+
+class _MockRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        if server.latency > 0:
+            time.sleep(server.latency)
+        status = 200
+        content_type = 'text/html; charset=utf-8'
+        with server.lock:
+            server.num_requests += 1
+            challenge = server.challenge_rate > 0 and \
+                server.random.random() < server.challenge_rate
+        if self.path.startswith('/asset/'):
+            # Stand-ins for images, fonts and style sheets.
+            html = 'x' * server.asset_size
+            content_type = 'application/octet-stream'
+        elif challenge:
+            html = CHALLENGE_HTML
+        else:
+            html = server.pages.get(self.path)
+            if html is None:
+                status = 404
+                html = EMPTY_HTML
+        if not isinstance(html, bytes):
+            html = html.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(html)))
+        self.end_headers()
+        self.wfile.write(html)
+        with server.lock:
+            server.bytes_sent += len(html)
+
+    def log_message(self, fmt, *args):
+        ScholarUtils.log('debug', 'mock server: ' + fmt % args)
+
+
+class ScholarMockServer(ThreadingMixIn, HTTPServer):
+
+    """
+    A local HTTP server serving recorded pages, with configurable
+    latency and challenge-page injection. Pages are looked up by path
+    and query string, see page_key(); paths below /asset/ are answered
+    with asset_size bytes of filler. Call start() to serve from a
+    background thread and stop() to shut down.
+    """
+    daemon_threads = True
+
+    def __init__(self, pages, host='127.0.0.1', port=0, latency=0.0,
+                 challenge_rate=0.0, seed=None, asset_size=1024):
+        HTTPServer.__init__(self, (host, port), _MockRequestHandler)
+        self.pages = pages
+        self.asset_size = asset_size
+        self.latency = latency
+        self.challenge_rate = challenge_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.num_requests = 0
+        self.bytes_sent = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    usage = 'replay.py [options] <recording>\n' \
+        'Serves a recording of Scholar pages over local HTTP.'
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('--host', default='127.0.0.1',
+                      help='Address to listen on (default: 127.0.0.1)')
+    parser.add_option('--port', type='int', default=8080,
+                      help='Port to listen on (default: 8080)')
+    parser.add_option('--latency', type='float', default=0.0,
+                      help='Seconds to wait before serving each page')
+    parser.add_option('--challenge-rate', type='float', default=0.0,
+                      help='Fraction of requests answered with a challenge page')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.print_help()
+        return 1
+
+    recording = ScholarRecording(args[0])
+    server = ScholarMockServer(recording, host=options.host,
+                               port=options.port, latency=options.latency,
+                               challenge_rate=options.challenge_rate)
+    print('serving %d pages at %s' % (len(recording), server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
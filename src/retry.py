@@ -0,0 +1,232 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module decides how ScholarQuerier deals with failed requests. A
+ScholarRetryPolicy classifies errors, retries the retryable ones with
+exponential backoff and jitter, and asks for a browser restart when
+the WebDriver died. A ScholarCircuitBreaker stops sending requests for
+a while when most recent requests failed, instead of hammering a site
+(or a browser) that is down. Both keep counters in their stats member.
+"""
+import collections
+import errno
+import random
+import socket
+import threading
+import time
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from utils import ScholarConf, ScholarUtils
+
+try:
+    import http.client as httplib
+    from urllib.error import URLError
+except ImportError:  # Python 2
+    import httplib
+    from urllib2 import URLError
+
+# Selenium talks to the browser driver over local HTTP, so a dead driver
+# shows as a refused connection or a broken response, raised by httplib
+# or by urllib3, which Selenium uses where it is installed.
+_TIMEOUT_ERRORS = (TimeoutException, socket.timeout)
+_DRIVER_ERRORS = (httplib.BadStatusLine, httplib.CannotSendRequest)
+try:
+    _DRIVER_ERRORS += (ConnectionError,)
+except NameError:  # Python 2
+    pass
+try:
+    import urllib3.exceptions
+    # Not urllib3's TimeoutError: a refused connection is one of those.
+    _TIMEOUT_ERRORS += (urllib3.exceptions.ReadTimeoutError,)
+    _DRIVER_ERRORS += (urllib3.exceptions.HTTPError,)
+except ImportError:
+    pass
+
+
+class ScholarCircuitBreaker(object):
+
+    """
+    A circuit breaker over a sliding window of request outcomes. When
+    the error rate in the window reaches the threshold, the breaker
+    opens and before_request() holds requests back for the cooldown
+    period. Then one trial request goes through (half-open): if it
+    succeeds the breaker closes, otherwise it opens again. A challenge
+    page counts as a failed request: the site is refusing us.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, window=20, threshold=0.5, min_requests=5,
+                 cooldown=300):
+        self.threshold = threshold
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.outcomes = collections.deque(maxlen=window)
+        self.stats = {'opened': 0, 'wait_seconds': 0.0}
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        """Waits until the breaker lets a request through."""
+        with self._lock:
+            if self.state != self.OPEN:
+                return
+            wait = self.opened_at + self.cooldown - time.time()
+            self.state = self.HALF_OPEN
+        if wait > 0:
+            ScholarUtils.log('warn', 'circuit breaker open, waiting %d '
+                             'seconds' % wait)
+            self.stats['wait_seconds'] += wait
+            time.sleep(wait)
+
+    def record(self, success):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                if success:
+                    self.state = self.CLOSED
+                    self.outcomes.clear()
+                else:
+                    self._open()
+                return
+            self.outcomes.append(success)
+            failures = self.outcomes.count(False)
+            if self.state == self.CLOSED and \
+               len(self.outcomes) >= self.min_requests and \
+               failures >= self.threshold * len(self.outcomes):
+                self._open()
+
+    def _open(self):
+        ScholarUtils.log('warn', 'circuit breaker opened')
+        self.state = self.OPEN
+        self.opened_at = time.time()
+        self.stats['opened'] += 1
+        self.outcomes.clear()
+
+
+class ScholarRetryPolicy(object):
+
+    """
+    Classifies request errors and decides whether and when to retry.
+
+      timeout    the page did not load in time; retried
+      driver     the WebDriver crashed or is unreachable; the browser
+                 is restarted, then retried
+      transient  other network or browser errors; retried
+      fatal      errors retrying won't fix, e.g. bugs; not retried
+
+    Retries wait base_delay seconds, doubling per attempt up to
+    max_delay, minus a random share of up to jitter of the wait so that
+    workers do not retry in lockstep.
+    """
+    TIMEOUT = 'timeout'
+    DRIVER = 'driver'
+    TRANSIENT = 'transient'
+    FATAL = 'fatal'
+
+    # Parts of WebDriver error messages saying the browser is gone:
+    DRIVER_ERRORS = ('not reachable', 'no such window', 'invalid session',
+                     'session deleted', 'crashed', 'disconnected',
+                     'failed to decode response from marionette',
+                     'tried to run command without establishing a connection')
+
+    def __init__(self, max_attempts=4, base_delay=2.0, max_delay=120.0,
+                 jitter=0.5, breaker=None, seed=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.breaker = breaker
+        self.random = random.Random(seed)
+        self.stats = {'requests': 0, 'successes': 0, 'retries': 0,
+                      'restarts': 0, 'gave_up': 0, 'challenges': 0,
+                      'backoff_seconds': 0.0,
+                      self.TIMEOUT: 0, self.DRIVER: 0, self.TRANSIENT: 0,
+                      self.FATAL: 0}
+
+    @classmethod
+    def from_conf(cls):
+        """Returns a policy configured as ScholarConf says."""
+        breaker = None
+        if ScholarConf.BREAKER_THRESHOLD > 0:
+            breaker = ScholarCircuitBreaker(
+                window=ScholarConf.BREAKER_WINDOW,
+                threshold=ScholarConf.BREAKER_THRESHOLD,
+                cooldown=ScholarConf.BREAKER_COOLDOWN)
+        return cls(max_attempts=ScholarConf.RETRY_ATTEMPTS,
+                   base_delay=ScholarConf.RETRY_BASE_DELAY,
+                   max_delay=ScholarConf.RETRY_MAX_DELAY,
+                   jitter=ScholarConf.RETRY_JITTER, breaker=breaker)
+
+    @classmethod
+    def classify(cls, err):
+        if isinstance(err, _TIMEOUT_ERRORS):
+            return cls.TIMEOUT
+        if isinstance(err, WebDriverException):
+            msg = (err.msg or '').lower()
+            for text in cls.DRIVER_ERRORS:
+                if text in msg:
+                    return cls.DRIVER
+            return cls.TRANSIENT
+        if isinstance(err, _DRIVER_ERRORS):
+            return cls.DRIVER
+        if isinstance(err, URLError) and \
+           isinstance(err.reason, socket.error):
+            err = err.reason
+        if isinstance(err, socket.error):
+            if err.errno in (errno.ECONNREFUSED, errno.ECONNRESET,
+                             errno.EPIPE):
+                return cls.DRIVER
+            return cls.TRANSIENT
+        if isinstance(err, (IOError, httplib.HTTPException)):
+            return cls.TRANSIENT
+        return cls.FATAL
+
+    def before_request(self):
+        self.stats['requests'] += 1
+        if self.breaker is not None:
+            self.breaker.before_request()
+
+    def succeeded(self):
+        self.stats['successes'] += 1
+        if self.breaker is not None:
+            self.breaker.record(True)
+
+    def failed(self, err):
+        """Records a failed request and returns its error class."""
+        kind = self.classify(err)
+        self.stats[kind] += 1
+        if self.breaker is not None:
+            self.breaker.record(False)
+        return kind
+
+    def challenged(self):
+        """Records a request answered with a challenge page."""
+        self.stats['challenges'] += 1
+        if self.breaker is not None:
+            self.breaker.record(False)
+
+    def should_retry(self, kind, attempt):
+        """
+        Returns True if a request that failed with the given error class
+        on the given (1-based) attempt should be tried again.
+        """
+        if kind == self.FATAL or attempt >= self.max_attempts:
+            self.stats['gave_up'] += 1
+            return False
+        self.stats['retries'] += 1
+        return True
+
+    def delay(self, attempt):
+        """Returns the seconds to wait before retrying the attempt."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        delay *= 1.0 - self.jitter * self.random.random()
+        self.stats['backoff_seconds'] += delay
+        return delay
+
+    def report(self):
+        stats = dict(self.stats)
+        if self.breaker is not None:
+            stats['breaker_opened'] = self.breaker.stats['opened']
+            stats['breaker_wait_seconds'] = self.breaker.stats['wait_seconds']
+        return stats
@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module keeps the state of a browser session between runs: the
+cookies, which also hold the Scholar preferences and let a solved "not a
+robot" challenge carry over, plus the ScholarSettings that were applied.
+The state is a small JSON file that is rewritten atomically, so saving
+and restoring it takes the same time however long the browser has been
+in use, unlike copying the whole Firefox profile.
+"""
+import json
+import os
+import tempfile
+import time
+from utils import ScholarConf, ScholarUtils
+
+
+def settings_prefs(settings):
+    """Returns the session preferences for a ScholarSettings instance."""
+    return {'citform': settings.citform,
+            'per_page_results': settings.per_page_results}
+
+
+class ScholarSession(object):
+
+    """
+    The cookies and preferences of a browser session, stored in a JSON
+    file. restore() loads them into a WebDriver, save() takes them from
+    one.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.cookies = []
+        self.prefs = None
+        try:
+            with open(file_name) as data_file:
+                data = json.load(data_file)
+            self.cookies = data.get('cookies', [])
+            self.prefs = data.get('prefs')
+        except (IOError, ValueError) as err:
+            if os.path.exists(file_name):
+                ScholarUtils.log('warn', 'ignoring session file %s: %s'
+                                 % (file_name, err))
+
+    def restore(self, driver, load=None):
+        """
+        Adds the stored cookies that did not expire yet to the driver.
+        WebDriver only accepts cookies for the site it is on, so this
+        loads a small page from Scholar first, with load(url) if given,
+        else with the driver itself. Returns True if any cookies were
+        restored.
+        """
+        now = time.time()
+        cookies = [cookie for cookie in self.cookies
+                   if cookie.get('expiry') is None or cookie['expiry'] > now]
+        if not cookies:
+            return False
+        (load or driver.get)(ScholarConf.SCHOLAR_SITE + '/robots.txt')
+        num = 0
+        for cookie in cookies:
+            try:
+                driver.add_cookie(cookie)
+                num += 1
+            except Exception as err:
+                ScholarUtils.log('debug', 'cookie %s not restored: %s'
+                                 % (cookie.get('name'), err))
+        ScholarUtils.log('info', 'restored %d cookies from %s'
+                         % (num, self.file_name))
+        return num > 0
+
+    def save(self, driver, settings=None):
+        """
+        Stores the driver's cookies, plus the preferences of settings if
+        given, or else the preferences stored before.
+        """
+        self.cookies = driver.get_cookies()
+        if settings is not None:
+            self.prefs = settings_prefs(settings)
+        # Several queriers may save the same session file at once, so
+        # each writes a temporary file of its own.
+        fd, tmp_file = tempfile.mkstemp(
+            prefix=os.path.basename(self.file_name) + '.', suffix='.tmp',
+            dir=os.path.dirname(self.file_name) or '.')
+        try:
+            with os.fdopen(fd, 'w') as data_file:
+                json.dump({'cookies': self.cookies, 'prefs': self.prefs,
+                           'saved': time.time()}, data_file, indent=2)
+            os.rename(tmp_file, self.file_name)
+        except Exception:
+            os.remove(tmp_file)
+            raise
+
+    def has_settings(self, settings):
+        """Returns True if the session was saved with these settings."""
+        return self.prefs == settings_prefs(settings)
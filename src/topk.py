@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module keeps the K best articles of a crawl, by citation count or
+year, as they come out of the parser, so ranking jobs like "the 100
+most cited papers citing X" hold K articles in memory instead of all of
+them. Scholar lists results roughly by relevance, which goes along
+with citations, so once a few pages in a row did not get an article
+into the top K, later pages are unlikely to either; with a patience the
+crawl stops there.
+"""
+import heapq
+from utils import ScholarUtils
+
+KEYS = ('num_citations', 'year')
+
+
+class ScholarTopK(object):
+
+    """
+    The k articles with the largest key seen so far, in a bounded heap.
+    offer() articles one at a time, or run() a whole iterator of them,
+    e.g. ScholarQuerier.iter_results(); articles() returns the top k,
+    best first. Ties keep the article seen first. With a patience,
+    run() stops once the heap is full and that many result pages in a
+    row did not change it.
+    """
+
+    def __init__(self, k, key='num_citations', patience=None):
+        if key not in KEYS:
+            raise ValueError('top-k key must be one of %s' % ', '.join(KEYS))
+        if k < 1:
+            raise ValueError('top-k needs k of at least 1')
+        self.k = k
+        self.key = key
+        self.patience = patience
+        self.stats = {'seen': 0, 'pages': 0, 'stopped_early': False}
+        self._heap = []
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def value(self, art):
+        """Returns the key of an article, 0 if it has none."""
+        try:
+            return int(art[self.key] or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def offer(self, art):
+        """Considers an article; returns True if it made the top k."""
+        self.stats['seen'] += 1
+        # The negated sequence number makes earlier articles win ties.
+        self._seq += 1
+        entry = (self.value(art), -self._seq, art)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return True
+        if entry[:2] <= self._heap[0][:2]:
+            return False
+        heapq.heapreplace(self._heap, entry)
+        return True
+
+    def run(self, articles):
+        """
+        Offers all articles of an iterator, in which None marks the end
+        of a result page, as ScholarQuerier.iter_results(page_ends=True)
+        yields them; the patience counts these pages. Stopping early
+        closes the iterator, so no further pages are fetched.
+        """
+        idle_pages = 0
+        changed = False
+        for art in articles:
+            if art is not None:
+                changed = self.offer(art) or changed
+                continue
+            self.stats['pages'] += 1
+            idle_pages = 0 if changed else idle_pages + 1
+            changed = False
+            if self.patience and len(self._heap) >= self.k and \
+               idle_pages >= self.patience:
+                self.stats['stopped_early'] = True
+                ScholarUtils.log('info', 'top %d unchanged for %d pages, '
+                                 'stopping after %d articles'
+                                 % (self.k, idle_pages, self.stats['seen']))
+                if hasattr(articles, 'close'):
+                    articles.close()
+                break
+        return self
+
+    def threshold(self):
+        """Returns the key an article needs to make the top k, or None."""
+        if len(self._heap) < self.k:
+            return None
+        return self._heap[0][0]
+
+    def articles(self):
+        """Returns the top articles, best first."""
+        return [entry[2] for entry in sorted(self._heap, reverse=True,
+                                             key=lambda entry: entry[:2])]
@@ -0,0 +1,146 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module records a timeline of what a crawl spends its time on, as
+spans: result pages, requests and their retries, navigation, the wait
+for the page to settle, parsing, citation data fetches, output, and
+challenge pauses. The spans are written as they end to a Chrome
+trace-event file in the JSON array format, which opens in
+chrome://tracing and https://ui.perfetto.dev, with one track per
+thread, so concurrent fetches show side by side. The format does not
+need the closing bracket, so the file can be opened even if the run was
+killed.
+
+Code marks spans with
+
+  with span('navigate', url=url):
+      ...
+
+which costs next to nothing while no tracer is set with set_tracer().
+"""
+import json
+import os
+import threading
+import time
+
+# Durations must not jump with the wall clock; Python 2 has no
+# monotonic clock, though.
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+_tracer = None
+
+
+def set_tracer(tracer):
+    """Makes span() record into tracer, or nothing if tracer is None."""
+    global _tracer
+    _tracer = tracer
+
+
+def span(name, **args):
+    """
+    Returns a context manager recording a span with the given name and
+    arguments on the current thread's track, if a tracer is set.
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, args)
+
+
+def instant(name, **args):
+    """Records a moment, e.g. a challenge page showing up."""
+    if _tracer is not None:
+        _tracer.instant(name, args)
+
+
+class _Span(object):
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = self.tracer.now()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args['error'] = '%s: %s' % (exc_type.__name__, exc)
+        self.tracer.add({'name': self.name, 'ph': 'X', 'ts': self.start,
+                         'dur': self.tracer.now() - self.start,
+                         'args': self.args})
+        return False
+
+
+class ScholarTracer(object):
+
+    """
+    Writes trace events to file_name as they come, so that memory use
+    does not grow with the run, and finishes the file on close().
+    Timestamps are microseconds since the tracer was created.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._origin = _clock()
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._file = open(file_name, 'w')
+        self._file.write('[')
+        self._sep = '\n'
+
+    def now(self):
+        return int((_clock() - self._origin) * 1e6)
+
+    def span(self, name, args):
+        return _Span(self, name, args)
+
+    def instant(self, name, args):
+        self.add({'name': name, 'ph': 'i', 's': 't', 'ts': self.now(),
+                  'args': args})
+
+    def add(self, event):
+        thread = threading.current_thread()
+        event['pid'] = os.getpid()
+        event['cat'] = 'scholar'
+        with self._lock:
+            tid = self._threads.get(thread.ident)
+            if tid is None:
+                # Small thread IDs, named after the threads, read better
+                # in the viewers than the system ones.
+                tid = len(self._threads) + 1
+                self._threads[thread.ident] = tid
+                self._write({'name': 'thread_name', 'ph': 'M',
+                             'pid': event['pid'], 'tid': tid,
+                             'args': {'name': thread.name}})
+            event['tid'] = tid
+            self._write(event)
+
+    def close(self):
+        """Finishes the trace file; later events are dropped."""
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write('\n]\n')
+            self._file.close()
+            self._file = None
+
+    def _write(self, event):
+        # Flushed right away: a run killed by a signal keeps its events.
+        if self._file is None:
+            return
+        self._file.write(self._sep + json.dumps(event))
+        self._file.flush()
+        self._sep = ',\n'
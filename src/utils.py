@@ -2,10 +2,24 @@
 # -*- coding: utf8 -*-
 
 import sys
-import json
 from excepts import FormatError
+from tracing import span
+from membudget import ScholarResultBuffer
 
-json_results = []
+try:
+    unicode
+except NameError:  # Python 3
+    unicode = str
+
+try:
+    import lxml
+    _HTML_PARSER = 'lxml'
+except ImportError:
+    _HTML_PARSER = None
+
+# The records of the current --json results file. Give it a
+# membudget.ScholarMemoryBudget to spill them to disk beyond it.
+json_results = ScholarResultBuffer()
 
 
 class ScholarSettings(object):
@@ -54,10 +68,59 @@ class ScholarConf(object):
     STARTING_RESULT = 0  # Result offset (to change page)
     SCHOLAR_SITE = 'http://scholar.google.com'
 
+    # Seconds to let a page settle after loading it, and to pause
+    # between result pages:
+    PAGE_LOAD_WAIT = 1
+    PAGE_INTERVAL = 1
+
+    # Seconds before a page load counts as timed out:
+    PAGE_LOAD_TIMEOUT = 60
+
+    # Retries of failed requests (see retry.py): attempts per request,
+    # and the wait before a retry, doubling per attempt up to the
+    # maximum, minus a random share of up to RETRY_JITTER.
+    RETRY_ATTEMPTS = 4
+    RETRY_BASE_DELAY = 2
+    RETRY_MAX_DELAY = 120
+    RETRY_JITTER = 0.5
+
+    # The circuit breaker holds requests back for BREAKER_COOLDOWN
+    # seconds once this share of the last BREAKER_WINDOW requests
+    # failed. A threshold of 0 disables it.
+    BREAKER_THRESHOLD = 0.5
+    BREAKER_WINDOW = 20
+    BREAKER_COOLDOWN = 300
+
+    # What to do when Scholar serves a "not a robot" challenge page:
+    # 'park' gives up on the page right away, 'backoff' first retries
+    # CHALLENGE_RETRIES times, waiting CHALLENGE_BACKOFF seconds and
+    # doubling the wait each time, and 'debug' drops into the debugger
+    # so the challenge can be solved in the browser.
+    CHALLENGE_POLICY = 'park'
+    CHALLENGE_RETRIES = 3
+    CHALLENGE_BACKOFF = 60
+    CHALLENGE_MAX_BACKOFF = 3600
+
+    # The BeautifulSoup tree builder for pages: lxml, the fastest, if
+    # installed, else None, which lets BeautifulSoup pick the best it
+    # has.
+    HTML_PARSER = _HTML_PARSER
+
     USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.10; rv:39.0) Gecko/20100101 Firefox/39.0'
 
-    # If set, we will use this file to read/save cookies to enable
-    # cookie use across sessions.
+    # If True, only the parts of results pages the parser reads are
+    # taken from the browser, instead of the whole page source.
+    EXTRACT_RESULTS = False
+
+    # If True, the browser runs headless and without images, fonts,
+    # media and prefetching, see ScholarQuerier.LEAN_PREFS. It is made
+    # visible when a challenge page shows up.
+    LEAN_BROWSER = False
+
+    # The cookies and settings of the browser session are kept in
+    # SESSION_FILE between runs (see session.py), or in COOKIE_JAR_FILE
+    # if set.
+    SESSION_FILE = '../session.json'
     COOKIE_JAR_FILE = None
 
 
@@ -108,7 +171,7 @@ def txt(querier, with_globals):
             if item[0] is not None:
                 print(fmt % (item[1], item[0]))
         if len(items) > 0:
-            print
+            print('')
 
     articles = querier.articles
     for art in articles:
@@ -116,10 +179,12 @@ def txt(querier, with_globals):
 
 
 def encode(s):
-    if isinstance(s, basestring):
+    """Returns s as a native string, UTF-8 encoded on Python 2."""
+    if isinstance(s, str):
+        return s
+    if isinstance(s, unicode):
         return s.encode('utf-8')  # pylint: disable-msg=C0103
-    else:
-        return str(s)
+    return str(s)
 
 
 def csv(querier, header=False, sep='|'):
@@ -131,17 +196,30 @@ def csv(querier, header=False, sep='|'):
 
 
 def reset_res():
-    del json_results[:]
+    finish_res()
+
+
+def finish_res():
+    """
+    Writes out the rest of a results file records were spilled to, if
+    any, and starts over with an empty list.
+    """
+    if json_results.num_spilled:
+        ScholarUtils.log('info', 'finishing %s, %d records spilled to it'
+                         % (json_results.file_name, json_results.num_spilled))
+    json_results.finish()
 
 
 def to_json(querier, file_name='../res.json'):
-    print 'adding ' + str(len(querier.articles)) + ' articles to json list'
-    print 'total articles in json list: ' + str(len(json_results))
-    for art in querier.articles:
-        json_results.append(
-            {key: art.attrs[key][0] for key in art.attrs.keys()})
-    with open(file_name, 'wb') as f:
-        json.dump(json_results, f)
+    print('adding ' + str(len(querier.articles)) + ' articles to json list')
+    print('total articles in json list: ' + str(len(json_results)))
+    if json_results.file_name not in (None, file_name):
+        finish_res()
+    # Without spilled records, the results file is complete after every
+    # page; with them, it is complete up to the last spill.
+    if json_results.add([art.as_dict() for art in querier.articles],
+                        file_name):
+        json_results.write(file_name)
 
 
 def citation_export(querier):
@@ -151,6 +229,11 @@ def citation_export(querier):
 
 
 def output_query(options, querier, file_name):
+    with span('output', articles=len(querier.articles)):
+        _output_query(options, querier, file_name)
+
+
+def _output_query(options, querier, file_name):
     if options.json:
         to_json(querier, file_name)
     elif options.csv:
@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+# -*- coding: utf8 -*-
+"""
+This module provides a lease-based work queue that lets any number of
+pyscholar.py workers share a crawl. The queue lives in a SQLite
+database file in WAL mode, which needs shared memory between the
+workers: keep the file on a local disk and run the workers on that
+host, as WAL does not work over NFS or other network file systems.
+
+A worker claims a task, which leases it for a limited time. While
+working on it the worker sends heartbeats to extend the lease, and
+finally records the task as done (or failed). Leases that expire
+because a worker died go back to the pending tasks, so another worker
+picks them up.
+"""
+import json
+import socket
+import sqlite3
+import time
+import os
+from utils import ScholarUtils
+
+
+class ScholarTask(object):
+
+    """
+    A unit of work claimed from a ScholarWorkQueue. The kind is either
+    'url' (a citations list URL to crawl) or 'query' (a dictionary of
+    search parameters, see query.query_from_spec); the payload is the
+    decoded JSON stored with the task.
+    """
+
+    def __init__(self, task_id, kind, payload, attempts, owner):
+        self.id = task_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.owner = owner
+
+    def __repr__(self):
+        return 'ScholarTask(%d, %s, %r)' % (self.id, self.kind, self.payload)
+
+
+class ScholarWorkQueue(object):
+
+    """
+    A work queue backed by a SQLite database. Tasks move between the
+    states below; a task is only ever leased to one worker at a time
+    and only the current lease owner may complete it.
+    """
+    PENDING = 'pending'
+    LEASED = 'leased'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind          TEXT NOT NULL,
+            key           TEXT NOT NULL UNIQUE,
+            payload       TEXT NOT NULL,
+            state         TEXT NOT NULL DEFAULT 'pending',
+            owner         TEXT,
+            lease_expires REAL,
+            attempts      INTEGER NOT NULL DEFAULT 0,
+            error         TEXT,
+            result        TEXT,
+            created       REAL NOT NULL,
+            finished      REAL
+        );
+        CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, id);
+    """
+
+    def __init__(self, db_file, lease_time=300, max_attempts=3):
+        self.db_file = db_file
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(db_file, timeout=60,
+                                    isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+
+    @staticmethod
+    def worker_name():
+        """Returns a worker name that is unique across hosts."""
+        return '%s:%d' % (socket.gethostname(), os.getpid())
+
+    def add(self, kind, payload, key=None):
+        """
+        Adds a task unless a task with the same key already exists, and
+        returns True if it was added. The key defaults to the kind and
+        payload, so enqueueing the same URL twice is harmless.
+        """
+        payload = json.dumps(payload, sort_keys=True)
+        if key is None:
+            key = kind + ':' + payload
+        cur = self.conn.execute(
+            'INSERT OR IGNORE INTO tasks (kind, key, payload, created) '
+            'VALUES (?, ?, ?, ?)', (kind, key, payload, time.time()))
+        return cur.rowcount > 0
+
+    def claim(self, worker):
+        """
+        Leases the oldest pending task to the given worker and returns
+        it as a ScholarTask, or returns None if no task is pending.
+        """
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._expire_leases(now)
+            row = self.conn.execute(
+                'SELECT id, kind, payload, attempts FROM tasks '
+                'WHERE state = ? ORDER BY id LIMIT 1',
+                (self.PENDING,)).fetchone()
+            if row is None:
+                self.conn.execute('COMMIT')
+                return None
+            self.conn.execute(
+                'UPDATE tasks SET state = ?, owner = ?, lease_expires = ?, '
+                'attempts = attempts + 1 WHERE id = ?',
+                (self.LEASED, worker, now + self.lease_time, row[0]))
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        ScholarUtils.log('info', 'claimed task %d (%s)' % (row[0], row[1]))
+        return ScholarTask(row[0], row[1], json.loads(row[2]), row[3] + 1,
+                           worker)
+
+    def heartbeat(self, task):
+        """
+        Extends the lease on a task. Returns False if the lease has been
+        lost, i.e. the task expired and went to another worker.
+        """
+        cur = self.conn.execute(
+            'UPDATE tasks SET lease_expires = ? '
+            'WHERE id = ? AND owner = ? AND state = ?',
+            (time.time() + self.lease_time, task.id, task.owner, self.LEASED))
+        if cur.rowcount == 0:
+            ScholarUtils.log('warn', 'lease on task %d lost' % task.id)
+            return False
+        return True
+
+    def complete(self, task, result=None):
+        """
+        Records a task as done. Returns False if the worker no longer
+        held the lease, in which case the completion is not recorded.
+        """
+        cur = self.conn.execute(
+            'UPDATE tasks SET state = ?, result = ?, finished = ?, '
+            'lease_expires = NULL WHERE id = ? AND owner = ? AND state = ?',
+            (self.DONE, json.dumps(result), time.time(), task.id,
+             task.owner, self.LEASED))
+        return cur.rowcount > 0
+
+    def fail(self, task, error, retry=True):
+        """
+        Gives up a task after an error. It goes back to the pending
+        tasks unless retry is False or it has used up its attempts.
+        """
+        state = self.PENDING
+        if not retry or task.attempts >= self.max_attempts:
+            state = self.FAILED
+        cur = self.conn.execute(
+            'UPDATE tasks SET state = ?, error = ?, owner = NULL, '
+            'lease_expires = NULL WHERE id = ? AND owner = ? AND state = ?',
+            (state, str(error), task.id, task.owner, self.LEASED))
+        return cur.rowcount > 0
+
+    def stats(self):
+        """Returns a dictionary of task counts by state."""
+        res = dict((state, 0) for state in
+                   (self.PENDING, self.LEASED, self.DONE, self.FAILED))
+        for state, count in self.conn.execute(
+                'SELECT state, COUNT(*) FROM tasks GROUP BY state'):
+            res[state] = count
+        return res
+
+    def close(self):
+        self.conn.close()
+
+    def _expire_leases(self, now):
+        # Expired leases either go back to the pending tasks or, once
+        # they used up their attempts, are marked as failed.
+        self.conn.execute(
+            'UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? '
+            'END, owner = NULL, lease_expires = NULL, error = ? '
+            'WHERE state = ? AND lease_expires < ?',
+            (self.max_attempts, self.FAILED, self.PENDING, 'lease expired',
+             self.LEASED, now))
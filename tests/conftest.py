@@ -0,0 +1,99 @@
+"""
+Shared fixtures. The modules live in src/ and import each other by
+their plain names, and they write their files relative to the working
+directory, so every test runs in a scratch directory of its own, with
+the waits of ScholarConf turned off.
+"""
+import optparse
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'src'))
+
+from benchmark import synthetic_page
+from query import ScholarQuerier
+from replay import ReplayDriver
+from utils import ScholarConf, json_results
+
+try:
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:  # Python 2
+    from urlparse import parse_qs, urlsplit
+
+CITES_URL = ScholarConf.SCHOLAR_SITE + '/scholar?cites=4412725301034017472'
+
+
+class SyntheticPages(object):
+
+    """
+    Results pages for any query, total results in all, as a page source
+    for ReplayDriver. Fetching a page whose start is in broken raises an
+    IOError; the starts fetched are kept in fetched.
+    """
+
+    def __init__(self, total=50, broken=()):
+        self.total = total
+        self.broken = set(broken)
+        self.fetched = []
+
+    def get(self, key):
+        args = parse_qs(urlsplit(key).query)
+        start = int(args.get('start', ['0'])[0])
+        num = int(args.get('num', [str(ScholarConf.MAX_PAGE_RESULTS)])[0])
+        if start in self.broken:
+            raise IOError('connection reset')
+        self.fetched.append(start)
+        if start >= self.total:
+            return None
+        return synthetic_page(min(num, self.total - start), start=start,
+                              total=self.total)
+
+
+def make_querier(pages, **kwargs):
+    """Returns a querier fetching from pages through a ReplayDriver."""
+    return ScholarQuerier(driver=ReplayDriver(pages, **kwargs))
+
+
+def make_options(**kwargs):
+    """Returns pyscholar.py options with their defaults, as main() has."""
+    defaults = {'json': True, 'csv': False, 'csv_header': False,
+                'citation': None, 'txt': False, 'txt_globals': False,
+                'cookie_file': None, 'start': 0, 'count': None,
+                'prefetch': 0, 'top': None, 'top_key': 'num_citations',
+                'top_patience': None, 'url': None, 'urls': None,
+                'cluster_id': None, 'author': None, 'allw': None,
+                'some': None, 'none': None, 'phrase': None,
+                'title_only': False, 'pub': None, 'after': None,
+                'before': None, 'no_patents': False, 'no_citations': False,
+                'cluster_ids': None, 'cluster_cache': None,
+                'cluster_output': '-', 'workers': 1, 'replay': None,
+                'replay_latency': 0.0, 'replay_challenge_rate': 0.0,
+                'batch_output': '../batch', 'index': None}
+    defaults.update(kwargs)
+    return optparse.Values(defaults)
+
+
+@pytest.fixture(autouse=True)
+def scratch(tmp_path, monkeypatch):
+    """
+    Runs the test in tmp_path/work, so that the usual ../res.json and
+    ../results/ end up in tmp_path, with no waiting between pages or
+    retries, and with a fresh results buffer.
+    """
+    work = tmp_path / 'work'
+    work.mkdir()
+    (tmp_path / 'results').mkdir()
+    monkeypatch.chdir(str(work))
+    for name, val in (('PAGE_LOAD_WAIT', 0), ('PAGE_INTERVAL', 0),
+                      ('RETRY_ATTEMPTS', 2), ('RETRY_BASE_DELAY', 0),
+                      ('RETRY_JITTER', 0), ('BREAKER_THRESHOLD', 0),
+                      ('CHALLENGE_BACKOFF', 0), ('LOG_LEVEL', 0),
+                      ('SESSION_FILE', str(tmp_path / 'session.json'))):
+        monkeypatch.setattr(ScholarConf, name, val)
+    json_results.clear()
+    json_results.budget = None
+    yield tmp_path
+    json_results.clear()
@@ -0,0 +1,75 @@
+from adaptive import ScholarAdaptiveController
+from query import SearchScholarQuery
+
+from conftest import CITES_URL, SyntheticPages, make_querier
+
+OK = ScholarAdaptiveController.OK
+ERROR = ScholarAdaptiveController.ERROR
+CHALLENGE = ScholarAdaptiveController.CHALLENGE
+
+
+def make_controller(**kwargs):
+    args = {'min_concurrency': 1, 'max_concurrency': 4, 'min_interval': 0.0,
+            'max_interval': 8.0, 'interval': 1.0, 'interval_step': 0.1,
+            'target_latency': 5.0, 'window': 10}
+    args.update(kwargs)
+    return ScholarAdaptiveController(**args)
+
+
+def load(controller, outcome, latency=0.1, times=1):
+    for _ in range(times):
+        controller.in_flight += 1
+        controller.record(latency, outcome)
+
+
+def test_fast_loads_raise_limit_and_shorten_interval():
+    controller = make_controller()
+    load(controller, OK, times=20)
+    assert controller.metrics()['limit'] == 4
+    assert controller.interval == 0.0
+    assert controller.stats['increases'] == 3
+
+
+def test_challenge_halves_limit_and_doubles_interval():
+    controller = make_controller(interval=2.0)
+    load(controller, OK, times=20)
+    limit = controller.limit
+    load(controller, CHALLENGE)
+    assert controller.limit == limit / 2
+    # Down to no interval at all, it starts again from one step.
+    assert controller.interval == 0.1
+    load(controller, CHALLENGE, times=10)
+    assert controller.limit == 1
+    assert controller.interval == 8.0
+    assert controller.metrics()['decisions'][-1]['reason'] == 'challenge page'
+
+
+def test_error_bursts_cut_once_per_window():
+    controller = make_controller(interval=2.0)
+    load(controller, OK, times=10)
+    load(controller, ERROR, times=5)
+    assert controller.stats['decreases'] == 1
+    load(controller, ERROR, times=5)
+    assert controller.stats['decreases'] == 1
+
+
+def test_slow_pages_cut_limit():
+    controller = make_controller()
+    load(controller, OK, times=20)
+    load(controller, OK, latency=60.0)
+    assert controller.limit == 3.0
+    assert controller.metrics()['decisions'][-1]['reason'].startswith(
+        'latency')
+
+
+def test_querier_reports_its_loads():
+    controller = make_controller(min_interval=0.0, interval=0.0)
+    querier = make_querier(SyntheticPages(total=30))
+    querier.controller = controller
+    query = SearchScholarQuery()
+    query.set_url(CITES_URL)
+    assert len(list(querier.iter_results(query))) == 30
+    metrics = controller.metrics()
+    assert metrics['requests'] == 3
+    assert metrics['in_flight'] == 0
+    assert metrics['errors'] == 0
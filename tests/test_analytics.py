@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from analytics import ScholarCorpus, venue_of
+
+RECORDS = [
+    {'cluster_id': '1', 'num_citations': 10, 'num_versions': 3,
+     'year': '2001', 'authors': 'A Einstein - Physical Review, 2001 - APS'},
+    {'cluster_id': '2', 'num_citations': 4, 'num_versions': 1,
+     'year': '2001', 'authors': 'N Bohr - Nature, 2001'},
+    {'cluster_id': '3', 'num_citations': 3, 'num_versions': None,
+     'year': '2003', 'authors': 'M Born - Physical Review, 2003 - APS'},
+    {'cluster_id': '1', 'num_citations': 10, 'num_versions': 3,
+     'year': '2001', 'authors': 'A Einstein - Physical Review, 2001 - APS'},
+    {'cluster_id': None, 'num_citations': 0, 'num_versions': 1,
+     'year': None, 'authors': 'Anonymous'},
+]
+
+
+def write_results(tmp_path, records=RECORDS):
+    file_name = str(tmp_path / 'res.json')
+    with open(file_name, 'w') as data_file:
+        json.dump(records, data_file)
+    return file_name
+
+
+def test_venue_of():
+    assert venue_of('A Einstein, B Podolsky - Physical Review') == \
+        'Physical Review'
+    assert venue_of('A Einstein, B Podolsky - Physical Review, 1935 - APS') \
+        == 'Physical Review'
+    assert venue_of('N Bohr - 1935 - APS') is None
+    assert venue_of('A Einstein') is None
+    assert venue_of(None) is None
+
+
+def test_statistics(tmp_path):
+    corpus = ScholarCorpus.from_files([write_results(tmp_path)]).unique()
+    assert len(corpus) == 4
+    assert corpus.h_index() == 3
+    assert corpus.g_index() == 4
+    summary = corpus.citation_summary()
+    assert summary['total'] == 17 and summary['uncited'] == 1
+    assert corpus.citation_histogram() == [(0, 1), (2, 1), (4, 1), (8, 1)]
+    assert corpus.per_year() == [(2001, 2, 14), (2003, 1, 3)]
+    assert corpus.top_venues(1)[0][1:] == (2, 13)
+
+
+def test_cache_is_used_until_the_files_change(tmp_path):
+    file_name = write_results(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    fresh = ScholarCorpus.from_files([file_name], cache_dir)
+    cached = ScholarCorpus.from_files([file_name], cache_dir)
+    assert isinstance(cached.num_citations, numpy.memmap)
+    assert list(cached.num_citations) == list(fresh.num_citations)
+    assert cached.venues == fresh.venues
+
+    write_results(tmp_path, RECORDS[:2])
+    os.utime(file_name, (0, 0))
+    reloaded = ScholarCorpus.from_files([file_name], cache_dir)
+    assert len(reloaded) == 2
@@ -0,0 +1,47 @@
+import archive
+from archive import ScholarPageArchive
+
+from conftest import CITES_URL
+
+
+def test_latest_fetch_of_url(scratch):
+    pages = ScholarPageArchive(str(scratch / 'archive'), compression='zlib')
+    pages.add(CITES_URL, u'<html>first caf\xe9</html>', fetch_time=1.0)
+    pages.add(CITES_URL, u'<html>second</html>', fetch_time=2.0)
+    assert pages.get(CITES_URL) == u'<html>second</html>'
+    assert pages.get(CITES_URL + '&start=10') is None
+    assert [fetch[1] for fetch in pages.scan()] == [1.0, 2.0]
+    assert len(pages) == 1
+    pages.close()
+
+
+def test_hash_collision_does_not_return_another_page(scratch, monkeypatch):
+    monkeypatch.setattr(archive, 'url_hash', lambda url: 42)
+    pages = ScholarPageArchive(str(scratch / 'archive'), compression='zlib')
+    pages.add('http://scholar.google.com/a', 'page a')
+    pages.add('http://scholar.google.com/b', 'page b')
+    assert pages.get('http://scholar.google.com/a') is None
+    assert pages.get('http://scholar.google.com/b') == 'page b'
+    pages.close()
+
+
+def test_writers_sharing_an_archive(scratch):
+    directory = str(scratch / 'archive')
+    first = ScholarPageArchive(directory, compression='zlib',
+                               initial_capacity=4, segment_size=300)
+    second = ScholarPageArchive(directory, compression='zlib',
+                                initial_capacity=4, segment_size=300)
+    urls = ['http://scholar.google.com/p%d' % num for num in range(20)]
+    for num, url in enumerate(urls):
+        (first, second)[num % 2].add(url, 'page %d' % num)
+    for pages in (first, second):
+        assert [pages.get(url) for url in urls] == \
+            ['page %d' % num for num in range(20)]
+        assert len(pages) == 20
+    assert first.num_fetches() == 20
+    first.close()
+    second.close()
+    reopened = ScholarPageArchive(directory)
+    reopened.reindex()
+    assert reopened.get(urls[7]) == 'page 7'
+    reopened.close()
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+
+import asyncquery
+from asyncquery import ScholarAsyncQuerier
+from query import SearchScholarQuery
+
+from conftest import CITES_URL, SyntheticPages, make_querier
+
+
+def make_query():
+    query = SearchScholarQuery()
+    query.set_url(CITES_URL)
+    return query
+
+
+def test_querier_is_made_off_the_loop_thread(monkeypatch):
+    threads = []
+
+    def new_querier():
+        threads.append(threading.current_thread())
+        return make_querier(SyntheticPages(total=30))
+    monkeypatch.setattr(asyncquery, 'ScholarQuerier', new_querier)
+
+    async def citing():
+        async with ScholarAsyncQuerier() as querier:
+            assert threads and threads[0] is not threading.current_thread()
+            return [art async for art in querier.iter_results(make_query())]
+    assert len(asyncio.run(citing())) == 30
+    assert len(threads) == 1
+
+
+def test_queriers_run_concurrently():
+    async def citing(total):
+        querier = await ScholarAsyncQuerier.create(
+            make_querier(SyntheticPages(total=total)))
+        try:
+            return [art async for art in querier.iter_results(make_query(), 25)]
+        finally:
+            await querier.quit()
+
+    async def both():
+        return await asyncio.gather(citing(12), citing(40))
+    assert [len(arts) for arts in asyncio.run(both())] == [12, 25]
+
+
+def test_send_query_returns_articles():
+    async def send():
+        async with ScholarAsyncQuerier(make_querier(SyntheticPages())) as querier:
+            return await querier.send_query(make_query())
+    assert len(asyncio.run(send())) == 10
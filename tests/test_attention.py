@@ -0,0 +1,89 @@
+import json
+
+from attention import ScholarAttentionQueue
+from pyscholar import release_parked, resolve_clusters, run_worker
+from workqueue import ScholarWorkQueue
+
+from conftest import CITES_URL, SyntheticPages, make_options, make_querier
+from test_clusters import ChallengedPages
+
+
+def test_parked_work_is_kept_until_done(scratch):
+    attention = ScholarAttentionQueue('../parked.json')
+    entry = {'kind': 'cluster', 'cluster_id': '1'}
+    attention.park(entry, 'challenge page')
+    attention.park(entry, 'challenge page again')
+    assert len(attention) == 1
+    assert attention.release() == attention.entries
+    # Released, but not done yet: still parked, also on disk.
+    assert len(ScholarAttentionQueue('../parked.json')) == 1
+    attention.done(entry)
+    assert len(ScholarAttentionQueue('../parked.json')) == 0
+
+
+def test_release_parked_runs_the_parked_search(scratch):
+    attention = ScholarAttentionQueue('../parked.json')
+    attention.park({'kind': 'url', 'url': CITES_URL,
+                    'file_name': '../results/cites.json',
+                    'spec': {'count': 25}}, 'challenge page')
+    attention.park({'kind': 'query', 'file_name': '../res.json',
+                    'spec': {'author': 'albert einstein', 'count': 15}},
+                   'challenge page')
+    # As with --release-parked alone: no search in the options.
+    release_parked(make_options(), make_querier(SyntheticPages(total=100)),
+                   attention)
+    assert len(attention) == 0
+    with open('../results/cites.json') as res:
+        assert len(json.load(res)) == 25
+    with open('../res.json') as res:
+        assert len(json.load(res)) == 15
+
+
+def test_release_parked_keeps_work_that_fails_again(scratch):
+    attention = ScholarAttentionQueue('../parked.json')
+    attention.park({'kind': 'url', 'url': CITES_URL,
+                    'file_name': '../results/cites.json',
+                    'spec': {'count': 30}}, 'challenge page')
+    release_parked(make_options(),
+                   make_querier(SyntheticPages(total=100, broken=[10])),
+                   attention)
+    assert len(ScholarAttentionQueue('../parked.json')) == 1
+    release_parked(make_options(),
+                   make_querier(SyntheticPages(total=100), challenge_rate=1.0),
+                   attention)
+    assert len(ScholarAttentionQueue('../parked.json')) == 1
+
+
+def test_challenged_worker_counts_its_attempts(scratch):
+    queue = ScholarWorkQueue(str(scratch / 'queue.db'), max_attempts=3)
+    queue.add('url', {'url': CITES_URL})
+    querier = make_querier(SyntheticPages(), challenge_rate=1.0)
+    run_worker(make_options(count=20), querier, queue,
+               ScholarAttentionQueue('../parked.json'))
+    assert queue.stats()['failed'] == 1
+    assert querier.firefox.num_requests == 3
+
+
+def test_release_parked_resolves_parked_clusters(scratch):
+    attention = ScholarAttentionQueue('../parked.json')
+    attention.park({'kind': 'cluster', 'cluster_id': '7'}, 'challenge page')
+    options = make_options(cluster_output='../versions.jsonl')
+    release_parked(options, make_querier(SyntheticPages(total=3)), attention)
+    assert len(attention) == 0
+    with open('../versions.jsonl') as out:
+        assert json.loads(out.readline())['cluster_id'] == '7'
+
+
+def test_released_clusters_go_to_the_files_they_were_parked_with(scratch):
+    attention = ScholarAttentionQueue('../parked.json')
+    options = make_options(cluster_output='../versions.jsonl',
+                           cluster_cache='../clusters.cache')
+    querier = make_querier(ChallengedPages(['7']))
+    resolve_clusters(options, [querier], attention, ['7'])
+    assert attention.entries[0]['output'] == '../versions.jsonl'
+    # Released by a run with the default options, writing to stdout.
+    release_parked(make_options(), querier, attention)
+    assert len(attention) == 0
+    for file_name in ('../versions.jsonl', '../clusters.cache'):
+        with open(file_name) as data_file:
+            assert json.loads(data_file.readline())['cluster_id'] == '7'
@@ -0,0 +1,67 @@
+import json
+import os
+
+from batch import ScholarBatch, read_specs
+
+from conftest import SyntheticPages, make_querier
+
+
+def write_batch(tmp_path, lines):
+    batch_file = str(tmp_path / 'batch.jsonl')
+    with open(batch_file, 'w') as data_file:
+        data_file.write('\n'.join(lines) + '\n')
+    return batch_file
+
+
+def run_batch(tmp_path, pages, lines):
+    batch_file = write_batch(tmp_path, lines)
+    out_dir = str(tmp_path / 'out')
+    batch = ScholarBatch(make_querier(pages), out_dir, batch_file)
+    batch.run(read_specs(batch_file))
+    return batch, out_dir
+
+
+def test_writes_one_file_per_spec(tmp_path):
+    pages = SyntheticPages(total=15)
+    batch, out_dir = run_batch(tmp_path, pages, [
+        '# comment', '{"id": "a", "allw": "entanglement", "count": 15}', '',
+        '{"allw": "decoherence", "count": 5}'])
+    assert batch.stats['done'] == 2
+    with open(os.path.join(out_dir, 'a.json')) as data_file:
+        res = json.load(data_file)
+    assert res['line'] == 2 and len(res['articles']) == 15
+    assert os.path.exists(os.path.join(out_dir, 'query-00004.json'))
+
+
+def test_bad_lines_fail_alone(tmp_path):
+    batch, out_dir = run_batch(tmp_path, SyntheticPages(), [
+        '{"id": "broken", ', '["not", "an", "object"]', '42',
+        '{"id": "good", "allw": "entanglement", "count": 5}'])
+    assert batch.stats['failed'] == 3
+    assert batch.stats['done'] == 1
+    assert os.listdir(out_dir) == ['good.json']
+
+
+def test_failed_fetch_writes_no_output(tmp_path):
+    pages = SyntheticPages(total=30, broken=[10])
+    lines = ['{"id": "a", "allw": "entanglement", "count": 30}']
+    batch, out_dir = run_batch(tmp_path, pages, lines)
+    assert batch.stats['failed'] == 1
+    assert os.listdir(out_dir) == []
+    # Run again once the page can be fetched.
+    pages.broken.clear()
+    batch, out_dir = run_batch(tmp_path, pages, lines)
+    assert batch.stats['done'] == 1
+    with open(os.path.join(out_dir, 'a.json')) as data_file:
+        assert len(json.load(data_file)['articles']) == 30
+
+
+def test_ids_stay_inside_output_dir(tmp_path):
+    batch, out_dir = run_batch(tmp_path, SyntheticPages(), [
+        '{"id": "../../escape", "allw": "a", "count": 1}',
+        '{"id": "sub/dir name", "allw": "b", "count": 1}',
+        '{"id": "..", "allw": "c", "count": 1}'])
+    assert batch.stats['done'] == 3
+    assert sorted(os.listdir(out_dir)) == [
+        '_.._escape.json', 'query-00003.json', 'sub_dir_name.json']
+    assert not os.path.exists(str(tmp_path / 'escape.json'))
@@ -0,0 +1,21 @@
+from benchmark import compare, synthetic_articles, synthetic_page
+from parser import ScholarArticleParser120726
+
+
+def test_synthetic_page_parses_to_its_articles():
+    parser = ScholarArticleParser120726()
+    articles = []
+    parser.handle_article = articles.append
+    parser.parse(synthetic_page(10, start=20, total=95))
+    assert len(articles) == 10
+    assert articles[0]['title'] == 'On the theory of things, part 20'
+    assert len(synthetic_articles(150)) == 150
+
+
+def test_compare_flags_slowdowns_beyond_tolerance():
+    baseline = {'fast': {'rate': 100.0, 'unit': 'pages/s'},
+                'slow': {'rate': 100.0, 'unit': 'pages/s'}}
+    results = {'fast': {'rate': 90.0, 'unit': 'pages/s'},
+               'slow': {'rate': 70.0, 'unit': 'pages/s'},
+               'new': {'rate': 1.0, 'unit': 'pages/s'}}
+    assert compare(results, baseline, 0.25) == ['slow']
@@ -0,0 +1,96 @@
+import io
+import json
+
+from attention import ScholarAttentionQueue
+from clusters import ScholarClusterResolver
+from pyscholar import make_querier as make_cli_querier, open_replay
+from replay import CHALLENGE_HTML, ScholarRecording
+
+from conftest import SyntheticPages, make_options, make_querier
+
+
+class ClusterPages(SyntheticPages):
+
+    """Versions for any cluster but those in broken or missing."""
+
+    def __init__(self, total=3, broken=(), missing=()):
+        SyntheticPages.__init__(self, total=total)
+        self.broken_clusters = set(broken)
+        self.missing = set(missing)
+
+    def get(self, key):
+        for cluster in self.broken_clusters:
+            if 'cluster=%s' % cluster in key:
+                raise IOError('connection reset')
+        for cluster in self.missing:
+            if 'cluster=%s' % cluster in key:
+                return None
+        return SyntheticPages.get(self, key)
+
+
+def resolve(pages, ids, cache_file=None, workers=2):
+    queriers = [make_querier(pages) for _ in range(workers)]
+    resolver = ScholarClusterResolver(queriers, cache_file=cache_file)
+    out = io.StringIO()
+    resolver.resolve(ids, out)
+    resolver.close()
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    return resolver.stats, dict((rec['cluster_id'], rec['versions'])
+                                for rec in lines)
+
+
+def test_resolves_each_cluster_once(scratch):
+    stats, res = resolve(ClusterPages(), ['1', '2', '1', 'x'])
+    assert sorted(res) == ['1', '2']
+    assert len(res['1']) == 3
+    assert stats['resolved'] == 2 and stats['duplicates'] == 1
+
+
+def test_failed_clusters_are_not_written(scratch):
+    cache = str(scratch / 'cache.jsonl')
+    pages = ClusterPages(broken=['2'], missing=['3'])
+    stats, res = resolve(pages, ['1', '2', '3'], cache_file=cache)
+    assert sorted(res) == ['1']
+    assert stats['failed'] == 2 and stats['resolved'] == 1
+    # A rerun answers 1 from the cache and tries the others again.
+    stats, res = resolve(ClusterPages(), ['1', '2', '3'], cache_file=cache)
+    assert stats['cached'] == 1 and stats['resolved'] == 2
+    assert sorted(res) == ['1', '2', '3']
+
+
+def test_worker_queriers_share_one_replay(scratch):
+    file_name = str(scratch / 'rec.jsonl.gz')
+    ScholarRecording(file_name).close()
+    options = make_options(replay=file_name)
+    replay = open_replay(file_name)
+    queriers = [make_cli_querier(options, None, replay=replay)
+                for _ in range(3)]
+    assert all(querier.firefox.pages is replay for querier in queriers)
+
+
+class ChallengedPages(ClusterPages):
+
+    """Challenge pages for the clusters in challenged, once each."""
+
+    def __init__(self, challenged):
+        ClusterPages.__init__(self)
+        self.challenged = set(challenged)
+
+    def get(self, key):
+        for cluster in list(self.challenged):
+            if 'cluster=%s' % cluster in key:
+                self.challenged.discard(cluster)
+                return CHALLENGE_HTML
+        return ClusterPages.get(self, key)
+
+
+def test_resolved_clusters_reset_the_back_off(scratch):
+    attention = ScholarAttentionQueue(str(scratch / 'parked.json'))
+    pages = ChallengedPages(['1', '2'])
+    resolver = ScholarClusterResolver([make_querier(pages)],
+                                      attention=attention)
+    resolver.resolve(['1', '2'], io.StringIO())
+    assert attention.consecutive == 2
+    resolver.resolve(['3'], io.StringIO())
+    assert attention.consecutive == 0
+    assert resolver.stats['parked'] == 2 and resolver.stats['resolved'] == 1
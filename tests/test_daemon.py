@@ -0,0 +1,64 @@
+import json
+import threading
+
+import pytest
+
+from daemon import ScholarDaemon
+
+from conftest import SyntheticPages, make_querier
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+except ImportError:  # Python 2
+    from urllib2 import HTTPError, Request, urlopen
+
+
+@pytest.fixture
+def pages():
+    return SyntheticPages(total=25)
+
+
+@pytest.fixture
+def daemon(pages):
+    daemon = ScholarDaemon([make_querier(pages)], port=0, queue_timeout=1)
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    yield daemon
+    daemon.shutdown()
+    thread.join()
+    daemon.close()
+
+
+def post(daemon, spec):
+    data = spec if isinstance(spec, bytes) else json.dumps(spec).encode('utf-8')
+    resp = urlopen(Request(daemon.url + '/query', data=data), timeout=10)
+    return [json.loads(line.decode('utf-8')) for line in resp]
+
+
+def test_query_streams_articles(daemon):
+    arts = post(daemon, {'allw': 'entanglement', 'count': 25})
+    assert len(arts) == 25
+    assert arts[0]['title'].startswith('On the theory of things')
+    stats = json.loads(urlopen(daemon.url + '/stats', timeout=10).read()
+                       .decode('utf-8'))
+    assert stats['queries'] == 1 and stats['articles'] == 25
+    assert stats['idle'] == 1
+
+
+def test_bad_specs_are_rejected(daemon):
+    for body in (b'{"allw": ', b'[1, 2]', b'{"count": 5}'):
+        with pytest.raises(HTTPError) as err:
+            post(daemon, body)
+        assert err.value.code == 400
+
+
+def test_fetch_error_ends_the_stream(daemon, pages):
+    pages.broken.add(10)
+    lines = post(daemon, {'allw': 'entanglement', 'count': 25})
+    assert len(lines) == 11
+    assert lines[-1]['error'].startswith('could not fetch')
+    assert daemon.report()['fetch_errors'] == 1
+    # The querier is back in the pool.
+    pages.broken.clear()
+    assert len(post(daemon, {'allw': 'entanglement', 'count': 5})) == 5
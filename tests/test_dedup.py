@@ -0,0 +1,68 @@
+from dedup import (ScholarDedupIndex, normalize_authors, normalize_title,
+                   record_key)
+
+PREPRINT = {'title': 'On the Electrodynamics of Moving Bodies',
+            'authors': 'A Einstein - arXiv preprint', 'year': '1905',
+            'cluster_id': '1'}
+JOURNAL = {'title': '[PDF] On the electrodynamics of moving bodies.',
+           'authors': 'A Einstein - Annalen der Physik', 'year': 1905,
+           'cluster_id': '2'}
+OTHER = {'title': 'Can quantum-mechanical description of physical reality '
+                  'be considered complete?',
+         'authors': 'A Einstein, B Podolsky, N Rosen - Physical Review',
+         'year': 1935, 'cluster_id': '3'}
+
+
+def test_normalization():
+    assert normalize_title(u'[PDF] Caf\xe9: The Book!') == u'cafe the book'
+    assert normalize_authors('A Einstein, B Podolsky - Physical Review') \
+        == ['einstein', 'podolsky']
+
+
+def test_merges_versions_of_the_same_paper():
+    index = ScholarDedupIndex()
+    assert index.add('a', PREPRINT) == []
+    assert index.add('b', JOURNAL) == ['a']
+    assert index.add('c', OTHER) == []
+    assert index.groups() == [['a', 'b']]
+
+
+def add_file(index, file_name, records):
+    for idx, record in enumerate(records):
+        index.add(record_key(record), record, source=(file_name, idx))
+
+
+def test_adding_a_file_again_keeps_its_groups(scratch):
+    index = ScholarDedupIndex()
+    records = [PREPRINT, OTHER, JOURNAL]
+    add_file(index, 'res.json', records)
+    groups = index.groups()
+    # An incremental rerun adds every record of the file again.
+    for idx, record in enumerate(records):
+        assert index.add(record_key(record), record, ('res.json', idx)) == []
+    assert index.groups() == groups == [['cluster:1', 'cluster:2']]
+    assert all(len(bucket) == len(set(bucket))
+               for buckets in index.buckets for bucket in buckets.values())
+
+    file_name = str(scratch / 'dedup.idx')
+    index.save(file_name)
+    assert ScholarDedupIndex.load(file_name).groups() == groups
+
+
+def test_rewritten_file_gets_its_new_records_indexed():
+    index = ScholarDedupIndex()
+    add_file(index, 'res.json', [OTHER, PREPRINT])
+    # A new crawl rewrote res.json from the start.
+    add_file(index, 'res.json', [JOURNAL, OTHER])
+    assert len(index) == 3
+    assert index.groups() == [['cluster:1', 'cluster:2']]
+    assert index.meta['cluster:2']['source'] == ['res.json', 0]
+    assert index.meta['cluster:3']['source'] == ['res.json', 1]
+
+
+def test_records_without_cluster_id_are_keyed_by_content():
+    untitled = dict(OTHER, cluster_id=None)
+    assert record_key(untitled) == record_key(dict(untitled, title=
+        'Can quantum mechanical description of physical reality be '
+        'considered complete'))
+    assert record_key(untitled) != record_key(dict(untitled, year=1936))
@@ -0,0 +1,63 @@
+import pytest
+from bs4 import BeautifulSoup
+
+from excepts import ChallengeError
+from query import ScholarQuerier, SearchScholarQuery
+from replay import ReplayDriver
+from utils import ScholarConf
+
+from conftest import CITES_URL, SyntheticPages, make_querier
+
+
+class ScriptDriver(ReplayDriver):
+
+    """
+    A ReplayDriver running the result extraction script, by doing what
+    it does with BeautifulSoup.
+    """
+
+    def __init__(self, pages, **kwargs):
+        ReplayDriver.__init__(self, pages, **kwargs)
+        self.scripts = 0
+
+    def execute_script(self, script):
+        assert script == ScholarQuerier.EXTRACT_SCRIPT
+        self.scripts += 1
+        soup = BeautifulSoup(self.page_source, 'html.parser')
+        md = soup.find(id='gs_ab_md')
+        divs = [div for div in soup.select('div.gs_r')
+                if div.find_parent('div', class_='gs_r') is None]
+        if md is None and not divs:
+            return None
+        return u''.join([str(md) if md else u''] + [str(div) for div in divs])
+
+
+def fetch(querier, limit=25):
+    query = SearchScholarQuery()
+    query.set_url(CITES_URL)
+    arts = [art.as_dict() for art in querier.iter_results(query, limit=limit)]
+    return query, arts
+
+
+def test_extracted_results_parse_like_whole_pages(monkeypatch):
+    _, whole = fetch(make_querier(SyntheticPages()))
+    monkeypatch.setattr(ScholarConf, 'EXTRACT_RESULTS', True)
+    driver = ScriptDriver(SyntheticPages())
+    query, extracted = fetch(ScholarQuerier(driver=driver))
+    assert driver.scripts == 3
+    assert extracted == whole
+    assert query['num_results'] == 50
+
+
+def test_challenge_pages_are_read_whole(monkeypatch):
+    monkeypatch.setattr(ScholarConf, 'EXTRACT_RESULTS', True)
+    driver = ScriptDriver(SyntheticPages(), challenge_rate=1.0)
+    with pytest.raises(ChallengeError):
+        fetch(ScholarQuerier(driver=driver))
+    assert driver.scripts >= 1
+
+
+def test_drivers_without_scripts_give_whole_pages(monkeypatch):
+    monkeypatch.setattr(ScholarConf, 'EXTRACT_RESULTS', True)
+    _, arts = fetch(make_querier(SyntheticPages()), limit=10)
+    assert len(arts) == 10
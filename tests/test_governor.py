@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from governor import ScholarRateGovernor
+
+
+def test_burst_then_waits_for_tokens(tmp_path):
+    governor = ScholarRateGovernor(str(tmp_path / 'rate.json'), 50.0,
+                                   job='a', burst=0.1)
+    waits = [governor.acquire() for _ in range(6)]
+    assert waits[0] < 0.05
+    assert sum(waits) >= 0.08
+    assert governor.report()['requests'] == 6
+
+
+def test_active_jobs_share_the_rate_by_weight(tmp_path):
+    file_name = str(tmp_path / 'rate.json')
+    light = ScholarRateGovernor(file_name, 10.0, weight=1.0, job='light')
+    heavy = ScholarRateGovernor(file_name, 10.0, weight=3.0, job='heavy')
+    light.acquire()
+    heavy.acquire()
+    with open(file_name) as state_file:
+        jobs = json.load(state_file)
+    assert sorted(jobs) == ['heavy', 'light']
+    # Both used their token; the next ones come at their shares of the
+    # rate, 2.5 and 7.5 per second.
+    assert light._take() == pytest.approx(0.4, abs=0.02)
+    assert heavy._take() == pytest.approx(1 / 7.5, abs=0.02)
+
+
+def test_stale_jobs_are_dropped(tmp_path):
+    file_name = str(tmp_path / 'rate.json')
+    with open(file_name, 'w') as state_file:
+        json.dump({'gone': {'tokens': 0.0, 'last': 0.0, 'weight': 100.0,
+                            'seen': 0.0}}, state_file)
+    governor = ScholarRateGovernor(file_name, 10.0, job='a')
+    assert governor.acquire() < 0.05
+    with open(file_name) as state_file:
+        assert list(json.load(state_file)) == ['a']
+
+
+def test_corrupt_state_is_reset(tmp_path):
+    file_name = str(tmp_path / 'rate.json')
+    with open(file_name, 'w') as state_file:
+        state_file.write('{"a": ')
+    governor = ScholarRateGovernor(file_name, 10.0, job='a')
+    assert governor.acquire() < 0.05
+    with open(file_name) as state_file:
+        assert list(json.load(state_file)) == ['a']
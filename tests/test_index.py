@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+import index
+from index import ScholarIndex, decode_postings, encode_postings
+
+RECORDS = [
+    {'cluster_id': '1', 'title': 'Quantum theory of measurement',
+     'authors': 'A Einstein - Physical Review', 'excerpt': 'reality'},
+    {'cluster_id': '2', 'title': 'Theory of relativity',
+     'authors': 'A Einstein - Annalen der Physik', 'excerpt': 'quantum'},
+    {'cluster_id': '3', 'title': 'Atomic structure',
+     'authors': 'N Bohr - Nature', 'excerpt': 'quantum theory of atoms'},
+]
+
+
+def titles(idx, query):
+    return sorted(doc['title'] for _, doc in idx.search(query))
+
+
+def make_index(directory, records=RECORDS):
+    idx = ScholarIndex(directory)
+    for record in records:
+        idx.add(record)
+    idx.flush()
+    return idx
+
+
+def test_postings_round_trip():
+    postings = [(0, [1, 5, 1000]), (7, [2]), (300, [0, 70000])]
+    assert decode_postings(encode_postings(postings)) == postings
+
+
+def test_search(tmp_path):
+    idx = make_index(str(tmp_path / 'index'))
+    assert titles(idx, 'einstein') == ['Quantum theory of measurement',
+                                       'Theory of relativity']
+    assert titles(idx, '"quantum theory"') == ['Atomic structure',
+                                               'Quantum theory of measurement']
+    assert titles(idx, 'quantum -relativity -bohr') == [
+        'Quantum theory of measurement']
+    assert titles(idx, 'relativity OR atomic') == ['Atomic structure',
+                                                   'Theory of relativity']
+    assert not idx.add(RECORDS[0])
+
+
+def test_compact_replaces_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(index, 'MAX_SEGMENTS', 2)
+    directory = str(tmp_path / 'index')
+    idx = ScholarIndex(directory)
+    for record in RECORDS:
+        idx.add(record)
+        idx.flush()
+    assert sorted(os.listdir(directory)) == [
+        'docs.jsonl', 'docs.off', 'seg-00003.post', 'seg-00003.terms',
+        'segments.json']
+    idx = ScholarIndex(directory)
+    assert titles(idx, 'quantum') == [r['title'] for r in
+                                      sorted(RECORDS, key=lambda r: r['title'])]
+
+
+def test_interrupted_flush_leaves_index_as_it_was(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'index')
+    make_index(directory, RECORDS[:2])
+    sizes = [os.path.getsize(os.path.join(directory, name))
+             for name in ('docs.jsonl', 'docs.off')]
+
+    def fail(*args):
+        raise IOError('disk full')
+    monkeypatch.setattr(ScholarIndex, '_write_manifest', fail)
+    idx = ScholarIndex(directory)
+    idx.add(RECORDS[2])
+    with pytest.raises(IOError):
+        idx.flush()
+    monkeypatch.undo()
+
+    idx = ScholarIndex(directory)
+    assert len(idx) == 2
+    assert [os.path.getsize(os.path.join(directory, name))
+            for name in ('docs.jsonl', 'docs.off')] == sizes
+    assert titles(idx, 'bohr') == []
+    assert idx.add(RECORDS[2])
+    idx.flush()
+    assert titles(ScholarIndex(directory), 'bohr') == ['Atomic structure']
+
+
+def test_failed_segment_write_adds_no_docs(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'index')
+    make_index(directory, RECORDS[:2])
+    size = os.path.getsize(os.path.join(directory, 'docs.jsonl'))
+
+    def fail(*args):
+        raise IOError('disk full')
+    monkeypatch.setattr(ScholarIndex, '_write_segment', fail)
+    idx = ScholarIndex(directory)
+    idx.add(RECORDS[2])
+    with pytest.raises(IOError):
+        idx.flush()
+    assert os.path.getsize(os.path.join(directory, 'docs.jsonl')) == size
+
+
+def test_interrupted_compact_keeps_old_segments(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'index')
+    idx = ScholarIndex(directory)
+    for record in RECORDS:
+        idx.add(record)
+        idx.flush()
+
+    def fail(*args):
+        raise IOError('disk full')
+    monkeypatch.setattr(ScholarIndex, '_write_manifest', fail)
+    with pytest.raises(IOError):
+        idx.compact()
+    monkeypatch.undo()
+    assert titles(ScholarIndex(directory), 'einstein') == [
+        'Quantum theory of measurement', 'Theory of relativity']
@@ -0,0 +1,45 @@
+import pytest
+
+from excepts import FetchError
+from query import SearchScholarQuery
+
+from conftest import CITES_URL, SyntheticPages, make_querier
+
+
+def make_query():
+    query = SearchScholarQuery()
+    query.set_url(CITES_URL)
+    return query
+
+
+def test_yields_up_to_limit():
+    pages = SyntheticPages(total=100)
+    arts = list(make_querier(pages).iter_results(make_query(), limit=25))
+    assert len(arts) == 25
+    assert pages.fetched == [0, 10, 20]
+
+
+def test_stops_at_reported_number_of_results():
+    pages = SyntheticPages(total=23)
+    arts = list(make_querier(pages).iter_results(make_query()))
+    assert len(arts) == 23
+    assert pages.fetched == [0, 10, 20]
+
+
+def test_fetches_pages_as_articles_are_consumed():
+    pages = SyntheticPages(total=100)
+    results = make_querier(pages).iter_results(make_query())
+    for _ in range(10):
+        next(results)
+    assert pages.fetched == [0]
+    next(results)
+    assert pages.fetched == [0, 10]
+    results.close()
+
+
+def test_failed_fetch_raises_instead_of_ending_results():
+    pages = SyntheticPages(total=100, broken=[20])
+    results = make_querier(pages).iter_results(make_query())
+    with pytest.raises(FetchError):
+        for _ in results:
+            pass
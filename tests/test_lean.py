@@ -0,0 +1,61 @@
+import pytest
+from selenium.webdriver import FirefoxProfile
+
+import query
+from excepts import ChallengeError
+from query import ScholarQuerier, SearchScholarQuery
+from replay import ReplayDriver
+from utils import ScholarConf
+
+from conftest import CITES_URL, SyntheticPages
+
+
+class RecordingProfile(FirefoxProfile):
+
+    def __init__(self):
+        FirefoxProfile.__init__(self)
+        self.prefs = {}
+
+    def set_preference(self, key, val):
+        self.prefs[key] = val
+        FirefoxProfile.set_preference(self, key, val)
+
+
+@pytest.fixture
+def browsers(monkeypatch):
+    """The browsers started, as ReplayDrivers, with the options given."""
+    started = []
+    pages = SyntheticPages()
+
+    def firefox(options=None):
+        driver = ReplayDriver(pages, challenge_rate=1.0 if not started else 0)
+        driver.options = options
+        driver.set_page_load_timeout = lambda secs: None
+        started.append(driver)
+        return driver
+    monkeypatch.setattr(query.webdriver, 'Firefox', firefox)
+    monkeypatch.setattr(query, 'FirefoxProfile', RecordingProfile)
+    monkeypatch.setattr(ScholarConf, 'LEAN_BROWSER', True)
+    return started
+
+
+def test_lean_browser_is_headless_with_lean_prefs(browsers):
+    querier = ScholarQuerier()
+    options = browsers[0].options
+    assert '-headless' in options.arguments
+    assert options.profile.prefs == ScholarQuerier.LEAN_PREFS
+    assert options.profile.prefs['permissions.default.image'] == 2
+    assert querier.headless
+
+
+def test_challenge_brings_up_a_visible_browser(browsers):
+    querier = ScholarQuerier()
+    search = SearchScholarQuery()
+    search.set_url(CITES_URL)
+    with pytest.raises(ChallengeError):
+        list(querier.iter_results(search))
+    assert len(browsers) == 2
+    assert '-headless' not in browsers[1].options.arguments
+    assert browsers[1].options.profile.prefs == ScholarQuerier.LEAN_PREFS
+    assert not querier.headless
+    assert querier.firefox is browsers[1]
@@ -0,0 +1,62 @@
+import json
+import os
+
+import membudget
+from membudget import ScholarMemoryBudget, ScholarResultBuffer
+
+
+def records(start, num):
+    return [{'title': u'paper %d é' % idx} for idx in range(start,
+                                                            start + num)]
+
+
+def load(file_name):
+    with open(file_name) as data_file:
+        return json.load(data_file)
+
+
+def test_spills_append_to_the_results_file(tmp_path):
+    (tmp_path / 'out').mkdir()
+    file_name = str(tmp_path / 'out' / 'res.json')
+    buf = ScholarResultBuffer(ScholarMemoryBudget(max_records=5))
+    assert buf.add(records(0, 3), file_name)
+    buf.write(file_name)
+    assert load(file_name) == records(0, 3)
+    assert not buf.add(records(3, 3), file_name)
+    assert buf.records == [] and len(buf) == 6
+    assert load(file_name) == records(0, 6)
+    buf.add(records(6, 3), file_name)
+    # Not spilled yet, but what was is still there.
+    assert load(file_name) == records(0, 6)
+    buf.add(records(9, 3), file_name)
+    assert load(file_name) == records(0, 12)
+    buf.add(records(12, 2), file_name)
+    buf.finish()
+    assert load(file_name) == records(0, 14)
+    assert os.listdir(str(tmp_path / 'out')) == ['res.json']
+    assert buf.budget.report()['spills'] == 3
+    assert len(buf) == 0 and buf.file_name is None
+
+
+def test_rss_spills_only_after_growth(monkeypatch):
+    rss = [150.0]
+    monkeypatch.setattr(membudget, 'rss_mb', lambda: rss[0])
+    budget = ScholarMemoryBudget(max_rss=100.0)
+    assert budget.exceeded(1)
+    assert not budget.exceeded(2)
+    rss[0] = 154.0
+    assert not budget.exceeded(3)
+    rss[0] = 155.5
+    assert budget.exceeded(4)
+    assert budget.report()['peak_rss_mb'] == 155.5
+
+
+def test_under_budget_nothing_spills(tmp_path, monkeypatch):
+    monkeypatch.setattr(membudget, 'rss_mb', lambda: 50.0)
+    file_name = str(tmp_path / 'res.json')
+    buf = ScholarResultBuffer(ScholarMemoryBudget(max_rss=100.0))
+    for start in range(0, 30, 10):
+        assert buf.add(records(start, 10), file_name)
+    buf.write()
+    assert load(file_name) == records(0, 30)
+    assert buf.budget.report()['spills'] == 0
@@ -0,0 +1,44 @@
+import benchmark
+from benchmark import synthetic_page
+from page import ScholarPage
+from parser import ScholarArticleParser120726
+from utils import ScholarConf
+
+
+def parse(html):
+    parser = ScholarArticleParser120726()
+    articles = [art.as_dict() for art in parser.iter_articles(html)]
+    parser.release()
+    return articles
+
+
+def test_page_text_and_bytes_parse_alike():
+    source = synthetic_page(5).replace('things', u'th\xefngs')
+    as_page = parse(ScholarPage(source))
+    assert as_page[0]['title'].startswith(u'On the theory of th\xefngs')
+    assert parse(source.encode('utf-8')) == as_page
+    assert parse(source) == as_page
+
+
+def test_lxml_is_the_default_builder_when_installed():
+    try:
+        import lxml
+    except ImportError:
+        assert ScholarConf.HTML_PARSER is None
+    else:
+        assert ScholarConf.HTML_PARSER == 'lxml'
+
+
+def test_contains_any():
+    page = ScholarPage(u'<p>Please show you\'re not a robot</p>', url='u')
+    assert page.contains_any([u'nothing', u'not a robot'])
+    assert not page.contains_any([u'nothing'])
+    assert len(page) == 37
+
+
+def test_bench_page_names_the_builders(monkeypatch):
+    monkeypatch.setattr(benchmark, 'best_time', lambda func, number: 0.5)
+    results = {}
+    benchmark.bench_page(results, size=3)
+    assert results['page/bytes']['rate'] == 2.0
+    assert results['page/page']['unit'].startswith('pages/s (')
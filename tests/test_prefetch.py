@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from excepts import FetchError
+from prefetch import ScholarPagePrefetcher
+from pyscholar import loop
+from query import SearchScholarQuery
+
+from conftest import CITES_URL, SyntheticPages, make_options, make_querier
+
+
+def make_query():
+    query = SearchScholarQuery()
+    query.set_url(CITES_URL)
+    return query
+
+
+def test_prefetched_loop_writes_all_pages(scratch):
+    pages = SyntheticPages(total=45)
+    loop(make_options(count=100, prefetch=2), make_query(),
+         make_querier(pages), file_name='../res.json')
+    assert sorted(pages.fetched) == [0, 10, 20, 30, 40]
+    with open('../res.json') as res:
+        assert len(json.load(res)) == 45
+
+
+def test_fetch_errors_reach_the_consumer():
+    pages = SyntheticPages(total=100, broken=[10])
+    querier = make_querier(pages)
+    query = make_query()
+    prefetcher = ScholarPagePrefetcher(querier, query, 0, 50, depth=2)
+    got = []
+    with pytest.raises(FetchError):
+        for html in prefetcher:
+            querier.parse_response(query, html)
+            got.append(len(querier.articles))
+    prefetcher.cancel()
+    assert got == [10]
+
+
+def test_cancel_stops_fetching():
+    pages = SyntheticPages(total=1000)
+    querier = make_querier(pages)
+    prefetcher = ScholarPagePrefetcher(querier, make_query(), 0, 1000,
+                                       depth=1)
+    next(iter(prefetcher))
+    prefetcher.cancel()
+    assert len(pages.fetched) <= 3
@@ -0,0 +1,59 @@
+import shutil
+
+from query import ScholarQuerier
+from replay import (CHALLENGE_HTML, EMPTY_HTML, HttpDriver, ReplayDriver,
+                    ScholarMockServer, ScholarRecording, page_key)
+
+from conftest import CITES_URL
+
+
+def test_recording_round_trip(scratch):
+    file_name = str(scratch / 'rec.jsonl.gz')
+    recording = ScholarRecording(file_name)
+    recording.add(CITES_URL, u'<html>caf\xe9</html>')
+    recording.close()
+    replayed = ScholarRecording(file_name)
+    assert len(replayed) == 1
+    assert replayed.get('http://elsewhere.org/scholar?cites=4412725301034017472') \
+        == u'<html>caf\xe9</html>'
+
+
+def test_aborted_recording_is_usable_and_extended(scratch):
+    file_name = str(scratch / 'rec.jsonl.gz')
+    aborted = str(scratch / 'aborted.jsonl.gz')
+    recording = ScholarRecording(file_name)
+    for num in range(3):
+        recording.add('http://scholar.google.com/p%d' % num, 'page %d' % num)
+    # What a killed run leaves: flushed, but without the end of stream.
+    shutil.copy(file_name, aborted)
+    recording.close()
+
+    resumed = ScholarRecording(aborted)
+    assert len(resumed) == 3
+    resumed.add('http://scholar.google.com/p3', 'page 3')
+    resumed.close()
+    replayed = ScholarRecording(aborted)
+    assert sorted(replayed.pages) == ['/p0', '/p1', '/p2', '/p3']
+
+
+def test_replay_driver_serves_pages_and_challenges():
+    driver = ReplayDriver({'/known': '<html>known</html>'})
+    driver.get('http://scholar.google.com/known')
+    assert driver.page_source == '<html>known</html>'
+    driver.get('http://scholar.google.com/unknown')
+    assert driver.page_source == EMPTY_HTML
+    driver = ReplayDriver({}, challenge_rate=1.0)
+    driver.get('http://scholar.google.com/known')
+    assert driver.page_source == CHALLENGE_HTML
+
+
+def test_mock_server_serves_querier():
+    server = ScholarMockServer({page_key(CITES_URL): '<html>cites</html>'})
+    server.start()
+    try:
+        querier = ScholarQuerier(driver=HttpDriver(server.url))
+        page = querier._get_http_response(CITES_URL)
+        assert page.text == '<html>cites</html>'
+        assert server.num_requests == 1
+    finally:
+        server.stop()
@@ -0,0 +1,67 @@
+import errno
+import socket
+
+import pytest
+from urllib3.exceptions import (MaxRetryError, NewConnectionError,
+                                ProtocolError, ReadTimeoutError)
+
+from excepts import ChallengeError
+from retry import ScholarCircuitBreaker, ScholarRetryPolicy
+
+from conftest import CITES_URL, SyntheticPages, make_querier
+
+
+def test_errors_are_classified():
+    assert ScholarRetryPolicy.classify(IOError('reset')) == 'transient'
+    assert ScholarRetryPolicy.classify(KeyError('bug')) == 'fatal'
+    policy = ScholarRetryPolicy(max_attempts=3, base_delay=1, jitter=0)
+    assert policy.should_retry('transient', 2)
+    assert not policy.should_retry('transient', 3)
+    assert not policy.should_retry('fatal', 1)
+    assert [policy.delay(num) for num in (1, 2, 3)] == [1, 2, 4]
+
+
+@pytest.mark.parametrize('err, kind', [
+    (MaxRetryError(None, '/session', 'refused'), 'driver'),
+    (NewConnectionError(None, 'refused'), 'driver'),
+    (ProtocolError('Connection aborted.'), 'driver'),
+    (ReadTimeoutError(None, '/session', 'read timed out'), 'timeout'),
+    (ConnectionResetError(errno.ECONNRESET, 'reset'), 'driver'),
+    (ConnectionError('driver went away'), 'driver'),
+    (socket.error(errno.EHOSTUNREACH, 'unreachable'), 'transient'),
+])
+def test_driver_connection_errors_are_classified(err, kind):
+    assert ScholarRetryPolicy.classify(err) == kind
+
+
+def test_breaker_opens_and_closes_after_trial():
+    breaker = ScholarCircuitBreaker(window=4, threshold=0.5, min_requests=4,
+                                    cooldown=0)
+    for success in (True, False, True, False):
+        breaker.record(success)
+    assert breaker.state == breaker.OPEN
+    breaker.before_request()
+    assert breaker.state == breaker.HALF_OPEN
+    breaker.record(True)
+    assert breaker.state == breaker.CLOSED
+
+
+def test_challenge_during_trial_reopens_breaker():
+    breaker = ScholarCircuitBreaker(cooldown=0)
+    breaker._open()
+    querier = make_querier(SyntheticPages(), challenge_rate=1.0)
+    querier.retry_policy = ScholarRetryPolicy(breaker=breaker)
+    with pytest.raises(ChallengeError):
+        querier._get_http_response(CITES_URL)
+    assert breaker.state == breaker.OPEN
+    assert querier.retry_policy.stats['challenges'] == 1
+
+
+def test_failing_recorder_does_not_fail_the_fetch():
+    class BrokenStore(object):
+        def add(self, url, html):
+            raise IOError('disk full')
+
+    querier = make_querier(SyntheticPages())
+    querier.recorder = querier.archive = BrokenStore()
+    assert querier._get_http_response(CITES_URL) is not None
@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+import time
+
+from replay import ReplayDriver
+from session import ScholarSession
+from utils import ScholarConf, ScholarSettings
+
+from conftest import CITES_URL, SyntheticPages, make_querier
+
+
+class CookieDriver(ReplayDriver):
+
+    def __init__(self, pages, cookies=()):
+        ReplayDriver.__init__(self, pages)
+        self.cookies = list(cookies)
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        ReplayDriver.get(self, url)
+
+    def add_cookie(self, cookie):
+        self.cookies.append(cookie)
+
+    def get_cookies(self):
+        return list(self.cookies)
+
+
+class CountingGovernor(object):
+
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+        return 0.0
+
+
+def test_session_round_trip(scratch):
+    file_name = str(scratch / 'session.json')
+    settings = ScholarSettings()
+    settings.set_citation_format(ScholarSettings.CITFORM_BIBTEX)
+    live = {'name': 'GSP', 'value': 'CF=4', 'expiry': time.time() + 3600}
+    expired = {'name': 'old', 'value': '1', 'expiry': time.time() - 1}
+    ScholarSession(file_name).save(CookieDriver({}, [live, expired]),
+                                   settings)
+
+    session = ScholarSession(file_name)
+    assert session.has_settings(settings)
+    driver = CookieDriver({})
+    assert session.restore(driver)
+    assert driver.cookies == [live]
+    assert driver.urls == [ScholarConf.SCHOLAR_SITE + '/robots.txt']
+
+
+def test_restore_goes_through_the_querier(scratch):
+    file_name = str(scratch / 'session.json')
+    cookie = {'name': 'GSP', 'value': 'CF=4'}
+    ScholarSession(file_name).save(CookieDriver({}, [cookie]))
+    driver = CookieDriver(SyntheticPages())
+    querier = make_querier(SyntheticPages())
+    querier.firefox = driver
+    querier.session = ScholarSession(file_name)
+    querier._session_pending = True
+    # Set after the querier was made, as make_querier() does.
+    querier.governor = CountingGovernor()
+    assert querier._get_http_response(CITES_URL) is not None
+    assert driver.urls[0].endswith('/robots.txt')
+    assert querier.governor.acquired == 2
+    assert querier.retry_policy.stats['requests'] == 2
+    assert driver.cookies == [cookie]
+
+
+def test_concurrent_saves_do_not_collide(scratch):
+    file_name = str(scratch / 'session.json')
+    sessions = [ScholarSession(file_name) for _ in range(4)]
+    errors = []
+
+    def save(session, num):
+        for _ in range(20):
+            try:
+                session.save(CookieDriver({}, [{'name': 'n', 'value': num}]))
+            except Exception as err:
+                errors.append(err)
+
+    threads = [threading.Thread(target=save, args=(session, num))
+               for num, session in enumerate(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with open(file_name) as data_file:
+        assert len(json.load(data_file)['cookies']) == 1
+    assert os.listdir(str(scratch)).count('session.json') == 1
+    assert not [name for name in os.listdir(str(scratch))
+                if name.endswith('.tmp')]
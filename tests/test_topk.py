@@ -0,0 +1,74 @@
+import sys
+
+import pytest
+
+import pyscholar
+from benchmark import synthetic_page
+from query import SearchScholarQuery
+from topk import ScholarTopK
+
+from conftest import CITES_URL, SyntheticPages, make_querier
+
+
+def arts(*cites):
+    return [{'num_citations': num, 'title': 'cited %s' % num}
+            for num in cites]
+
+
+def pages(*pages):
+    for page in pages:
+        for art in page:
+            yield art
+        yield None
+
+
+def test_keeps_k_best_first_seen_wins_ties():
+    top = ScholarTopK(3).run(pages(arts(5, 9, 1), arts(9, 7, None)))
+    assert [art['num_citations'] for art in top.articles()] == [9, 9, 7]
+    assert top.articles()[0] is not top.articles()[1]
+    assert top.threshold() == 7
+    assert top.stats == {'seen': 6, 'pages': 2, 'stopped_early': False}
+
+
+def test_patience_counts_marked_pages():
+    results = pages(arts(9, 8), arts(7, 1, 1, 1), arts(1), arts(1, 1),
+                    arts(50))
+    top = ScholarTopK(2, patience=2).run(results)
+    assert top.stats['stopped_early']
+    assert top.stats['pages'] == 3
+    assert top.stats['seen'] == 7
+    assert [art['num_citations'] for art in top.articles()] == [9, 8]
+
+
+class ShortPages(SyntheticPages):
+
+    """Result pages with fewer articles than asked for, 7 instead of 10."""
+
+    def get(self, key):
+        html = SyntheticPages.get(self, key)
+        if html is None:
+            return None
+        start = self.fetched[-1]
+        return synthetic_page(7, start=start, total=self.total)
+
+
+def test_pages_are_counted_as_fetched():
+    source = ShortPages(total=50)
+    query = SearchScholarQuery()
+    query.set_url(CITES_URL)
+    top = ScholarTopK(3, patience=100)
+    top.run(make_querier(source).iter_results(query, page_ends=True))
+    assert top.stats['pages'] == len(source.fetched) == 5
+    assert top.stats['seen'] == 35
+
+
+@pytest.mark.parametrize('args', [['--top', '0'], ['--top', '-3'],
+                                  ['--top', '5', '--top-patience', '0']])
+def test_main_rejects_bad_top(monkeypatch, args):
+    monkeypatch.setattr(sys, 'argv', ['pyscholar.py', '-u', CITES_URL] + args)
+    assert pyscholar.main() == 1
+
+
+def test_k_must_be_positive():
+    with pytest.raises(ValueError):
+        ScholarTopK(0)
@@ -0,0 +1,71 @@
+import json
+import threading
+
+import pytest
+
+import tracing
+from query import SearchScholarQuery
+from tracing import ScholarTracer, set_tracer, span
+
+from conftest import CITES_URL, SyntheticPages, make_querier
+
+
+@pytest.fixture
+def tracer(tmp_path):
+    tracer = ScholarTracer(str(tmp_path / 'trace.json'))
+    set_tracer(tracer)
+    yield tracer
+    set_tracer(None)
+    tracer.close()
+
+
+def read_events(file_name):
+    with open(file_name) as trace_file:
+        text = trace_file.read()
+    if not text.rstrip().endswith(']'):
+        text += ']'
+    return json.loads(text)
+
+
+def test_events_are_on_disk_before_close(tracer):
+    query = SearchScholarQuery()
+    query.set_url(CITES_URL)
+    list(make_querier(SyntheticPages(total=20)).iter_results(query))
+    events = read_events(tracer.file_name)
+    names = [event['name'] for event in events]
+    assert names.count('navigate') == 2
+    assert names[0] == 'thread_name'
+    navigate = [event for event in events if event['name'] == 'navigate']
+    assert navigate[0]['args']['url'].startswith(CITES_URL)
+    assert all(event['dur'] >= 0 for event in events if event['ph'] == 'X')
+    assert navigate[0]['ts'] < navigate[1]['ts']
+    tracer.close()
+    with open(tracer.file_name) as trace_file:
+        assert json.load(trace_file) == events
+
+
+def test_spans_record_errors_and_threads(tracer):
+    with pytest.raises(ValueError):
+        with span('parse', page=1):
+            raise ValueError('bad page')
+
+    def work():
+        with span('fetch'):
+            pass
+    thread = threading.Thread(target=work, name='worker')
+    thread.start()
+    thread.join()
+    events = read_events(tracer.file_name)
+    assert events[1]['args'] == {'page': 1, 'error': 'ValueError: bad page'}
+    threads = [event['args']['name'] for event in events
+               if event['name'] == 'thread_name']
+    assert threads == [threading.current_thread().name, 'worker']
+    assert events[-1]['tid'] == 2
+
+
+def test_clock_is_monotonic(tracer, monkeypatch):
+    monkeypatch.setattr(tracing.time, 'time', lambda: 0.0)
+    with span('navigate'):
+        pass
+    event = read_events(tracer.file_name)[-1]
+    assert event['ts'] >= 0 and event['dur'] >= 0
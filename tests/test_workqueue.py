@@ -0,0 +1,73 @@
+import json
+
+from attention import ScholarAttentionQueue
+from pyscholar import run_worker
+from workqueue import ScholarTask, ScholarWorkQueue
+
+from conftest import CITES_URL, SyntheticPages, make_options, make_querier
+
+
+def make_queue(tmp_path, **kwargs):
+    return ScholarWorkQueue(str(tmp_path / 'queue.db'), **kwargs)
+
+
+def test_tasks_are_added_once_and_leased_to_one_worker(scratch):
+    queue = make_queue(scratch)
+    assert queue.add('url', {'url': 'a'})
+    assert not queue.add('url', {'url': 'a'})
+    assert queue.add('url', {'url': 'b'})
+    first = queue.claim('w1')
+    second = queue.claim('w2')
+    assert (first.payload['url'], second.payload['url']) == ('a', 'b')
+    assert queue.claim('w3') is None
+    # Only the lease owner may complete a task.
+    assert not queue.complete(ScholarTask(first.id, first.kind, first.payload,
+                                          first.attempts, 'w2'))
+    assert queue.complete(first)
+    assert queue.stats() == {'pending': 0, 'leased': 1, 'done': 1,
+                             'failed': 0}
+
+
+def test_expired_lease_goes_to_another_worker(scratch):
+    queue = make_queue(scratch, lease_time=-1)
+    queue.add('url', {'url': 'a'})
+    first = queue.claim('w1')
+    second = queue.claim('w2')
+    assert second.id == first.id and second.attempts == 2
+    assert not queue.heartbeat(first)
+    assert not queue.complete(first)
+    assert queue.complete(second)
+
+
+def test_worker_crawls_and_completes_tasks(scratch):
+    queue = make_queue(scratch)
+    queue.add('url', {'url': CITES_URL})
+    pages = SyntheticPages(total=25)
+    run_worker(make_options(count=30), make_querier(pages), queue,
+               ScholarAttentionQueue('../parked.json'))
+    assert queue.stats()['done'] == 1
+    with open(str(scratch / 'results' / '4412725301034017472.json')) as res:
+        assert len(json.load(res)) == 25
+
+
+def test_worker_fails_task_whose_page_could_not_be_fetched(scratch):
+    queue = make_queue(scratch, max_attempts=2)
+    queue.add('url', {'url': CITES_URL})
+    pages = SyntheticPages(total=50, broken=[10])
+    run_worker(make_options(count=50), make_querier(pages), queue,
+               ScholarAttentionQueue('../parked.json'))
+    # Both attempts stopped at the broken page; neither completed it.
+    assert queue.stats()['failed'] == 1
+    assert queue.stats()['done'] == 0
+    assert pages.fetched == [0, 0]
+
+
+def test_worker_stops_when_lease_is_lost(scratch):
+    queue = make_queue(scratch)
+    queue.add('url', {'url': CITES_URL})
+    queue.heartbeat = lambda task: False
+    pages = SyntheticPages(total=50)
+    run_worker(make_options(count=50), make_querier(pages), queue,
+               ScholarAttentionQueue('../parked.json'))
+    assert pages.fetched == [0]
+    assert queue.stats()['leased'] == 1